@@ -0,0 +1,135 @@
+"""
+Провайдеры тарифов доставки.
+
+- TariffTableRateProvider (по умолчанию) — локальная тарифная сетка СДЭК (cart/services.py),
+  без сетевых запросов.
+- CdekRateProvider — калькулятор api.cdek.ru/v2/calculator/tariff. Запросы по группам товаров
+  корзины (по складам) выполняются параллельно через общий пул соединений requests.Session;
+  ответы кешируются по маршруту и весу, округленному вверх до CDEK_WEIGHT_STEP граммов.
+  Если API не ответил за CDEK_TIMEOUT или вернул ошибку, стоимость группы берется из
+  локальной сетки, поэтому медленный API не задерживает оформление заказа дольше таймаута.
+
+Провайдер задается настройкой SHIPPING_RATE_PROVIDER (путь к классу).
+"""
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor, wait
+from decimal import Decimal
+from functools import lru_cache
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+from requests.adapters import HTTPAdapter
+
+from .services import normalize_city, quote_many, weight_grams
+
+logger = logging.getLogger('django')
+
+CDEK_TOKEN_KEY = "cdek_access_token"
+CDEK_RATE_KEY_PREFIX = "cdek_rate"
+CDEK_RATE_TIMEOUT = 6 * 60 * 60
+# Тарифы СДЭК «склад-склад» и «склад-дверь»
+CDEK_TARIFF_CODES = {'pickup': 136, 'courier': 137}
+
+
+class TariffTableRateProvider:
+    """Стоимость по локальной тарифной сетке СДЭК."""
+
+    def quote_many(self, warehouse_cities, weights, delivery_city, delivery_method):
+        return quote_many(warehouse_cities, weights, delivery_city, delivery_method)
+
+
+class CdekRateProvider:
+    """Стоимость по API калькулятора СДЭК с откатом на локальную сетку."""
+
+    def __init__(self, base_url=None, client_id=None, client_secret=None, timeout=None, max_workers=None,
+                 weight_step=None):
+        self.base_url = (base_url or settings.CDEK_API_URL).rstrip('/')
+        self.client_id = client_id if client_id is not None else settings.CDEK_CLIENT_ID
+        self.client_secret = client_secret if client_secret is not None else settings.CDEK_CLIENT_SECRET
+        self.timeout = timeout or settings.CDEK_TIMEOUT
+        self.weight_step = weight_step or settings.CDEK_WEIGHT_STEP
+        max_workers = max_workers or settings.CDEK_MAX_WORKERS
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='cdek-rates')
+        self.fallback = TariffTableRateProvider()
+
+    def _token(self):
+        token = cache.get(CDEK_TOKEN_KEY)
+        if token is None:
+            response = self.session.post(f"{self.base_url}/v2/oauth/token", data={
+                'grant_type': 'client_credentials',
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+            }, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
+            token = data['access_token']
+            # токен обновляется заранее, чтобы не отправить запрос с истекающим
+            cache.set(CDEK_TOKEN_KEY, token, max(int(data.get('expires_in', 3600)) - 60, 1))
+        return token
+
+    def _bucket(self, weight):
+        """Вес в граммах, округленный вверх до шага тарификации."""
+        return max(math.ceil(weight_grams(weight) / self.weight_step), 1) * self.weight_step
+
+    def _rate_key(self, warehouse_city, delivery_city, method, grams):
+        # в ключе — нормализованные названия, чтобы "Москва" и "г. москва" делили один тариф
+        route = f"{normalize_city(warehouse_city)}:{normalize_city(delivery_city)}"
+        return f"{CDEK_RATE_KEY_PREFIX}:{method}:{grams}:{route}"
+
+    def _fetch_rate(self, warehouse_city, delivery_city, method, grams):
+        response = self.session.post(f"{self.base_url}/v2/calculator/tariff", json={
+            'tariff_code': CDEK_TARIFF_CODES[method],
+            'from_location': {'city': warehouse_city},
+            'to_location': {'city': delivery_city},
+            'packages': [{'weight': grams}],
+        }, headers={'Authorization': f"Bearer {self._token()}"}, timeout=self.timeout)
+        response.raise_for_status()
+        cost = Decimal(str(response.json()['total_sum']))
+        cache.set(self._rate_key(warehouse_city, delivery_city, method, grams), cost, CDEK_RATE_TIMEOUT)
+        return cost
+
+    def quote_many(self, warehouse_cities, weights, delivery_city, delivery_method):
+        warehouse_cities, weights = list(warehouse_cities), list(weights)
+        # в API уходят названия как их ввели (без пробелов по краям): нормализованная форма — только ключ кеша
+        delivery_city = delivery_city.strip()
+        method = 'courier' if delivery_method == 'Курьером' else 'pickup'
+        routes = [(city.strip(), delivery_city, method, self._bucket(weight))
+                  for city, weight in zip(warehouse_cities, weights)]
+
+        cached = cache.get_many([self._rate_key(*route) for route in routes])
+        costs = [cached.get(self._rate_key(*route)) for route in routes]
+        futures = {i: self.executor.submit(self._fetch_rate, *route)
+                   for i, route in enumerate(routes) if costs[i] is None}
+        # общий срок на все группы: незавершенные запросы досчитываются в фоне и попадут в кеш
+        wait(futures.values(), timeout=self.timeout)
+
+        fallback = []
+        for i, future in futures.items():
+            if future.done() and future.exception() is None:
+                costs[i] = future.result()
+            else:
+                error = future.exception() if future.done() else 'timeout'
+                logger.warning(f"CDEK rate for {routes[i][0]} -> {delivery_city} unavailable: {error}")
+                fallback.append(i)
+        if fallback:
+            fallback_costs = self.fallback.quote_many([warehouse_cities[i] for i in fallback],
+                                                      [weights[i] for i in fallback],
+                                                      delivery_city, delivery_method)
+            for i, cost in zip(fallback, fallback_costs):
+                costs[i] = cost
+        return costs
+
+
+@lru_cache(maxsize=None)
+def get_rate_provider():
+    provider_path = getattr(settings, 'SHIPPING_RATE_PROVIDER', None)
+    if provider_path:
+        return import_string(provider_path)()
+    return TariffTableRateProvider()
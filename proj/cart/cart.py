@@ -1,59 +1,238 @@
+"""
+Корзина покупателя.
+
+Позиции хранятся в хранилище корзины:
+
+- при Redis-кеше — в hash'е Redis `cart:<id>` (поле — id товара), рядом с ним hash
+  `cart:<id>:summary` с количеством единиц и суммой в копейках, которые меняются вместе
+  с позициями в одной транзакции (WATCH/MULTI). Id корзины кладется в сессию при первом
+  добавлении товара;
+- иначе (LocMemCache в тестах и локально) — словарем в сессии, как раньше.
+
+Счетчик в шапке сайта (`cart|length`) читает только итоги и не обращается к БД;
+при обходе корзины товары вместе с магазинами загружаются одним запросом. Страница корзины
+и оформление заказа сверяют корзину с каталогом (Cart.revalidate) тем же одним запросом.
+"""
+import json
+import uuid
 from decimal import Decimal
+from functools import lru_cache
+
+from django.conf import settings
 
 from products.models import Product
 
+SESSION_KEY = 'session_key'
+CART_ID_SESSION_KEY = 'cart_id'
+CART_TTL = 30 * 24 * 60 * 60
+
+
+def _kopecks(item):
+    return int(Decimal(item['price']) * 100) * item['qty'] if item else 0
+
+
+class SessionCartStore:
+    """Позиции корзины словарем {id товара: позиция} в сессии."""
+
+    def __init__(self, session):
+        self.session = session
+
+    def items(self):
+        return self.session.get(SESSION_KEY, {})
+
+    def get(self, product_id):
+        return self.items().get(product_id)
+
+    def save(self, product_id, item):
+        self.session[SESSION_KEY] = {**self.items(), product_id: item}
+
+    def delete(self, product_id):
+        items = self.items()
+        if product_id in items:
+            self.session[SESSION_KEY] = {pk: item for pk, item in items.items() if pk != product_id}
+
+    def count(self):
+        return sum(item['qty'] for item in self.items().values())
+
+    def total(self):
+        return sum((Decimal(item['price']) * item['qty'] for item in self.items().values()), Decimal(0))
+
+
+class RedisCartStore:
+    """Позиции корзины в hash'е Redis с итогами в отдельном hash'е."""
+
+    def __init__(self, client, session):
+        self.client = client
+        self.session = session
+
+    @property
+    def cart_id(self):
+        return self.session.get(CART_ID_SESSION_KEY)
+
+    def _keys(self, create=False):
+        if self.cart_id is None:
+            if not create:
+                return None, None
+            self.session[CART_ID_SESSION_KEY] = uuid.uuid4().hex
+        key = f"cart:{self.cart_id}"
+        return key, f"{key}:summary"
+
+    def items(self):
+        key, _ = self._keys()
+        if key is None:
+            return {}
+        return {pk.decode(): json.loads(item) for pk, item in self.client.hgetall(key).items()}
+
+    def get(self, product_id):
+        key, _ = self._keys()
+        item = self.client.hget(key, product_id) if key else None
+        return json.loads(item) if item else None
+
+    def _write(self, product_id, item):
+        """
+        Меняет позицию и итоги одной транзакцией MULTI/EXEC. Прежняя позиция читается под WATCH:
+        если ее успел изменить параллельный запрос, транзакция повторяется с новым значением.
+        """
+        key, summary_key = self._keys(create=True)
+
+        def write(pipe):
+            previous = pipe.hget(key, product_id)
+            previous = json.loads(previous) if previous else None
+            pipe.multi()
+            if item is None and previous is None:
+                return
+            if item is None:
+                pipe.hdel(key, product_id)
+            else:
+                pipe.hset(key, product_id, json.dumps(item))
+            pipe.hincrby(summary_key, 'qty', (item['qty'] if item else 0) - (previous['qty'] if previous else 0))
+            pipe.hincrby(summary_key, 'total', _kopecks(item) - _kopecks(previous))
+            pipe.expire(key, CART_TTL)
+            pipe.expire(summary_key, CART_TTL)
+
+        self.client.transaction(write, key)
+
+    def save(self, product_id, item):
+        self._write(product_id, item)
+
+    def delete(self, product_id):
+        if self.cart_id is not None:
+            self._write(product_id, None)
+
+    def _summary(self, field):
+        _, summary_key = self._keys()
+        return int(self.client.hget(summary_key, field) or 0) if summary_key else 0
+
+    def count(self):
+        return self._summary('qty')
+
+    def total(self):
+        return Decimal(self._summary('total')) / 100
+
+
+@lru_cache(maxsize=None)
+def _redis_client():
+    cache_settings = settings.CACHES["default"]
+    if cache_settings["BACKEND"] != "django.core.cache.backends.redis.RedisCache":
+        return None
+    import redis
+    return redis.Redis.from_url(cache_settings["LOCATION"])
+
+
+def get_cart_store(session):
+    client = _redis_client()
+    if client is None:
+        return SessionCartStore(session)
+    return RedisCartStore(client, session)
+
 
 class Cart():
 
     def __init__(self, request) -> None:
 
         self.session = request.session
+        self.store = get_cart_store(self.session)
 
-        cart = self.session.get('session_key')
-
-        if not cart:
-            cart = self.session['session_key'] = {}
+    @property
+    def cart(self):
+        return self.store.items()
 
-        self.cart = cart
+    def __contains__(self, product_id):
+        return self.store.get(str(product_id)) is not None
 
     def __len__(self):
-        return sum(item['qty'] for item in self.cart.values())
+        return self.store.count()
 
     def __iter__(self):
-        product_ids = self.cart.keys()
-        products = Product.objects.filter(pk__in=product_ids)
-        cart = self.cart.copy()
-
-        for product in products:
-            cart[str(product.pk)]['product'] = product
-
-        for item in cart.values():
-            item['price'] = Decimal(item['price'])
-            item['total'] = item['price'] * item['qty']
-            yield item
+        cart = self.store.items()
+        # товары вместе с магазинами одним запросом
+        products = Product.objects.select_related('shop').in_bulk([int(pk) for pk in cart])
+
+        for product_id, item in cart.items():
+            product = products.get(int(product_id))
+            if product is None:
+                continue
+            yield self._line(item, product)
+
+    def revalidate(self):
+        """
+        Сверяет корзину с каталогом одним запросом: обновляет цены, урезает количество до остатка
+        и убирает товары, которых больше нет в продаже. Возвращает (позиции, изменения);
+        позиции — как при обходе корзины, изменения — словари с ключами product, kind
+        ('price', 'quantity' или 'out_of_stock'), old и new.
+        """
+        cart = self.store.items()
+        products = Product.objects.select_related('shop').in_bulk([int(pk) for pk in cart])
+        items, changes = [], []
+
+        for product_id, item in cart.items():
+            product = products.get(int(product_id))
+            if product is None or not product.show:
+                self.store.delete(product_id)
+                if product is not None:
+                    changes.append({'product': product, 'kind': 'out_of_stock', 'old': item['qty'], 'new': 0})
+                continue
+
+            if product.items_left is not None and product.items_left < 1:
+                self.store.delete(product_id)
+                changes.append({'product': product, 'kind': 'out_of_stock', 'old': item['qty'], 'new': 0})
+                continue
+
+            updated = dict(item)
+            if item['price'] != str(product.price):
+                updated['price'] = str(product.price)
+                changes.append({'product': product, 'kind': 'price',
+                                'old': Decimal(item['price']), 'new': Decimal(updated['price'])})
+            if product.items_left is not None and item['qty'] > product.items_left:
+                updated['qty'] = product.items_left
+                changes.append({'product': product, 'kind': 'quantity', 'old': item['qty'], 'new': updated['qty']})
+            if updated != item:
+                self.store.save(product_id, updated)
+
+            items.append(self._line(updated, product))
+        return items, changes
+
+    @staticmethod
+    def _line(item, product):
+        """Позиция для вывода; сохраненная в хранилище позиция не меняется."""
+        price = Decimal(item['price'])
+        return {**item, 'product': product, 'price': price, 'total': price * item['qty']}
 
     def add(self, product, quantity):
 
         product_id = str(product.pk)
-        shop_slug = product.shop.slug
 
-        if product_id not in self.cart:
-            self.cart[product_id] = {'qty': quantity, 'price': str(product.price), 'shop_slug': shop_slug, }
-            self.cart[product_id]['qty'] = quantity
-
-        self.session.modified = True
+        if self.store.get(product_id) is None:
+            self.store.save(product_id, {'qty': quantity, 'price': str(product.price), 'shop_slug': product.shop.slug})
 
     def delete(self, product):
-        product_id = str(product)
-        if product_id in self.cart:
-            del self.cart[product_id]
-            self.session.modified = True
+        self.store.delete(str(product))
 
     def update(self, product, quantity):
         product_id = str(product)
-        if product_id in self.cart:
-            self.cart[product_id]['qty'] = quantity
-            self.session.modified = True
+        item = self.store.get(product_id)
+        if item is not None:
+            self.store.save(product_id, {**item, 'qty': quantity})
 
     def get_total_price(self):
-        return sum(Decimal(item['price']) * item['qty'] for item in self.cart.values())
+        return self.store.total()
@@ -0,0 +1,109 @@
+"""
+Оформление заказа.
+
+Адрес, заказ, все его позиции и запрос на оплату (PaymentOutbox) записываются одной короткой
+транзакцией; платежный шлюз вызывается уже после ее фиксации, поэтому сетевой запрос к YooKassa
+не держит блокировки БД. Товары заказа резервируются в той же транзакции (cart/stock.py):
+если какого-то товара уже не хватает, заказ не создается (OutOfStock). Если процесс упадет
+между транзакцией и вызовом шлюза, запрос повторит задача process_payment_outbox с тем же
+ключом идемпотентности.
+"""
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from yookassa import Payment
+from yookassa.domain.exceptions import BadRequestError, ForbiddenError
+
+from products.recommendations import forget_purchased_product_ids
+from .models import ShippingAddress, Order, OrderItem, PaymentOutbox
+from .stock import reserve_stock, release_stock
+
+logger = logging.getLogger('django')
+
+# Шлюз отклонил сам запрос на оплату: повтор с тем же ключом ничего не изменит
+PAYMENT_REJECTED_ERRORS = (BadRequestError, ForbiddenError)
+
+
+def get_shipping_address(user, fields):
+    """Адрес доставки по отпечатку; новый адрес создается один раз (уникальный индекс по отпечатку)."""
+    user_id = user.pk if user is not None else None
+    address, _ = ShippingAddress.objects.get_or_create(
+        fingerprint=ShippingAddress.make_fingerprint(user_id, **fields),
+        defaults={**fields, 'user': user},
+    )
+    return address
+
+
+def place_order(*, user, shop, items, customer, delivery_method, address, return_url):
+    """
+    Создает заказ магазина shop с позициями items (product, qty, price) и запрос на оплату.
+    customer — данные покупателя из формы, address — поля адреса доставки. Возвращает PaymentOutbox;
+    если товара не хватает, транзакция откатывается и выбрасывается OutOfStock.
+    """
+    amount = sum(item['price'] * item['qty'] for item in items)
+    with transaction.atomic():
+        order = Order.objects.create(
+            user=user,
+            shop=shop,
+            shipping_address=get_shipping_address(user, address),
+            delivery_method=delivery_method,
+            amount=amount,
+            **customer,
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=item['product'], price=item['price'], quantity=item['qty'])
+            for item in items
+        ])
+        reserve_stock(order, items)
+        outbox = PaymentOutbox.objects.create(order=order, payload={
+            "amount": {
+                "value": str(amount),
+                "currency": 'RUB'
+            },
+            "confirmation": {
+                "type": "redirect",
+                "return_url": return_url,
+            },
+            "capture": True,
+            "test": True,
+            "description": f'Оплата заказа {order.pk} из магазина {shop.title} на платформе AirsoftPlace',
+            "metadata": {  # добавляем метаданные с ID заказа
+                "order_id": order.pk
+            },
+        })
+    if user is not None:
+        # bulk_create не вызывает post_save у позиций заказа
+        forget_purchased_product_ids(user.pk)
+    return outbox
+
+
+def send_payment(outbox, retry=False):
+    """
+    Создает платеж в YooKassa вне транзакции и возвращает ссылку на оплату или None.
+    При оформлении заказа ошибка шлюза снимает резерв и удаляет заказ: покупатель видит ошибку
+    и может оформить заказ заново. При повторе из process_payment_outbox (retry=True) запрос
+    остается в ожидании до следующего запуска задачи, а заказ удаляется, только если шлюз отклонил
+    платеж или исчерпаны попытки (PAYMENT_OUTBOX_MAX_ATTEMPTS).
+    """
+    PaymentOutbox.objects.filter(pk=outbox.pk).update(attempts=F('attempts') + 1)
+    try:
+        payment = Payment.create(outbox.payload, str(outbox.idempotence_key))
+    except Exception as e:
+        logger.error(f"Error creating payment for order {outbox.order_id}: {str(e)}")
+        outbox.refresh_from_db(fields=['attempts'])
+        if (retry and not isinstance(e, PAYMENT_REJECTED_ERRORS)
+                and outbox.attempts < settings.PAYMENT_OUTBOX_MAX_ATTEMPTS):
+            return None
+        # Удаляем заказ, если платеж не создан, и возвращаем его товары на склад
+        with transaction.atomic():
+            release_stock(outbox.order_id)
+            Order.objects.filter(pk=outbox.order_id).delete()
+        return None
+
+    confirmation_url = payment.confirmation.confirmation_url
+    with transaction.atomic():
+        Order.objects.filter(pk=outbox.order_id).update(payment_id=payment.id)
+        PaymentOutbox.objects.filter(pk=outbox.pk).update(status='sent', confirmation_url=confirmation_url)
+    return confirmation_url
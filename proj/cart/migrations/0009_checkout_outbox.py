@@ -0,0 +1,60 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:47
+
+import django.db.models.deletion
+import hashlib
+import uuid
+from django.db import migrations, models
+
+ADDRESS_FIELDS = ('country', 'region', 'city', 'street', 'house', 'flat', 'entrance', 'floor', 'intercom')
+
+
+def fill_fingerprints(apps, schema_editor):
+    # повторяющиеся адреса объединяются: заказы переносятся на первый адрес, дубликаты удаляются
+    ShippingAddress = apps.get_model('cart', 'ShippingAddress')
+    Order = apps.get_model('cart', 'Order')
+    seen = {}
+    for address in ShippingAddress.objects.order_by('pk'):
+        parts = [str(address.user_id or '')] + [str(getattr(address, name) or '').strip().lower()
+                                                for name in ADDRESS_FIELDS]
+        fingerprint = hashlib.sha256('\x1f'.join(parts).encode()).hexdigest()
+        if fingerprint in seen:
+            Order.objects.filter(shipping_address_id=address.pk).update(shipping_address_id=seen[fingerprint])
+            address.delete()
+            continue
+        seen[fingerprint] = address.pk
+        address.fingerprint = fingerprint
+        address.save(update_fields=['fingerprint'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0008_alter_orderitem_order_alter_orderitem_price_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shippingaddress',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True, verbose_name='Отпечаток адреса'),
+        ),
+        migrations.RunPython(fill_fingerprints, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='PaymentOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('idempotence_key', models.UUIDField(default=uuid.uuid4, unique=True, verbose_name='Ключ идемпотентности')),
+                ('payload', models.JSONField(verbose_name='Запрос к платежному шлюзу')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает отправки'), ('sent', 'Платеж создан')], db_index=True, default='pending', max_length=20, verbose_name='Статус')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')),
+                ('confirmation_url', models.CharField(blank=True, max_length=500, null=True, verbose_name='Ссылка на оплату')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Время создания')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Время обновления')),
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='payment_outbox', to='cart.order', verbose_name='Заказ')),
+            ],
+            options={
+                'verbose_name': 'Запрос на оплату',
+                'verbose_name_plural': 'Запросы на оплату',
+            },
+        ),
+    ]
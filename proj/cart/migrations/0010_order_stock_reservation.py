@@ -0,0 +1,37 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:50
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_paid_orders_committed(apps, schema_editor):
+    # товары оплаченных заказов уже списаны прежней задачей decrease_product_quantity
+    Order = apps.get_model('cart', 'Order')
+    Order.objects.filter(paid=True).update(stock_status='committed')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0009_checkout_outbox'),
+        ('products', '0019_recently_viewed'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='stock_reserved_until',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Резерв товаров до'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='stock_status',
+            field=models.CharField(choices=[('none', 'Не списаны'), ('reserved', 'Зарезервированы'), ('committed', 'Списаны'), ('released', 'Возвращены на склад')], default='none', max_length=20, verbose_name='Товары на складе'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['stock_status', 'stock_reserved_until'], name='cart_order_stock_s_743db8_idx'),
+        ),
+        migrations.RunPython(mark_paid_orders_committed, migrations.RunPython.noop),
+    ]
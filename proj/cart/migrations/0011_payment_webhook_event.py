@@ -0,0 +1,35 @@
+# Generated by Django 5.0.2 on 2026-10-18 12:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0010_order_stock_reservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentWebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payment_id', models.CharField(max_length=100, verbose_name='ID платежа')),
+                ('event', models.CharField(max_length=50, verbose_name='Событие')),
+                ('payload', models.JSONField(verbose_name='Уведомление')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает обработки'), ('processed', 'Обработано')], db_index=True, default='pending', max_length=20, verbose_name='Статус')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Время получения')),
+                ('processed', models.DateTimeField(blank=True, null=True, verbose_name='Время обработки')),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payment_events', to='cart.order', verbose_name='Заказ')),
+            ],
+            options={
+                'verbose_name': 'Уведомление об оплате',
+                'verbose_name_plural': 'Уведомления об оплате',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='paymentwebhookevent',
+            constraint=models.UniqueConstraint(fields=('payment_id', 'event'), name='unique_payment_event'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.0.2 on 2026-10-18 12:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0011_payment_webhook_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentwebhookevent',
+            name='body',
+            field=models.TextField(blank=True, verbose_name='Тело запроса'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='payment_id',
+            field=models.CharField(blank=True, db_index=True, max_length=100, null=True, verbose_name='ID платежа'),
+        ),
+        migrations.AlterField(
+            model_name='paymentwebhookevent',
+            name='event',
+            field=models.CharField(blank=True, max_length=50, null=True, verbose_name='Событие'),
+        ),
+        migrations.AlterField(
+            model_name='paymentwebhookevent',
+            name='payload',
+            field=models.JSONField(blank=True, null=True, verbose_name='Уведомление'),
+        ),
+        migrations.AlterField(
+            model_name='paymentwebhookevent',
+            name='payment_id',
+            field=models.CharField(blank=True, max_length=100, null=True, verbose_name='ID платежа'),
+        ),
+        migrations.AlterField(
+            model_name='paymentwebhookevent',
+            name='status',
+            field=models.CharField(choices=[('received', 'Получено'), ('pending', 'Ожидает обработки'), ('processed', 'Обработано'), ('duplicate', 'Повтор'), ('rejected', 'Отклонено')], db_index=True, default='pending', max_length=20, verbose_name='Статус'),
+        ),
+    ]
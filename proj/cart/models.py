@@ -1,3 +1,6 @@
+import hashlib
+import uuid
+
 from django.db import models
 from phonenumber_field.modelfields import PhoneNumberField
 from products.models import Shop, Product
@@ -22,6 +25,21 @@ class ShippingAddress(models.Model):
     intercom = models.CharField(blank=True, null=True, max_length=150, verbose_name='Домофон')
     user = models.ForeignKey(
         User, on_delete=models.SET_NULL, blank=True, null=True, verbose_name='Пользователь')
+    # хеш пользователя и полей адреса: повторный адрес находится по уникальному индексу, а не по 10 колонкам
+    fingerprint = models.CharField('Отпечаток адреса', max_length=64, unique=True, blank=True, null=True,
+                                   editable=False)
+
+    ADDRESS_FIELDS = ('country', 'region', 'city', 'street', 'house', 'flat', 'entrance', 'floor', 'intercom')
+
+    @classmethod
+    def make_fingerprint(cls, user_id, **fields):
+        parts = [str(user_id or '')] + [str(fields.get(name) or '').strip().lower() for name in cls.ADDRESS_FIELDS]
+        return hashlib.sha256('\x1f'.join(parts).encode()).hexdigest()
+
+    def save(self, *args, **kwargs):
+        self.fingerprint = self.make_fingerprint(
+            self.user_id, **{name: getattr(self, name) for name in self.ADDRESS_FIELDS})
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return ("Адрес " + str(self.pk) + ", пользователь " + str(self.user) + ", " + str(self.country) + ", " +
@@ -49,6 +67,12 @@ class Order(models.Model):
         ('pick-up_point', 'Пункт выдачи '),
         ('by_courier', 'Курьером')
     )
+    STOCK_STATUS_OPTIONS = (
+        ('none', 'Не списаны'),
+        ('reserved', 'Зарезервированы'),
+        ('committed', 'Списаны'),
+        ('released', 'Возвращены на склад'),
+    )
     shop = models.ForeignKey(
         Shop,
         related_name='orders',
@@ -81,7 +105,11 @@ class Order(models.Model):
     created = models.DateTimeField(auto_now_add=True, verbose_name='Время создания')
     updated = models.DateTimeField(auto_now=True, verbose_name='Время обновления')
     paid = models.BooleanField(default=False, verbose_name='Оплачен')
-    payment_id = models.CharField(max_length=100, blank=True, null=True, verbose_name='ID платежа')
+    payment_id = models.CharField(max_length=100, blank=True, null=True, db_index=True, verbose_name='ID платежа')
+    # резерв остатков товаров заказа (cart/stock.py)
+    stock_status = models.CharField(max_length=20, choices=STOCK_STATUS_OPTIONS, default='none',
+                                    verbose_name='Товары на складе')
+    stock_reserved_until = models.DateTimeField(blank=True, null=True, verbose_name='Резерв товаров до')
 
     class Meta:
         verbose_name = "Заказ"
@@ -89,6 +117,7 @@ class Order(models.Model):
         ordering = ['-created']
         indexes = [
             models.Index(fields=['-created']),
+            models.Index(fields=['stock_status', 'stock_reserved_until']),
         ]
         constraints = [
             models.CheckConstraint(check=models.Q(
@@ -149,6 +178,71 @@ class OrderItem(models.Model):
         return OrderItem.objects.aggregate(average_price=models.Avg('price'))['average_price']
 
 
+class PaymentOutbox(models.Model):
+    """
+    Запрос на создание платежа, записанный в одной транзакции с заказом (см. cart/checkout.py).
+    Шлюз вызывается после фиксации транзакции; зависшие записи повторяет задача process_payment_outbox
+    с тем же ключом идемпотентности.
+    """
+    STATUS_OPTIONS = (
+        ('pending', 'Ожидает отправки'),
+        ('sent', 'Платеж создан'),
+    )
+    order = models.OneToOneField(
+        Order, on_delete=models.CASCADE, related_name='payment_outbox', verbose_name='Заказ')
+    idempotence_key = models.UUIDField(default=uuid.uuid4, unique=True, verbose_name='Ключ идемпотентности')
+    payload = models.JSONField(verbose_name='Запрос к платежному шлюзу')
+    status = models.CharField(max_length=20, choices=STATUS_OPTIONS, default='pending', db_index=True,
+                              verbose_name='Статус')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')
+    confirmation_url = models.CharField(max_length=500, blank=True, null=True, verbose_name='Ссылка на оплату')
+    created = models.DateTimeField(auto_now_add=True, verbose_name='Время создания')
+    updated = models.DateTimeField(auto_now=True, verbose_name='Время обновления')
+
+    class Meta:
+        verbose_name = "Запрос на оплату"
+        verbose_name_plural = "Запросы на оплату"
+
+    def __str__(self):
+        return "Запрос на оплату заказа " + str(self.order_id)
+
+
+class PaymentWebhookEvent(models.Model):
+    """
+    Входящий ящик уведомлений YooKassa (см. cart/payments.py). Уведомление уникально по платежу
+    и событию: повторная доставка не создает записи и не запускает обработку заново.
+    В режиме быстрого ответа вебхук сохраняет только тело запроса (статус «Получено»),
+    платеж и событие заполняются при разборе ящика.
+    """
+    STATUS_OPTIONS = (
+        ('received', 'Получено'),
+        ('pending', 'Ожидает обработки'),
+        ('processed', 'Обработано'),
+        ('duplicate', 'Повтор'),
+        ('rejected', 'Отклонено'),
+    )
+    payment_id = models.CharField(max_length=100, blank=True, null=True, verbose_name='ID платежа')
+    event = models.CharField(max_length=50, blank=True, null=True, verbose_name='Событие')
+    order = models.ForeignKey(
+        Order, on_delete=models.SET_NULL, blank=True, null=True, related_name='payment_events', verbose_name='Заказ')
+    body = models.TextField(blank=True, verbose_name='Тело запроса')
+    payload = models.JSONField(blank=True, null=True, verbose_name='Уведомление')
+    status = models.CharField(max_length=20, choices=STATUS_OPTIONS, default='pending', db_index=True,
+                              verbose_name='Статус')
+    created = models.DateTimeField(auto_now_add=True, verbose_name='Время получения')
+    processed = models.DateTimeField(blank=True, null=True, verbose_name='Время обработки')
+
+    class Meta:
+        verbose_name = "Уведомление об оплате"
+        verbose_name_plural = "Уведомления об оплате"
+        constraints = [
+            models.UniqueConstraint(fields=['payment_id', 'event'], name='unique_payment_event'),
+        ]
+
+    def __str__(self):
+        return f"Уведомление {self.event} платежа {self.payment_id}"
+
+
 class StoreSalesReport(models.Model):
     shop = models.ForeignKey(
         Shop,
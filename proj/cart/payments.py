@@ -0,0 +1,152 @@
+"""
+Обработка уведомлений YooKassa об оплате.
+
+Вебхук записывает уведомление во входящий ящик PaymentWebhookEvent, уникальный по платежу
+и событию, поэтому повторные доставки одного уведомления отбрасываются. Задача
+process_payment_event выполняет все переходы заказа одной транзакцией: отметку об оплате,
+счетчики заказов товаров, списание резерва и отчет о продажах. Переход выполняется только
+для еще не оплаченного заказа, поэтому письма о заказе отправляются не более одного раза.
+
+В режиме быстрого ответа (YOOKASSA_WEBHOOK_FAST_ACK) вебхук только сохраняет тело запроса
+и сразу отвечает 200, а разбор уведомлений, поиск заказов и проверка сумм выполняются пачками
+в задаче drain_payment_webhook_inbox (parse_received_events).
+"""
+import calendar
+import json
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+from yookassa.domain.notification import WebhookNotificationEventType, WebhookNotificationFactory
+
+from products.services import increase_products_order_count
+from .models import Order, PaymentWebhookEvent, StoreSalesReport
+from .stock import commit_stock, release_stock
+
+
+def add_order_to_sales_report(order):
+    """Учитывает заказ в текущем месячном отчете магазина (вызывать в транзакции); повтор не учитывается."""
+    today = timezone.now().date()
+    report = StoreSalesReport.objects.filter(
+        shop=order.shop,
+        start_date__lte=today,
+        end_date__gte=today
+    ).select_for_update().first()
+
+    # Если нет активного отчета, создаем
+    if not report:
+        _, last_day = calendar.monthrange(today.year, today.month)
+        report = StoreSalesReport.objects.create(
+            shop=order.shop,
+            start_date=today.replace(day=1),
+            end_date=today.replace(day=last_day),
+            revenue=Decimal('0.00'),
+            products_performance={},
+            category_performance={}
+        )
+    elif report.orders.filter(pk=order.pk).exists():
+        return report
+
+    report.revenue += order.amount
+    report.orders.add(order)
+
+    # Продажи по товарам и категориям
+    products_perf = report.products_performance.copy()
+    category_perf = report.category_performance.copy()
+    for item in order.items.select_related('product').prefetch_related('product__category'):
+        if item.product is None:
+            continue
+        product_id = str(item.product.pk)
+        products_perf[product_id] = products_perf.get(product_id, 0) + item.quantity
+        for category in item.product.category.all():
+            category_perf[category.slug] = category_perf.get(category.slug, 0) + item.quantity
+    report.products_performance = products_perf
+    report.category_performance = category_perf
+
+    report.save()
+    return report
+
+
+def confirm_order_payment(order_id):
+    """
+    Оплата заказа подтверждена: заказ отмечается оплаченным и передается в сборку, товары
+    учитываются в статистике, резерв списывается, заказ попадает в отчет о продажах.
+    Возвращает True, если заказ оплачен этим вызовом, и False, если он уже был оплачен.
+    """
+    with transaction.atomic():
+        order = Order.objects.select_related('shop').select_for_update().get(pk=order_id)
+        if order.paid:
+            return False
+        order.paid = True
+        order.status = 'in_assembly'
+        order.save(update_fields=['paid', 'status', 'updated'])
+        increase_products_order_count(order.pk)
+        commit_stock(order.pk)
+        add_order_to_sales_report(order)
+        return True
+
+
+def cancel_order_payment(order_id):
+    """Платеж отменен: резерв возвращается на склад, неоплаченный заказ удаляется."""
+    with transaction.atomic():
+        order = Order.objects.select_for_update().filter(pk=order_id).first()
+        if order is None or order.paid:
+            return False
+        release_stock(order.pk)
+        order.delete()
+        return True
+
+
+PAYMENT_EVENTS = (WebhookNotificationEventType.PAYMENT_SUCCEEDED, WebhookNotificationEventType.PAYMENT_CANCELED)
+
+
+def _parse(body):
+    """Тело вебхука -> (уведомление JSON, событие, id платежа, сумма) или None, если оно не разбирается."""
+    try:
+        payload = json.loads(body)
+        notification = WebhookNotificationFactory().create(payload)
+        amount = getattr(getattr(notification.object, 'amount', None), 'value', None)
+        return payload, notification.event, notification.object.id, amount
+    except Exception:
+        return None
+
+
+def parse_received_events(batch_size):
+    """
+    Разбирает пачку сохраненных вебхуком уведомлений: заказы ищутся одним запросом по id платежей,
+    уже принятые уведомления (по платежу и событию) помечаются повторами, уведомления без заказа
+    или с неверной суммой отклоняются. Возвращает (число разобранных, id уведомлений к обработке).
+    """
+    with transaction.atomic():
+        batch = list(PaymentWebhookEvent.objects
+                     .select_for_update(skip_locked=True)
+                     .filter(status='received')
+                     .order_by('pk')[:batch_size])
+        parsed = {record.pk: _parse(record.body) for record in batch}
+        payment_ids = {notification[2] for notification in parsed.values() if notification}
+        orders = {order.payment_id: order for order in Order.objects.filter(payment_id__in=payment_ids)}
+        accepted = set(PaymentWebhookEvent.objects
+                       .filter(payment_id__in=payment_ids)
+                       .values_list('payment_id', 'event'))
+
+        ready = []
+        for record in batch:
+            notification = parsed[record.pk]
+            if notification is None:
+                record.status = 'rejected'
+                continue
+            record.payload, event, payment_id, amount = notification
+            order = orders.get(payment_id)
+            if (payment_id, event) in accepted:
+                record.status = 'duplicate'
+            elif event not in PAYMENT_EVENTS or order is None or (
+                    event == WebhookNotificationEventType.PAYMENT_SUCCEEDED
+                    and (amount is None or Decimal(amount) != order.amount)):
+                record.status = 'rejected'
+            else:
+                accepted.add((payment_id, event))
+                record.payment_id, record.event, record.order = payment_id, event, order
+                record.status = 'pending'
+                ready.append(record.pk)
+        PaymentWebhookEvent.objects.bulk_update(batch, ['payment_id', 'event', 'order', 'payload', 'status'])
+        return len(batch), ready
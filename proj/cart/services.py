@@ -1,4 +1,21 @@
-from decimal import Decimal
+"""
+Расчет стоимости доставки СДЭК по тарифной сетке.
+
+Сетка (CITY_ZONES, TARIFF_MATRIX, TARIFF_TABLE и особые города зон) при импорте компилируется
+в плотные таблицы numpy: для каждого класса города отправления, зоны назначения и способа
+доставки — базовая цена и цена лишнего килограмма. Классы городов отправления — это
+различные строки TARIFF_MATRIX после учета особых городов, поэтому их немного.
+
+Названия городов нормализуются (normalize_city): регистр, «ё»/«е», дефисы и пробелы,
+префиксы «г.» и «город». Вес округляется вверх до грамма, стоимость считается в целых
+тысячных рубля и кешируется в LRU по (склад, город доставки, способ, вес в граммах);
+quote_many считает стоимость для всех складов корзины одним векторным вычислением.
+"""
+import re
+from decimal import Decimal, ROUND_CEILING
+from functools import lru_cache
+
+import numpy as np
 
 CITY_ZONES = {
     # Зона 1
@@ -326,8 +343,23 @@ TARIFF_TABLE = {
 }
 
 
+CITY_PREFIX_RE = re.compile(r'^(?:город\s+|г\.\s*|г\s+)')
+CITY_SEPARATORS_RE = re.compile(r'[\s\-\u2010-\u2015]+')
+DELIVERY_METHODS = ('pickup', 'courier')
+QUOTE_CACHE_SIZE = 4096
+
+
+def normalize_city(city_name):
+    name = city_name.strip().lower().replace('ё', 'е')
+    name = CITY_PREFIX_RE.sub('', name)
+    return CITY_SEPARATORS_RE.sub(' ', name).strip()
+
+
+CITY_INDEX = {normalize_city(city): zone for city, zone in CITY_ZONES.items()}
+
+
 def get_city_zone(city_name):
-    return CITY_ZONES.get(city_name.strip().lower(), None)
+    return CITY_INDEX.get(normalize_city(city_name), None)
 
 
 def determine_tariff_zone(from_zone, to_zone, from_city, to_city):
@@ -359,37 +391,89 @@ def calculate_shipping_cost(tariff_zone, delivery_method, total_weight):
         return Decimal(base_price + (extra_kg * per_kg))
 
 
-# Функция Заглушка имитирующая запросы на https://api.cdek.ru/v2/calculator/tariff
-def get_cdek_shipping_cost(warehouse_city, delivery_city, group_weight, delivery_method):
-    # Определение зон
-    from_zone = get_city_zone(warehouse_city)
-    to_zone = get_city_zone(delivery_city)
-    if from_zone is None or to_zone is None:
-        return
+def _compile_tariffs():
+    """
+    Плотные таблицы сетки: ROUTE_PRICES[класс отправления, зона назначения, способ] = (база, за кг)
+    и CITY_ROWS — класс отправления каждого нормализованного города.
+    """
+    tariff_zones = list(TARIFF_TABLE)
+    prices = np.array([[TARIFF_TABLE[tariff_zone][method] for method in DELIVERY_METHODS]
+                       for tariff_zone in tariff_zones], dtype=np.int64)
+    to_zones = range(max(CITY_ZONES.values()) + 1)
+    rows, city_rows = {}, {}
+    for city, zone in CITY_ZONES.items():
+        # нулевая зона назначения не используется: на нее указывает тариф внутригородской доставки
+        row = (0,) + tuple(tariff_zones.index(determine_tariff_zone(zone, to_zone, city, None))
+                           for to_zone in to_zones[1:])
+        city_rows[normalize_city(city)] = rows.setdefault(row, len(rows))
+    route_prices = prices[np.array(list(rows), dtype=np.int64)]
+    return route_prices, prices[tariff_zones.index(0)], city_rows
+
+
+ROUTE_PRICES, SAME_CITY_PRICES, CITY_ROWS = _compile_tariffs()
+
+
+def _method_index(delivery_method):
+    return DELIVERY_METHODS.index('courier' if delivery_method == 'Курьером' else 'pickup')
+
 
+def weight_grams(weight):
+    """Вес в кг (Decimal, float, int) -> целые граммы, с округлением вверх."""
+    return int((Decimal(str(weight)) * 1000).to_integral_value(rounding=ROUND_CEILING))
+
+
+def _millirubles(base_price, per_kg, grams):
+    return base_price * 1000 + np.maximum(grams - 1000, 0) * per_kg
+
+
+@lru_cache(maxsize=QUOTE_CACHE_SIZE)
+def _quote(warehouse_city, delivery_city, method, grams):
+    row, to_zone = CITY_ROWS.get(warehouse_city), CITY_INDEX.get(delivery_city)
+    if row is None or to_zone is None:
+        return None
+    base_price, per_kg = SAME_CITY_PRICES[method] if warehouse_city == delivery_city \
+        else ROUTE_PRICES[row, to_zone, method]
+    return Decimal(int(_millirubles(base_price, per_kg, grams))).scaleb(-3)
+
+
+def quote(warehouse_city, delivery_city, weight, delivery_method):
+    """Стоимость доставки группы весом weight кг; None, если город не найден в сетке."""
+    return _quote(normalize_city(warehouse_city), normalize_city(delivery_city),
+                  _method_index(delivery_method), weight_grams(weight))
+
+
+def quote_many(warehouse_cities, weights, delivery_city, delivery_method):
+    """
+    Стоимость доставки групп товаров со складов warehouse_cities (вес групп — weights, в кг)
+    в город delivery_city одним векторным вычислением. Для неизвестных городов — None.
+    """
+    delivery_city = normalize_city(delivery_city)
+    to_zone = CITY_INDEX.get(delivery_city)
+    warehouses = [normalize_city(city) for city in warehouse_cities]
+    if to_zone is None or not warehouses:
+        return [None] * len(warehouses)
+    method = _method_index(delivery_method)
+    rows = np.array([CITY_ROWS.get(city, -1) for city in warehouses], dtype=np.int64)
+    grams = np.array([weight_grams(weight) for weight in weights], dtype=np.int64)
+    prices = ROUTE_PRICES[rows, to_zone, method]
+    same_city = np.array([city == delivery_city for city in warehouses])
+    prices[same_city] = SAME_CITY_PRICES[method]
+    costs = _millirubles(prices[:, 0], prices[:, 1], grams)
+    return [Decimal(int(cost)).scaleb(-3) if row >= 0 else None for row, cost in zip(rows, costs)]
+
+
+def product_shipping_weight(product):
+    """Объемный или фактический вес товара (больший из них) в кг; для товара без габаритов — 0."""
     try:
-        # Для внутригородских доставок
-        if warehouse_city == delivery_city:
-            tariff_zone = 0
-        else:
-            # Определение тарифной зоны
-            tariff_zone = determine_tariff_zone(
-                from_zone,
-                to_zone,
-                warehouse_city,
-                delivery_city
-            )
+        volumetric = product.shipping_width * product.shipping_length * product.shipping_height / 5000
+        return Decimal(weight_grams(max(volumetric, product.shipping_weight))).scaleb(-3)
     except Exception:
-        return
+        return Decimal(0)
 
+
+# Функция Заглушка имитирующая запросы на https://api.cdek.ru/v2/calculator/tariff
+def get_cdek_shipping_cost(warehouse_city, delivery_city, group_weight, delivery_method):
     try:
-        # Расчет стоимости доставки для группы
-        delivery_cost = calculate_shipping_cost(
-            tariff_zone,
-            delivery_method,
-            group_weight
-        )
+        return quote(warehouse_city, delivery_city, group_weight, delivery_method)
     except Exception:
         return
-
-    return Decimal(delivery_cost)
@@ -0,0 +1,60 @@
+"""
+Расчет стоимости доставки корзины магазина.
+
+Для расчета нужны только веса групп товаров по городам склада. Они зависят лишь от состава
+корзины, поэтому кешируются по хешу ее содержимого (id товаров магазина и их количества)
+в версии области каталога: повторные расчеты для другого города или способа доставки
+берут веса из кеша и считают стоимость провайдером тарифов (cart/carriers.py) без запросов к БД.
+При изменении товаров сигналы меняют версию каталога, и веса пересчитываются.
+"""
+import hashlib
+from decimal import Decimal
+
+from django.core.cache import cache
+
+from products.models import Product
+from products.utils import CATALOG_SCOPE, versioned_key
+from .carriers import get_rate_provider
+from .services import product_shipping_weight
+
+SHIPPING_GROUPS_TIMEOUT = 60 * 60
+
+
+def cart_contents_hash(cart_items):
+    """Хеш состава позиций корзины {id товара: позиция}, не зависящий от порядка позиций."""
+    contents = ",".join(f"{pk}:{item['qty']}" for pk, item in sorted(cart_items.items(), key=lambda i: int(i[0])))
+    return hashlib.sha1(contents.encode()).hexdigest()
+
+
+def _load_shipping_groups(product_ids):
+    groups = {}
+    products = Product.objects.filter(pk__in=product_ids).only(
+        'warehouse_city', 'shipping_width', 'shipping_length', 'shipping_height', 'shipping_weight')
+    for product in products:
+        groups[product.warehouse_city] = (groups.get(product.warehouse_city, Decimal('0.00'))
+                                          + product_shipping_weight(product))
+    return groups
+
+
+def get_shipping_groups(cart, shop_slug):
+    """Объемный вес товаров корзины магазина shop_slug по городам склада: {город склада: вес в кг}."""
+    items = {pk: item for pk, item in cart.cart.items() if item.get('shop_slug') == shop_slug}
+    if not items:
+        return {}
+    key = versioned_key(f"shipping_groups:{cart_contents_hash(items)}", CATALOG_SCOPE)
+    groups = cache.get(key)
+    if groups is None:
+        groups = _load_shipping_groups([int(pk) for pk in items])
+        cache.set(key, groups, SHIPPING_GROUPS_TIMEOUT)
+    return groups
+
+
+def quote_cart(cart, shop_slug, delivery_city, delivery_method):
+    """Стоимость доставки товаров корзины магазина shop_slug; None, если ее нельзя рассчитать."""
+    groups = get_shipping_groups(cart, shop_slug)
+    if not groups:
+        return None
+    costs = get_rate_provider().quote_many(groups.keys(), groups.values(), delivery_city, delivery_method)
+    if None in costs:
+        return None
+    return sum(costs, Decimal('0.00'))
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from products.recommendations import forget_purchased_product_ids
+from .models import OrderItem
+
+
+@receiver(post_save, sender=OrderItem)
+def reset_purchases_on_order_item_create(sender, instance, created, **kwargs):
+    # новая покупка меняет отпечаток истории пользователя — рекомендации пересчитаются
+    if created and instance.order_id and instance.order.user_id:
+        forget_purchased_product_ids(instance.order.user_id)
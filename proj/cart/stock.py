@@ -0,0 +1,131 @@
+"""
+Резервирование остатков товаров.
+
+Остаток (Product.items_left) уменьшается при создании заказа, в той же транзакции, условным
+UPDATE ... SET items_left = items_left - n WHERE items_left >= n. Проверка и списание выполняются
+одним запросом в БД, поэтому параллельные покупатели последней единицы не уводят остаток в минус:
+один из запросов обновит строку, остальные получат 0 обновленных строк и OutOfStock.
+
+Резерв держится settings.STOCK_RESERVATION_MINUTES. Если оплата отменена или не пришла за это
+время, товары возвращаются на склад (задачи delete_order_with_canceled_payment и
+release_expired_stock_reservations). Оплата подтверждает резерв; если он уже истек, товары
+списываются заново тем же условным запросом.
+
+Остаток меняется через update(), без сигналов сохранения товара, поэтому после фиксации
+транзакции кеши с остатком (каталог и фасеты, карточки недавно просмотренных товаров)
+сбрасываются явно (_forget_stock).
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from products.models import Product, ProductCategoryMembership
+from products.recently_viewed import forget_product_card
+from products.recommendations import mark_products_changed
+from products.services import invalidate_catalog_caches
+from .models import Order, OrderItem
+
+logger = logging.getLogger('django')
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_id):
+        super().__init__(f"Not enough items left for product {product_id}")
+        self.product_id = product_id
+
+
+def _forget_stock(product_ids):
+    """После фиксации транзакции сбрасывает кеши, в которых хранится остаток товаров product_ids."""
+    product_ids = list(product_ids)
+
+    def forget():
+        shop_ids = set(Product.objects.filter(pk__in=product_ids).values_list('shop_id', flat=True))
+        category_ids = set(ProductCategoryMembership.objects
+                           .filter(product_id__in=product_ids)
+                           .values_list('category_id', flat=True))
+        invalidate_catalog_caches(shop_ids, category_ids)
+        for product_id in product_ids:
+            forget_product_card(product_id)
+        mark_products_changed(product_ids)
+
+    transaction.on_commit(forget)
+
+
+def _take(quantities):
+    """Списывает {id товара: количество}; при нехватке любого товара — OutOfStock (вызывать в транзакции)."""
+    # один порядок блокировки строк во всех транзакциях — без взаимных блокировок
+    for product_id, quantity in sorted(quantities.items()):
+        taken = (Product.objects
+                 .filter(pk=product_id, items_left__gte=quantity)
+                 .update(items_left=F('items_left') - quantity))
+        if not taken:
+            raise OutOfStock(product_id)
+    _forget_stock(quantities)
+
+
+def _give_back(quantities):
+    for product_id, quantity in sorted(quantities.items()):
+        Product.objects.filter(pk=product_id).update(items_left=F('items_left') + quantity)
+    _forget_stock(quantities)
+
+
+def _order_quantities(order_id):
+    quantities = {}
+    for product_id, quantity in (OrderItem.objects
+                                 .filter(order_id=order_id, product__isnull=False)
+                                 .values_list('product_id', 'quantity')):
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+
+def reserve_stock(order, items):
+    """Резервирует позиции items (product, qty) за заказом; вызывается в транзакции создания заказа."""
+    quantities = {}
+    for item in items:
+        quantities[item['product'].pk] = quantities.get(item['product'].pk, 0) + item['qty']
+    _take(quantities)
+    order.stock_status = 'reserved'
+    order.stock_reserved_until = timezone.now() + timedelta(minutes=settings.STOCK_RESERVATION_MINUTES)
+    order.save(update_fields=['stock_status', 'stock_reserved_until'])
+
+
+def commit_stock(order_id):
+    """
+    Оплата пришла: резерв становится списанием. Истекший (возвращенный) резерв и заказы без резерва
+    списываются заново; если товара уже нет, заказ оплачен сверх остатка — это пишется в лог.
+    Повторный вызов ничего не меняет.
+    """
+    with transaction.atomic():
+        order = Order.objects.select_for_update().get(pk=order_id)
+        if order.stock_status == 'committed':
+            return
+        if order.stock_status != 'reserved':
+            try:
+                with transaction.atomic():
+                    _take(_order_quantities(order_id))
+            except OutOfStock as e:
+                logger.warning(f"Order {order_id} paid after its reservation was released: {str(e)}")
+        order.stock_status = 'committed'
+        order.stock_reserved_until = None
+        order.save(update_fields=['stock_status', 'stock_reserved_until'])
+
+
+def release_stock(order_id):
+    """Возвращает зарезервированные товары заказа на склад; подтвержденный или возвращенный резерв не трогает."""
+    with transaction.atomic():
+        order = Order.objects.select_for_update().filter(pk=order_id).first()
+        if order is None or order.stock_status != 'reserved':
+            return False
+        _give_back(_order_quantities(order_id))
+        order.stock_status = 'released'
+        order.stock_reserved_until = None
+        order.save(update_fields=['stock_status', 'stock_reserved_until'])
+        return True
+
+
+def expired_reservations():
+    return Order.objects.filter(stock_status='reserved', stock_reserved_until__lt=timezone.now(), paid=False)
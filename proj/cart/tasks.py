@@ -1,14 +1,20 @@
 from products.models import Shop
 from proj.celery import app
-from .models import Order, OrderItem, StoreSalesReport
+from .models import Order, StoreSalesReport, PaymentOutbox, PaymentWebhookEvent
+from .checkout import send_payment
+from .payments import confirm_order_payment, cancel_order_payment, parse_received_events
+from .stock import release_stock, expired_reservations
 from proj.settings import EMAIL_HOST_USER
 from django.core.mail import send_mail
 from django.template.loader import get_template
 import logging
+from celery import group
+from django.conf import settings
 from django.db import transaction
+from yookassa.domain.notification import WebhookNotificationEventType
 from django.utils import timezone
 import calendar
-from datetime import date
+from datetime import date, timedelta
 from decimal import Decimal
 from django.contrib.auth import get_user_model
 
@@ -17,95 +23,6 @@ User = get_user_model()
 logger = logging.getLogger('django')
 
 
-@app.task
-def update_order_status(order_id):
-    try:
-        with transaction.atomic():
-            order = Order.objects.select_for_update().get(pk=order_id)
-            order.paid = True
-            order.status = 'in_assembly'
-            order.save(update_fields=['paid', 'status', 'updated'])
-            logger.info(f"Order {order_id} status updated successfully")
-    except Exception as e:
-        logger.error(f"Error updating order status {order_id}: {str(e)}")
-
-
-@app.task
-def decrease_product_quantity(order_id):
-    try:
-        with transaction.atomic():
-            order = Order.objects.get(pk=order_id)
-            order_items = OrderItem.objects.filter(order=order).select_related('product')
-            for item in order_items:
-                product = item.product
-                if product.items_left is not None:
-                    product.items_left -= item.quantity
-                    product.save()
-            logger.info(f"Products decreased for order {order_id}")
-    except Exception as e:
-        logger.error(f"Error decreasing products for order {order_id}: {str(e)}")
-
-
-@app.task
-def update_store_sales_report(order_id):
-    try:
-        with transaction.atomic():
-            # Блокируем связанные объекты для избежания race condition
-            order = Order.objects.select_related('shop').select_for_update().get(pk=order_id)
-            shop = order.shop
-
-            # Находим подходящий отчет
-            today = timezone.now().date()
-            report = StoreSalesReport.objects.filter(
-                shop=shop,
-                start_date__lte=today,
-                end_date__gte=today
-            ).select_for_update().first()
-
-            # Если нет активного отчета, создаем
-            if not report:
-                first_day_this_month = today.replace(day=1)
-                _, last_day = calendar.monthrange(today.year, today.month)
-                last_day_this_month = today.replace(day=last_day)
-
-                report = StoreSalesReport.objects.create(
-                    shop=shop,
-                    start_date=first_day_this_month,
-                    end_date=last_day_this_month,
-                    revenue=Decimal('0.00'),
-                    products_performance={},
-                    category_performance={}
-                )
-
-            # Обновляем выручку
-            report.revenue += order.amount
-            report.save(update_fields=['revenue'])
-
-            # Добавляем заказ в отчет
-            report.orders.add(order)
-
-            # Обновляем продажи по товарам
-            products_perf = report.products_performance.copy()
-            for item in order.items.select_related('product').all():
-                product_id = str(item.product.pk)
-                products_perf[product_id] = products_perf.get(product_id, 0) + item.quantity
-            report.products_performance = products_perf
-
-            # Обновляем продажи по категориям
-            category_perf = report.category_performance.copy()
-            for item in order.items.select_related('product').all():
-                for category in item.product.category.all():
-                    category_slug = category.slug
-                    category_perf[category_slug] = category_perf.get(category_slug, 0) + item.quantity
-            report.category_performance = category_perf
-
-            report.save()
-            logger.info(f"Updated sales report {report.id} for order {order_id}")
-
-    except Exception as e:
-        logger.error(f"Error updating sales report for order {order_id}: {str(e)}")
-
-
 @app.task
 def send_email_to_owner(order_id):
     try:
@@ -223,7 +140,94 @@ def create_monthly_reports():
 @app.task
 def delete_order_with_canceled_payment(order_id):
     try:
-        with transaction.atomic():
-            Order.objects.select_for_update().get(pk=order_id).delete()
+        cancel_order_payment(order_id)
     except Exception as e:
         logger.error(f"Error deleting order with canceled payment {order_id}: {str(e)}")
+
+
+@app.task
+def release_expired_stock_reservations():
+    """Возвращает на склад товары заказов, оплата которых не пришла за время резерва."""
+    try:
+        released = sum(release_stock(order_id) for order_id in expired_reservations().values_list('pk', flat=True))
+        logger.info(f"Released stock reservations of {released} orders")
+    except Exception as e:
+        logger.error(f"Error releasing stock reservations: {str(e)}")
+
+
+@app.task
+def process_payment_outbox():
+    """
+    Повторяет запросы на оплату, которые не были отправлены в шлюз после создания заказа
+    (например, процесс упал между транзакцией и вызовом YooKassa). Ключ идемпотентности тот же,
+    поэтому уже созданный платеж не дублируется, а лишь связывается с заказом. Временная ошибка
+    шлюза оставляет запрос до следующего запуска (см. send_payment).
+    """
+    try:
+        stale = PaymentOutbox.objects.filter(status='pending', created__lt=timezone.now() - timedelta(minutes=5))
+        for outbox in stale:
+            send_payment(outbox, retry=True)
+        logger.info("Payment outbox processed")
+    except Exception as e:
+        logger.error(f"Error processing payment outbox: {str(e)}")
+
+
+@app.task
+def process_payment_event(event_id):
+    """
+    Обрабатывает уведомление YooKassa из входящего ящика: переходы заказа выполняются одной
+    транзакцией вместе с отметкой об обработке, письма о заказе отправляются после ее фиксации
+    и только если заказ оплачен этим уведомлением.
+    """
+    try:
+        with transaction.atomic():
+            event = PaymentWebhookEvent.objects.select_for_update().get(pk=event_id)
+            if event.status == 'processed':
+                return
+            newly_paid = False
+            if event.order_id is not None:
+                if event.event == WebhookNotificationEventType.PAYMENT_SUCCEEDED:
+                    newly_paid = confirm_order_payment(event.order_id)
+                elif event.event == WebhookNotificationEventType.PAYMENT_CANCELED:
+                    cancel_order_payment(event.order_id)
+            event.status = 'processed'
+            event.processed = timezone.now()
+            event.save(update_fields=['status', 'processed'])
+            if newly_paid:
+                order_id = event.order_id
+                transaction.on_commit(lambda: group(
+                    send_email_to_owner.si(order_id),
+                    send_email_to_customer.si(order_id),
+                ).delay())
+        logger.info(f"Payment event {event_id} processed")
+    except Exception as e:
+        logger.error(f"Error processing payment event {event_id}: {str(e)}")
+
+
+@app.task
+def process_pending_payment_events():
+    """Повторяет обработку уведомлений об оплате, которые не удалось обработать сразу."""
+    try:
+        stale = PaymentWebhookEvent.objects.filter(status='pending', created__lt=timezone.now() - timedelta(minutes=5))
+        for event_id in stale.values_list('pk', flat=True):
+            process_payment_event(event_id)
+        logger.info("Pending payment events processed")
+    except Exception as e:
+        logger.error(f"Error processing pending payment events: {str(e)}")
+
+
+@app.task
+def drain_payment_webhook_inbox():
+    """Разбирает пачками уведомления, сохраненные вебхуком в режиме быстрого ответа, и обрабатывает их."""
+    try:
+        drained = 0
+        while True:
+            parsed, ready = parse_received_events(settings.YOOKASSA_WEBHOOK_BATCH_SIZE)
+            if not parsed:
+                break
+            for event_id in ready:
+                process_payment_event(event_id)
+            drained += parsed
+        logger.info(f"Payment webhook inbox drained: {drained} events")
+    except Exception as e:
+        logger.error(f"Error draining payment webhook inbox: {str(e)}")
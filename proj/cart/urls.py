@@ -10,6 +10,7 @@ urlpatterns = [
     path('delete/', views.cart_delete, name='delete-to-cart'),
     path('update/', views.cart_update, name='update-to-cart'),
     path('order/<slug:shop_slug>/', views.order_view, name='order-view'),
+    path('order/<slug:shop_slug>/shipping-quote/', views.shipping_quote, name='shipping-quote'),
     path('payment-success/', views.payment_success, name='payment-success'),
     path('payment-error/', views.payment_error, name='payment-error'),
     path('webhook-yookassa/', yookassa_webhook, name='webhook-yookassa'),
@@ -1,16 +1,20 @@
 import json
 import logging
 from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
 from django.http import HttpResponse
 from yookassa.domain.common import SecurityHelper
 from yookassa.domain.notification import (WebhookNotificationEventType,
                                           WebhookNotificationFactory)
-from .models import Order
-from .tasks import update_order_status, decrease_product_quantity, update_store_sales_report, send_email_to_owner, \
-    send_email_to_customer, delete_order_with_canceled_payment
+from .models import Order, PaymentWebhookEvent
+from .tasks import process_payment_event, drain_payment_webhook_inbox
 
 logger = logging.getLogger('django')
 
+INBOX_DRAIN_SCHEDULED_KEY = "payment_webhook_inbox_drain_scheduled"
+INBOX_DRAIN_DELAY = 1  # секунд: уведомления, пришедшие за это время, разбираются одной задачей
+
 
 def get_client_ip(request):
     x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
@@ -26,61 +30,53 @@ def yookassa_webhook(request):
     if not SecurityHelper().is_ip_trusted(ip):
         return HttpResponse(status=400)
 
+    if settings.YOOKASSA_WEBHOOK_FAST_ACK:
+        # Сохраняем уведомление как есть и сразу отвечаем: разбор и проверки — в drain_payment_webhook_inbox
+        PaymentWebhookEvent.objects.create(status='received', body=request.body.decode('utf-8', 'replace'))
+        if cache.add(INBOX_DRAIN_SCHEDULED_KEY, True, INBOX_DRAIN_DELAY):
+            drain_payment_webhook_inbox.apply_async(countdown=INBOX_DRAIN_DELAY)
+        return HttpResponse(status=200)
+
     # Извлечение JSON объекта из тела запроса
     event_json = json.loads(request.body)
     try:
         # Создание объекта класса уведомлений в зависимости от события
         notification_object = WebhookNotificationFactory().create(event_json)
         response_object = notification_object.object
-        if notification_object.event == WebhookNotificationEventType.PAYMENT_SUCCEEDED:
-            payment_id = response_object.id
-
-            try:
-                # Ищем заказ по payment_id
-                order = Order.objects.get(payment_id=payment_id)
-
-                # Проверяем совпадение суммы
-                if Decimal(response_object.amount.value) != order.amount:
-                    logger.error(
-                        f"Amount mismatch for order {order.id}. Payment: {response_object.amount.value}, "
-                        f"Order: {order.amount}")
-                    return HttpResponse(status=400)
+        if notification_object.event not in (WebhookNotificationEventType.PAYMENT_SUCCEEDED,
+                                             WebhookNotificationEventType.PAYMENT_CANCELED):
+            return HttpResponse(status=400)  # Сообщаем кассе об ошибке
 
-                # Обновляем статус заказа асинхронно
-                update_order_status.delay(order.id)
-                # Уменьшаем количество товаров асинхронно
-                decrease_product_quantity.delay(order.id)
-                # Обновляем отчет о продажах магазина асинхронно
-                update_store_sales_report.delay(order.id)
-                # Отправляем письмо владельцу магазина асинхронно
-                send_email_to_owner.delay(order.id)
-                # Отправляем письмо клиенту асинхронно
-                send_email_to_customer.delay(order.id)
+        payment_id = response_object.id
+        # Повторная доставка уже принятого уведомления: отвечаем сразу, не трогая заказ
+        if PaymentWebhookEvent.objects.filter(payment_id=payment_id, event=notification_object.event).exists():
+            logger.info(f"Duplicate webhook {notification_object.event} for payment ID: {payment_id}")
+            return HttpResponse(status=200)
 
-            except Order.DoesNotExist:
-                logger.error(f"Order not found for payment ID: {payment_id}")
-                return HttpResponse(status=400)
+        try:
+            # Ищем заказ по payment_id
+            order = Order.objects.get(payment_id=payment_id)
+        except Order.DoesNotExist:
+            logger.error(f"Order not found for payment ID: {payment_id}")
+            return HttpResponse(status=400)
 
-            except Exception as e:
-                logger.error(f"Error updating order: {str(e)}")
-                return HttpResponse(status=400)
-        # Платеж отклонен
-        elif notification_object.event == WebhookNotificationEventType.PAYMENT_CANCELED:
-            payment_id = response_object.id
-            try:
-                # Ищем заказ по payment_id
-                order = Order.objects.get(payment_id=payment_id)
-                delete_order_with_canceled_payment.delay(order.id)
-            except Order.DoesNotExist:
-                logger.error(f"Order not found for payment ID: {payment_id}")
-                return HttpResponse(status=400)
+        # Проверяем совпадение суммы
+        if (notification_object.event == WebhookNotificationEventType.PAYMENT_SUCCEEDED
+                and Decimal(response_object.amount.value) != order.amount):
+            logger.error(
+                f"Amount mismatch for order {order.id}. Payment: {response_object.amount.value}, "
+                f"Order: {order.amount}")
+            return HttpResponse(status=400)
 
-            except Exception as e:
-                logger.error(f"Error updating order: {str(e)}")
-                return HttpResponse(status=400)
+        # Уникальность по платежу и событию защищает и от одновременных повторов
+        event, created = PaymentWebhookEvent.objects.get_or_create(
+            payment_id=payment_id, event=notification_object.event,
+            defaults={'order': order, 'payload': event_json},
+        )
+        if created:
+            process_payment_event.delay(event.pk)
         else:
-            # Обработка ошибок
-            return HttpResponse(status=400)  # Сообщаем кассе об ошибке
+            logger.info(f"Duplicate webhook {notification_object.event} for payment ID: {payment_id}")
 
     except Exception:
         # Обработка ошибок
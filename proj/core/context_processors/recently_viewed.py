@@ -1,19 +1,11 @@
-from products.models import Product
-from django.db.models import Avg, Count
+from django.utils.functional import SimpleLazyObject
+from products.recently_viewed import get_recently_viewed_ids, get_product_cards
 
 
 def recently_viewed(request):
-    product_ids = request.session.get('recently_viewed', [])
+    product_ids = get_recently_viewed_ids(request)
     if not product_ids:
         return {}
 
-    # Получаем объекты и сохраняем порядок из списка идентификаторов
-    products = Product.objects.annotate(
-                                    avg_rating=Avg('reviews__rating'),
-                                    review_count=Count('reviews', distinct=True),
-                                ).filter(id__in=product_ids)
-    products_sorted = sorted(
-        products,
-        key=lambda prod: product_ids.index(prod.id)
-    )
-    return {'recently_viewed_products': products_sorted}
+    # Карточки берутся из кеша и только если шаблон действительно выводит товары
+    return {'recently_viewed_products': SimpleLazyObject(lambda: get_product_cards(product_ids))}
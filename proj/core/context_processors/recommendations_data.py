@@ -1,7 +1,11 @@
-from django.db.models import Q, Avg, Count
 from django.core.cache import cache
-from products.models import Product
+from django.utils.functional import SimpleLazyObject
 from products.tasks import find_recommended_products_for_user
+from products.leaderboard import get_popular_products
+from products.recommendations import get_purchased_product_ids, interactions_fingerprint, recommendations_key, \
+    hydrate_products
+
+TASK_GUARD_TIMEOUT = 10 * 60  # не чаще одной задачи рекомендаций на историю за это время
 
 
 def get_product_text(product):
@@ -15,24 +19,28 @@ def get_product_text(product):
     return f"{product.name} {cat_text} {description}"
 
 
-def recommendations_data(request):
-    queryset = Q(verified=True) & Q(show=True)
-
+def _recommended_products(request):
     if request.user.is_authenticated:
-        if cache.get(f"recommended_products_cache_user_{request.user.pk}"):
-            return {'recommended_products': cache.get(f"recommended_products_cache_user_{request.user.pk}")}
-        # Иначе: собираем из сессии до 10 последних просмотров
+        # собираем из сессии до 10 последних просмотров
         viewed_ids = request.session.get('recently_viewed', [])  # список ID, max len=10
+        interacted_ids = set(get_purchased_product_ids(request.user.pk)) | set(viewed_ids)
+        if interacted_ids:
+            # рекомендации общие для всех пользователей с такой же историей
+            fingerprint = interactions_fingerprint(interacted_ids)
+            recommended_ids = cache.get(recommendations_key(fingerprint))
+            if recommended_ids:
+                return hydrate_products(recommended_ids)
 
-        # Запускаем асинхронную задачу: передаём user_pk и viewed_ids
-        find_recommended_products_for_user.delay(request.user.pk, viewed_ids)
+            # Иначе запускаем асинхронную задачу: передаём user_pk и viewed_ids.
+            # Пока задача считает рекомендации для этой истории, повторно ее не ставим;
+            # новый просмотр меняет отпечаток, и задача ставится сразу
+            if cache.add(f"recommended_products_task_{fingerprint}", 1, TASK_GUARD_TIMEOUT):
+                find_recommended_products_for_user.delay(request.user.pk, viewed_ids)
     # Если пользователь не авторизован или не взаимодействовал с товарами
     # или идет ожидание задачи используем популярные товары
-    recommended_products = cache.get_or_set("recommended_products_cache", Product.objects.filter(queryset).annotate(
-                                        avg_rating=Avg('reviews__rating'),
-                                        review_count=Count('reviews', distinct=True),
-                                        order_count=Count('orderitems', distinct=True),
-                                    ).filter(
-                                        avg_rating__gte=4  # Только товары со средним рейтингом >= 4
-                                    ).order_by('-order_count')[:10], 10 * 60)
-    return {'recommended_products': recommended_products}
+    return get_popular_products()
+
+
+def recommendations_data(request):
+    # Вычисляется, только если шаблон действительно выводит рекомендации
+    return {'recommended_products': SimpleLazyObject(lambda: _recommended_products(request))}
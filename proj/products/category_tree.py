@@ -0,0 +1,72 @@
+"""
+Материализованная принадлежность товаров поддеревьям категорий.
+
+Для каждого товара в ProductCategoryMembership хранятся его категории и все их предки,
+поэтому товары поддерева категории и непустые подкатегории магазина выбираются
+одним индексированным join'ом вместо подзапросов по tree_id/lft/rght.
+Таблица обновляется сигналами при изменении категорий товара и перемещении
+категорий в дереве (в том числе перетаскиванием в админке).
+"""
+from django.db import transaction
+
+from .models import Category, Product, ProductCategoryMembership
+
+
+def _ancestors(category_id, parents):
+    while category_id is not None:
+        yield category_id
+        category_id = parents.get(category_id)
+
+
+def update_category_memberships(product_ids, parents=None):
+    """
+    Пересобирает строки принадлежности поддеревьям для переданных товаров.
+    Возвращает id категорий, в поддеревьях которых товары были до или после изменения.
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return set()
+    if parents is None:
+        parents = dict(Category.objects.values_list('id', 'parent_id'))
+    direct_links = (
+        Product.category.through.objects
+        .filter(product_id__in=product_ids)
+        .values_list('product_id', 'category_id')
+    )
+    rows = {}
+    for product_id, category_id in direct_links:
+        for ancestor_id in _ancestors(category_id, parents):
+            direct = ancestor_id == category_id or rows.get((product_id, ancestor_id), False)
+            rows[(product_id, ancestor_id)] = direct
+    with transaction.atomic():
+        old_rows = ProductCategoryMembership.objects.filter(product_id__in=product_ids)
+        affected = set(old_rows.values_list('category_id', flat=True))
+        old_rows.delete()
+        ProductCategoryMembership.objects.bulk_create(
+            ProductCategoryMembership(product_id=product_id, category_id=category_id, direct=direct)
+            for (product_id, category_id), direct in rows.items()
+        )
+    return affected | {category_id for _, category_id in rows}
+
+
+def update_moved_category_memberships(category):
+    """Обновляет товары поддерева перемещенной категории."""
+    parents = dict(Category.objects.values_list('id', 'parent_id'))
+    # при сохранении с новым parent сигнал node_moved приходит до записи parent_id в БД
+    parents[category.pk] = category.parent_id
+    return update_category_memberships(subtree_product_ids(category), parents)
+
+
+def subtree_product_ids(category):
+    """Товары, лежащие в категории или в любой из ее подкатегорий."""
+    return list(
+        ProductCategoryMembership.objects.filter(category=category).values_list('product_id', flat=True)
+    )
+
+
+def rebuild_category_memberships(batch_size=500):
+    """Полная перестройка таблицы принадлежности для всех товаров."""
+    product_ids = list(Product.objects.values_list('pk', flat=True))
+    for start in range(0, len(product_ids), batch_size):
+        update_category_memberships(product_ids[start:start + batch_size])
+    return len(product_ids)
@@ -0,0 +1,118 @@
+"""
+Модель совместных покупок (item-item коллаборативная фильтрация).
+
+По оплаченным заказам строится разреженная матрица «покупатель × товар» с неявной обратной
+связью: вес покупки растет логарифмически с количеством единиц и делится на логарифм числа
+разных товаров покупателя (покупки «всего подряд» говорят о сходстве товаров меньше).
+Близость товаров — косинусная мера столбцов этой матрицы; у каждого товара хранится
+только COPURCHASE_NEIGHBORS самых близких, поэтому модель остается разреженной.
+
+Покупатель — пользователь, а для заказов без пользователя — сам заказ (заказы делятся по
+магазинам, поэтому товары разных магазинов связываются только через пользователя).
+"""
+import os
+from collections import defaultdict
+
+import numpy as np
+from scipy.sparse import csr_matrix, diags
+
+from cart.models import OrderItem
+
+COPURCHASE_NEIGHBORS = 50
+
+
+class CoPurchaseModel:
+    def __init__(self, product_ids, similarity):
+        self.product_ids = np.asarray(product_ids, dtype=np.int64)
+        self.similarity = csr_matrix(similarity)
+        self.positions = {int(pk): i for i, pk in enumerate(self.product_ids)}
+
+    def scores_many(self, interacted_lists, candidate_ids):
+        """
+        Матрица (пользователи × кандидаты): средняя близость кандидата к товарам пользователя, в [0, 1].
+        Товары и кандидаты без совместных покупок дают нулевой вклад.
+        """
+        candidate_positions = np.array([self.positions.get(pk, -1) for pk in candidate_ids], dtype=np.int64)
+        scores = np.zeros((len(interacted_lists), len(candidate_ids)))
+        rows = [[self.positions[pk] for pk in ids if pk in self.positions] for ids in interacted_lists]
+        known = candidate_positions >= 0
+        if not any(rows) or not known.any():
+            return scores
+        # среднее по всем товарам пользователя, включая товары без совместных покупок
+        weights = csr_matrix((
+            np.concatenate([np.full(len(user_rows), 1.0 / max(len(ids), 1))
+                            for user_rows, ids in zip(rows, interacted_lists)]),
+            np.concatenate([np.asarray(user_rows, dtype=np.int64) for user_rows in rows]),
+            np.cumsum([0] + [len(user_rows) for user_rows in rows]),
+        ), shape=(len(rows), len(self.product_ids)))
+        similarities = (weights @ self.similarity).toarray()
+        scores[:, known] = similarities[:, candidate_positions[known]]
+        return scores
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            product_ids=self.product_ids,
+            data=self.similarity.data, indices=self.similarity.indices, indptr=self.similarity.indptr,
+            shape=np.array(self.similarity.shape),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            similarity = csr_matrix((data["data"], data["indices"], data["indptr"]), shape=tuple(data["shape"]))
+            return cls(data["product_ids"], similarity)
+
+
+def paid_purchase_rows():
+    """Позиции оплаченных заказов: (покупатель, id заказа, id товара, количество), старые заказы первыми."""
+    rows = (OrderItem.objects
+            .filter(order__paid=True, product__isnull=False)
+            .order_by('order__created', 'pk')
+            .values_list('order__user_id', 'order_id', 'product_id', 'quantity'))
+    return [(f"user_{user_id}" if user_id else f"order_{order_id}", order_id, product_id, quantity)
+            for user_id, order_id, product_id, quantity in rows]
+
+
+def _top_k_rows(matrix, k):
+    """Оставляет в каждой строке k наибольших значений."""
+    data, indices, indptr = [], [], [0]
+    for i in range(matrix.shape[0]):
+        start, end = matrix.indptr[i], matrix.indptr[i + 1]
+        row_data, row_indices = matrix.data[start:end], matrix.indices[start:end]
+        if len(row_data) > k:
+            top = np.argpartition(-row_data, k - 1)[:k]
+            row_data, row_indices = row_data[top], row_indices[top]
+        data.append(row_data)
+        indices.append(row_indices)
+        indptr.append(indptr[-1] + len(row_data))
+    return csr_matrix((np.concatenate(data), np.concatenate(indices), indptr), shape=matrix.shape)
+
+
+def build_copurchase_model(rows, k=COPURCHASE_NEIGHBORS):
+    """Строит модель по строкам paid_purchase_rows()."""
+    quantities = defaultdict(float)
+    for basket, _, product_id, quantity in rows:
+        quantities[basket, product_id] += quantity or 1
+    baskets = {basket: i for i, basket in enumerate(dict.fromkeys(basket for basket, _ in quantities))}
+    product_ids = sorted({product_id for _, product_id in quantities})
+    positions = {pk: i for i, pk in enumerate(product_ids)}
+    if not quantities:
+        return CoPurchaseModel([], csr_matrix((0, 0)))
+
+    purchases = csr_matrix((
+        np.log1p(list(quantities.values())),
+        ([baskets[basket] for basket, _ in quantities], [positions[pk] for _, pk in quantities]),
+    ), shape=(len(baskets), len(product_ids)))
+    basket_sizes = np.diff(purchases.indptr)
+    purchases = diags(1.0 / np.log1p(basket_sizes)) @ purchases
+
+    norms = np.sqrt(np.asarray(purchases.multiply(purchases).sum(axis=0)).ravel())
+    inverse_norms = diags(np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0))
+    similarity = (inverse_norms @ (purchases.T @ purchases) @ inverse_norms).tocsr()
+    similarity.setdiag(0)
+    similarity.eliminate_zeros()
+    return CoPurchaseModel(product_ids, _top_k_rows(similarity, k))
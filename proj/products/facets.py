@@ -0,0 +1,210 @@
+"""
+Движок фасетов для фильтров каталога.
+
+Все значения фильтров и количество товаров по каждому значению считаются
+за один проход по строкам области каталога (весь каталог, категория,
+категория магазина). Количество учитывает уже выбранные фильтры: для
+значения фасета считаются товары, подходящие под все фильтры, кроме
+фильтра самого этого фасета.
+"""
+from collections import Counter
+from dataclasses import dataclass, field
+
+from django.db.models import Q
+
+from .models import Product
+
+# (поле модели/GET-параметр, заголовок, тип значения, единица измерения)
+CHOICE_FACETS = (
+    ("product_type", "Тип товара", "str", ""),
+    ("compatibility", "Совместимость", "str", ""),
+    ("thread_type", "Тип резьбы", "str", ""),
+    ("mounting_type", "Тип крепления", "str", ""),
+    ("imitation_of_a_shot", "Имитация выстрела", "bool", ""),
+    ("laser_sight", "С ЛЦУ", "bool", ""),
+    ("weight", "Вес", "float", "гр."),
+    ("principle_of_operation", "Принцип действия", "str", ""),
+    ("diameter", "Диаметр", "float", "мм"),
+)
+
+# (поле модели, заголовок, GET-параметр нижней границы, GET-параметр верхней границы)
+RANGE_FACETS = (
+    ("price", "Цена", "min_price", "max_price"),
+    ("length", "Длина", "min_length", "max_length"),
+)
+
+ROW_FIELDS = ("pk", "items_left") + tuple(f[0] for f in RANGE_FACETS) + tuple(f[0] for f in CHOICE_FACETS)
+
+
+@dataclass
+class FacetValue:
+    value: object
+    label: str
+    param: str
+    count: int = 0
+    selected: bool = False
+
+
+@dataclass
+class Facet:
+    name: str
+    title: str
+    values: list = field(default_factory=list)
+
+
+@dataclass
+class RangeFacet:
+    name: str
+    title: str
+    min_param: str
+    max_param: str
+    min: object = None
+    max: object = None
+    selected_min: object = None
+    selected_max: object = None
+
+
+@dataclass
+class Facets:
+    ranges: dict
+    choices: list
+    total: int = 0
+
+    @property
+    def price(self):
+        return self.ranges["price"]
+
+    @property
+    def length(self):
+        return self.ranges["length"]
+
+
+def _parse_value(kind, raw):
+    if raw in (None, ""):
+        return None
+    if kind == "bool":
+        return {"True": True, "False": False}.get(raw)
+    if kind == "float":
+        try:
+            return float(raw.replace(",", "."))
+        except ValueError:
+            return None
+    return raw
+
+
+def _value_label(kind, value, unit):
+    if kind == "bool":
+        return "Да" if value else "Нет"
+    if kind == "float":
+        label = f"{value:g}"
+        return f"{label} {unit}" if unit else label
+    return str(value)
+
+
+class FilterState:
+    """Фильтры, выбранные пользователем в GET-параметрах запроса."""
+
+    def __init__(self, params):
+        self.selected = {}
+        for name, _, kind, _ in CHOICE_FACETS:
+            values = {_parse_value(kind, raw) for raw in params.getlist(name)}
+            values.discard(None)
+            if values:
+                self.selected[name] = values
+
+        self.ranges = {}
+        for name, _, min_param, max_param in RANGE_FACETS:
+            bounds = (_parse_value("float", params.get(min_param)), _parse_value("float", params.get(max_param)))
+            if bounds != (None, None):
+                self.ranges[name] = bounds
+
+        self.available = bool(params.get("available", ""))
+
+    def to_q(self):
+        """Условие для выборки товаров из БД."""
+        query = Q()
+        for name, values in self.selected.items():
+            query &= Q(**{f"{name}__in": list(values)})
+        for name, (low, high) in self.ranges.items():
+            if low is not None:
+                query &= Q(**{f"{name}__gte": low})
+            if high is not None:
+                query &= Q(**{f"{name}__lte": high})
+        if self.available:
+            query &= Q(items_left__gt=0)
+        return query
+
+    def failed_filters(self, row):
+        """Имена фильтров, которым не соответствует строка товара."""
+        failed = []
+        for name, values in self.selected.items():
+            if row[name] not in values:
+                failed.append(name)
+        for name, (low, high) in self.ranges.items():
+            value = row[name]
+            if value is None or (low is not None and value < low) or (high is not None and value > high):
+                failed.append(name)
+        if self.available and not (row["items_left"] or 0) > 0:
+            failed.append("available")
+        return failed
+
+
+def load_facet_rows(base_query):
+    """Один запрос: поля фасетов для всех товаров области каталога."""
+    return list(Product.objects.filter(base_query).order_by().values(*ROW_FIELDS).distinct())
+
+
+def build_facets(rows, state):
+    """Считает значения фасетов и количество товаров за один проход по строкам."""
+    choice_values = {name: set() for name, _, _, _ in CHOICE_FACETS}
+    counts = {name: Counter() for name, _, _, _ in CHOICE_FACETS}
+    range_bounds = {name: [None, None] for name, _, _, _ in RANGE_FACETS}
+    total = 0
+
+    for row in rows:
+        for name, bounds in range_bounds.items():
+            value = row[name]
+            if value is None:
+                continue
+            if bounds[0] is None or value < bounds[0]:
+                bounds[0] = value
+            if bounds[1] is None or value > bounds[1]:
+                bounds[1] = value
+
+        failed = state.failed_filters(row)
+        if not failed:
+            total += 1
+        for name in choice_values:
+            value = row[name]
+            if value is None:
+                continue
+            choice_values[name].add(value)
+            # товар учитывается в фасете, если не проходит максимум его собственный фильтр
+            if not failed or failed == [name]:
+                counts[name][value] += 1
+
+    choices = []
+    for name, title, kind, unit in CHOICE_FACETS:
+        selected = state.selected.get(name, set())
+        values = [
+            FacetValue(
+                value=value,
+                label=_value_label(kind, value, unit),
+                param=str(value),
+                count=counts[name][value],
+                selected=value in selected,
+            )
+            for value in sorted(choice_values[name])
+        ]
+        choices.append(Facet(name=name, title=title, values=values))
+
+    ranges = {}
+    for name, title, min_param, max_param in RANGE_FACETS:
+        low, high = state.ranges.get(name, (None, None))
+        ranges[name] = RangeFacet(
+            name=name, title=title, min_param=min_param, max_param=max_param,
+            min=range_bounds[name][0], max=range_bounds[name][1],
+            selected_min=low, selected_max=high,
+        )
+
+    return Facets(ranges=ranges, choices=choices, total=total)
@@ -0,0 +1,220 @@
+"""
+Рейтинг популярных товаров.
+
+Популярные товары (проверенные, показываемые, со средней оценкой от 4) ранжируются
+по количеству оплаченных заказов. Рейтинг хранится готовым — глобально, по каждой
+корневой категории и по каждому магазину:
+
+- при Redis-кеше — в sorted set'ах Redis (чтение топа за O(log n));
+- иначе (SQLite и LocMemCache в тестах и локально) — словарями в кеше Django.
+
+Рейтинг полностью перестраивается Celery beat задачей update_popular_leaderboards,
+а между перестройками обновляется точечно: при подтверждении оплаты заказа
+(cart.payments.confirm_order_payment → products.services.increase_products_order_count),
+изменении отзывов и сохранении товара.
+"""
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from .models import Product, ProductCategoryMembership
+
+GLOBAL_BOARD = "global"
+BOARD_KEY_PREFIX = "popular_leaderboard"
+BOARDS_KEY = f"{BOARD_KEY_PREFIX}:boards"
+BUILT_KEY = f"{BOARD_KEY_PREFIX}_built"
+REBUILD_LOCK_KEY = f"{BOARD_KEY_PREFIX}_rebuild_lock"
+MIN_RATING = 4
+
+
+def category_board(root_category_id):
+    return f"category_{root_category_id}"
+
+
+def shop_board(shop_id):
+    return f"shop_{shop_id}"
+
+
+def _board_key(board):
+    return f"{BOARD_KEY_PREFIX}:{board}"
+
+
+class RedisLeaderboard:
+    """Рейтинги в sorted set'ах Redis: участник — id товара, балл — количество заказов."""
+
+    boards_key = BOARDS_KEY
+
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url)
+
+    def is_built(self):
+        return bool(self.client.exists(BUILT_KEY))
+
+    def top(self, board, limit):
+        return [int(pk) for pk in self.client.zrevrange(_board_key(board), 0, limit - 1)]
+
+    def rebuild(self, boards):
+        old_boards = {name.decode() for name in self.client.smembers(self.boards_key)}
+        pipe = self.client.pipeline()
+        for board, scores in boards.items():
+            tmp_key = f"{_board_key(board)}:tmp"
+            pipe.delete(tmp_key)
+            pipe.zadd(tmp_key, scores)
+            # подмена готового рейтинга атомарна, читатели не видят пустой доски
+            pipe.rename(tmp_key, _board_key(board))
+        for board in old_boards - set(boards):
+            pipe.delete(_board_key(board))
+        pipe.delete(self.boards_key)
+        if boards:
+            pipe.sadd(self.boards_key, *boards)
+        pipe.set(BUILT_KEY, 1)
+        pipe.execute()
+
+    def set_score(self, product_id, boards, score):
+        pipe = self.client.pipeline()
+        for board in boards:
+            pipe.zadd(_board_key(board), {product_id: score})
+        pipe.sadd(self.boards_key, *boards)
+        pipe.execute()
+
+    def remove(self, product_id, boards):
+        pipe = self.client.pipeline()
+        for board in boards:
+            pipe.zrem(_board_key(board), product_id)
+        pipe.execute()
+
+    def increment(self, product_id, boards, amount=1):
+        pipe = self.client.pipeline()
+        for board in boards:
+            # xx — увеличиваем только товары, которые уже есть в рейтинге
+            pipe.zadd(_board_key(board), {product_id: amount}, xx=True, incr=True)
+        pipe.execute()
+
+
+class CacheLeaderboard:
+    """Рейтинги словарями {id товара: балл} в кеше Django (для окружений без Redis)."""
+
+    def is_built(self):
+        return bool(cache.get(BUILT_KEY))
+
+    def _scores(self, board):
+        return cache.get(_board_key(board), {})
+
+    def top(self, board, limit):
+        scores = self._scores(board)
+        return sorted(scores, key=lambda pk: (scores[pk], pk), reverse=True)[:limit]
+
+    def rebuild(self, boards):
+        old_boards = cache.get(BOARDS_KEY, set())
+        cache.delete_many([_board_key(board) for board in old_boards - set(boards)])
+        cache.set_many({_board_key(board): scores for board, scores in boards.items()}, None)
+        cache.set(BOARDS_KEY, set(boards), None)
+        cache.set(BUILT_KEY, 1, None)
+
+    def _update(self, boards, change):
+        for board in boards:
+            scores = self._scores(board)
+            change(scores)
+            cache.set(_board_key(board), scores, None)
+
+    def set_score(self, product_id, boards, score):
+        self._update(boards, lambda scores: scores.__setitem__(product_id, score))
+        cache.set(BOARDS_KEY, cache.get(BOARDS_KEY, set()) | set(boards), None)
+
+    def remove(self, product_id, boards):
+        self._update(boards, lambda scores: scores.pop(product_id, None))
+
+    def increment(self, product_id, boards, amount=1):
+        def change(scores):
+            if product_id in scores:
+                scores[product_id] += amount
+        self._update(boards, change)
+
+
+@lru_cache(maxsize=None)
+def get_leaderboard():
+    cache_settings = settings.CACHES["default"]
+    if cache_settings["BACKEND"] == "django.core.cache.backends.redis.RedisCache":
+        return RedisLeaderboard(cache_settings["LOCATION"])
+    return CacheLeaderboard()
+
+
+def _popular_products():
+    return Product.objects.filter(verified=True, show=True, avg_rating__gte=MIN_RATING)
+
+
+def _root_categories(product_ids):
+    roots = {}
+    for product_id, category_id in (ProductCategoryMembership.objects
+                                    .filter(product_id__in=product_ids, category__level=0)
+                                    .values_list('product_id', 'category_id')):
+        roots.setdefault(product_id, []).append(category_id)
+    return roots
+
+
+def _product_boards(shop_id, root_ids):
+    boards = [GLOBAL_BOARD] + [category_board(root_id) for root_id in root_ids]
+    if shop_id is not None:
+        boards.append(shop_board(shop_id))
+    return boards
+
+
+def _board_filter(board):
+    """Условие выборки товаров рейтинга из БД (пока рейтинг не построен)."""
+    kind, _, object_id = board.partition("_")
+    if kind == "category":
+        return Q(category_memberships__category_id=object_id)
+    if kind == "shop":
+        return Q(shop_id=object_id)
+    return Q()
+
+
+def rebuild_popular_leaderboards():
+    """Полная перестройка всех рейтингов; возвращает количество товаров в глобальном рейтинге."""
+    rows = list(_popular_products().values_list('pk', 'shop_id', 'order_count'))
+    roots = _root_categories([pk for pk, _, _ in rows])
+    boards = {}
+    for pk, shop_id, order_count in rows:
+        for board in _product_boards(shop_id, roots.get(pk, [])):
+            boards.setdefault(board, {})[pk] = order_count
+    get_leaderboard().rebuild(boards)
+    return len(rows)
+
+
+def update_product_in_leaderboards(product_id):
+    """Добавляет товар в рейтинги или убирает из них после изменения его оценки или видимости."""
+    product = Product.objects.filter(pk=product_id).values('shop_id', 'order_count').first()
+    if product is None:
+        return
+    boards = _product_boards(product['shop_id'], _root_categories([product_id]).get(product_id, []))
+    if _popular_products().filter(pk=product_id).exists():
+        get_leaderboard().set_score(product_id, boards, product['order_count'])
+    else:
+        get_leaderboard().remove(product_id, boards)
+
+
+def record_order_in_leaderboards(order_id):
+    """Учитывает оплаченный заказ: +1 каждому товару заказа, который есть в рейтингах."""
+    rows = Product.objects.filter(orderitems__order_id=order_id).values_list('pk', 'shop_id').distinct()
+    rows = list(rows)
+    roots = _root_categories([pk for pk, _ in rows])
+    leaderboard = get_leaderboard()
+    for pk, shop_id in rows:
+        leaderboard.increment(pk, _product_boards(shop_id, roots.get(pk, [])))
+
+
+def get_popular_products(board=GLOBAL_BOARD, limit=10):
+    """Топ популярных товаров рейтинга board (по умолчанию — всего каталога)."""
+    leaderboard = get_leaderboard()
+    if not leaderboard.is_built():
+        # рейтинг еще не построен: отдаем результат запроса к БД и строим рейтинг в фоне
+        if cache.add(REBUILD_LOCK_KEY, 1, 60):
+            from .tasks import update_popular_leaderboards
+            update_popular_leaderboards.delay()
+        return list(_popular_products().filter(_board_filter(board)).distinct().order_by('-order_count')[:limit])
+    ids = leaderboard.top(board, limit)
+    products = Product.objects.in_bulk(ids)
+    return [products[pk] for pk in ids if pk in products]
@@ -0,0 +1,55 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from scipy.sparse import random as sparse_random
+
+from products.recommendations import RecommendationModel
+
+
+class Command(BaseCommand):
+    help = ('Замеряет скорость пакетного расчета рекомендаций (пользователей в секунду) '
+            'на синтетических каталогах; база данных не используется')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, nargs='+', default=[10_000, 100_000],
+                            help='Размеры синтетических каталогов')
+        parser.add_argument('--users', type=int, default=1000, help='Количество пользователей')
+        parser.add_argument('--interactions', type=int, default=5, help='Товаров в профиле пользователя')
+        parser.add_argument('--vocabulary', type=int, default=5000, help='Размер словаря TF-IDF')
+        parser.add_argument('--terms', type=int, default=20, help='Слов в описании товара')
+        parser.add_argument('--sample', type=int, default=50,
+                            help='Пользователей для сравнения с расчетом по одному')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        for products in options['products']:
+            model = self._synthetic_model(rng, products, options['vocabulary'], options['terms'])
+            product_ids = [int(pk) for pk in model.product_ids]
+            interactions = {
+                user: [int(pk) for pk in rng.choice(model.product_ids, options['interactions'], replace=False)]
+                for user in range(options['users'])
+            }
+
+            started = time.perf_counter()
+            computed = sum(len(block) for block in model.recommend_many(interactions, product_ids))
+            batch_rate = computed / (time.perf_counter() - started)
+
+            sample = list(interactions.items())[:options['sample']]
+            started = time.perf_counter()
+            for _, ids in sample:
+                model.recommend(ids, [pk for pk in product_ids if pk not in ids])
+            single_rate = len(sample) / (time.perf_counter() - started)
+
+            self.stdout.write(self.style.SUCCESS(
+                f'{products} товаров: пакетно {batch_rate:.0f} польз./с, по одному {single_rate:.0f} польз./с'
+            ))
+
+    @staticmethod
+    def _synthetic_model(rng, products, vocabulary, terms):
+        tfidf = sparse_random(products, vocabulary, density=min(terms / vocabulary, 1.0), format='csr',
+                              random_state=rng)
+        prices = rng.uniform(100, 100_000, products)
+        return RecommendationModel(np.arange(1, products + 1), tfidf, prices, (prices.min(), prices.max()),
+                                   [f'term{i}' for i in range(vocabulary)], np.ones(vocabulary))
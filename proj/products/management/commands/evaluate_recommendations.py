@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from products.recommendations import evaluate_hit_rate
+
+
+class Command(BaseCommand):
+    help = ('Офлайн-оценка рекомендаций: hit rate@k на отложенной последней покупке '
+            'для разных весов модели совместных покупок')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--weights', type=float, nargs='+', default=[0.0, 0.1, 0.3, 0.5, 0.7, 1.0],
+                            help='Веса модели совместных покупок (0 — только TF-IDF)')
+        parser.add_argument('--k', type=int, default=10, help='Длина списка рекомендаций')
+
+    def handle(self, *args, **options):
+        hit_rates, users = evaluate_hit_rate(options['weights'], k=options['k'])
+        self.stdout.write(f'Пользователей в оценке: {users}')
+        for weight, hit_rate in hit_rates.items():
+            current = ' (текущий)' if weight == settings.RECOMMENDATIONS_COPURCHASE_WEIGHT else ''
+            self.stdout.write(f'вес {weight:.2f}{current}: hit rate@{options["k"]} = {hit_rate:.3f}')
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from products.category_tree import rebuild_category_memberships
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает принадлежность товаров поддеревьям категорий'
+
+    def handle(self, *args, **options):
+        rebuilt = rebuild_category_memberships()
+        self.stdout.write(self.style.SUCCESS(f'Принадлежность поддеревьям категорий перестроена для {rebuilt} товаров'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from products.services import rebuild_product_stats
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает среднюю оценку, количество отзывов и оплаченных заказов всех товаров'
+
+    def handle(self, *args, **options):
+        updated = rebuild_product_stats()
+        self.stdout.write(self.style.SUCCESS(f'Статистика пересчитана для {updated} товаров'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from products.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает поисковый индекс всех товаров'
+
+    def handle(self, *args, **options):
+        indexed = rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(f'Поисковый индекс перестроен для {indexed} товаров'))
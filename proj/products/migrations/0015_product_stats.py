@@ -0,0 +1,45 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:14
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_product_stats(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    Review = apps.get_model('products', 'Review')
+    OrderItem = apps.get_model('cart', 'OrderItem')
+    reviews = Review.objects.filter(product=OuterRef('pk')).order_by().values('product')
+    paid_items = OrderItem.objects.filter(product=OuterRef('pk'), order__paid=True).order_by().values('product')
+    Product.objects.update(
+        avg_rating=Subquery(reviews.annotate(avg=Avg('rating')).values('avg')),
+        review_count=Coalesce(Subquery(reviews.annotate(cnt=Count('id')).values('cnt')), 0),
+        order_count=Coalesce(Subquery(paid_items.annotate(cnt=Count('id')).values('cnt')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0014_remove_shop_passport_shop_bic_shop_address_and_more'),
+        ('cart', '0008_alter_orderitem_order_alter_orderitem_price_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='avg_rating',
+            field=models.FloatField(blank=True, db_index=True, editable=False, null=True, verbose_name='Средняя оценка'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='order_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False, verbose_name='Количество оплаченных заказов'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество отзывов'),
+        ),
+        migrations.RunPython(fill_product_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:19
+
+import django.contrib.postgres.search
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations, models
+
+
+def fill_search_documents(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    products = list(Product.objects.prefetch_related('category'))
+    for product in products:
+        text = ' '.join(filter(None, [
+            product.name,
+            ' '.join(cat.title for cat in product.category.all()),
+            product.brand, product.product_type, product.compatibility, product.thread_type,
+            product.mounting_type, product.principle_of_operation,
+        ]))
+        product.search_document = text.lower().replace('ё', 'е')
+    Product.objects.bulk_update(products, ['search_document'], batch_size=500)
+
+    if schema_editor.connection.vendor == 'postgresql':
+        Product.objects.update(search_vector=(
+            SearchVector('name', config='russian', weight='A')
+            + SearchVector('search_document', config='russian', weight='B')
+            + SearchVector('search_document', config='english', weight='C')
+        ))
+
+
+def create_gin_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS products_product_search_vector_gin '
+            'ON products_product USING gin (search_vector)'
+        )
+
+
+def drop_gin_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS products_product_search_vector_gin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0015_product_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_document',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Текст для поиска'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(create_gin_index, drop_gin_index),
+        migrations.RunPython(fill_search_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_memberships(apps, schema_editor):
+    Category = apps.get_model('products', 'Category')
+    Product = apps.get_model('products', 'Product')
+    Membership = apps.get_model('products', 'ProductCategoryMembership')
+    parents = dict(Category.objects.values_list('id', 'parent_id'))
+    rows = {}
+    for product_id, category_id in Product.category.through.objects.values_list('product_id', 'category_id'):
+        ancestor_id = category_id
+        while ancestor_id is not None:
+            rows[(product_id, ancestor_id)] = ancestor_id == category_id or rows.get((product_id, ancestor_id), False)
+            ancestor_id = parents.get(ancestor_id)
+    Membership.objects.bulk_create(
+        (Membership(product_id=product_id, category_id=category_id, direct=direct)
+         for (product_id, category_id), direct in rows.items()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0016_product_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductCategoryMembership',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('direct', models.BooleanField(default=False, verbose_name='Товар напрямую в категории')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='product_memberships', to='products.category', verbose_name='Категория')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='category_memberships', to='products.product', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Товар в поддереве категории',
+                'verbose_name_plural': 'Товары в поддеревьях категорий',
+                'indexes': [models.Index(fields=['category', 'product'], name='products_pr_categor_10c147_idx')],
+                'unique_together': {('product', 'category')},
+            },
+        ),
+        migrations.RunPython(fill_memberships, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.contrib.postgres.search import SearchVectorField
 from mptt.models import MPTTModel, TreeForeignKey, TreeManyToManyField
 import random
 import string
@@ -155,6 +156,17 @@ class Product(models.Model):
     shipping_height = models.FloatField("Высота при доставке в см", max_length=50)
     shipping_weight = models.FloatField("Вес при доставке в кг", max_length=50)
 
+    # Денормализованная статистика (обновляется сигналами отзывов и задачами оплаты заказов,
+    # пересчитывается целиком командой rebuild_product_stats)
+    avg_rating = models.FloatField('Средняя оценка', blank=True, null=True, editable=False, db_index=True)
+    review_count = models.PositiveIntegerField('Количество отзывов', default=0, editable=False)
+    order_count = models.PositiveIntegerField('Количество оплаченных заказов', default=0, editable=False,
+                                              db_index=True)
+
+    # Поисковый индекс (обновляется сигналами, см. products/search.py)
+    search_document = models.TextField('Текст для поиска', blank=True, default='', editable=False)
+    search_vector = SearchVectorField('Поисковый вектор', blank=True, null=True, editable=False)
+
     def __str__(self):
         return f'{self.name}'
 
@@ -165,6 +177,56 @@ class Product(models.Model):
         verbose_name_plural = 'Товары'
 
 
+class ProductCategoryMembership(models.Model):
+    """
+    Принадлежность товара категории и всем ее предкам (поддерживается сигналами,
+    см. products/category_tree.py). Позволяет выбирать товары поддерева одним join'ом.
+    """
+    product = models.ForeignKey(
+        Product,
+        related_name='category_memberships',
+        verbose_name='Товар',
+        on_delete=models.CASCADE
+    )
+    category = models.ForeignKey(
+        Category,
+        related_name='product_memberships',
+        verbose_name='Категория',
+        on_delete=models.CASCADE
+    )
+    direct = models.BooleanField('Товар напрямую в категории', default=False)
+
+    class Meta:
+        verbose_name = 'Товар в поддереве категории'
+        verbose_name_plural = 'Товары в поддеревьях категорий'
+        unique_together = ('product', 'category')
+        indexes = [models.Index(fields=['category', 'product'])]
+
+
+class ProductNeighbor(models.Model):
+    """Похожий товар (по модели рекомендаций, см. products/recommendations.py); пересчитывается задачей."""
+    product = models.ForeignKey(
+        Product,
+        related_name='neighbor_links',
+        verbose_name='Товар',
+        on_delete=models.CASCADE
+    )
+    neighbor = models.ForeignKey(
+        Product,
+        related_name='+',
+        verbose_name='Похожий товар',
+        on_delete=models.CASCADE
+    )
+    score = models.FloatField('Сходство')
+    rank = models.PositiveSmallIntegerField('Место')
+
+    class Meta:
+        verbose_name = 'Похожий товар'
+        verbose_name_plural = 'Похожие товары'
+        unique_together = ('product', 'neighbor')
+        indexes = [models.Index(fields=['product', 'rank'])]
+
+
 class Review(models.Model):
     RATING_OPTIONS = (
         (1, '★'),
@@ -199,3 +261,19 @@ class Review(models.Model):
     class Meta:
         verbose_name = 'Отзыв'
         verbose_name_plural = 'Отзывы'
+
+
+class RecentlyViewed(models.Model):
+    """Недавно просмотренные товары пользователя (см. products/recently_viewed.py), новые первыми."""
+    user = models.OneToOneField(
+        User,
+        related_name='recently_viewed',
+        verbose_name='Пользователь',
+        on_delete=models.CASCADE
+    )
+    product_ids = models.JSONField('id товаров', default=list)
+    updated = models.DateTimeField('Время обновления', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Недавно просмотренные товары'
+        verbose_name_plural = 'Недавно просмотренные товары'
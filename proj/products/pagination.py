@@ -0,0 +1,170 @@
+"""
+Пагинация списков товаров.
+
+Кроме обычного Paginator (COUNT(*) + OFFSET) поддерживается keyset-пагинация:
+страница выбирается условием по колонке сортировки и pk от последнего/первого
+товара соседней страницы, поэтому 50-я страница стоит столько же, сколько первая.
+Общее количество товаров в этом режиме берется из кеша.
+Режим включается настройкой PRODUCT_KEYSET_PAGINATION.
+"""
+import base64
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Q
+
+# Колонки, по которым возможна keyset-пагинация (NOT NULL, есть индекс или pk-подобный порядок)
+KEYSET_SORT_FIELDS = ("pub_date", "price", "order_count", "name")
+DEFAULT_PER_PAGE = 24
+COUNT_CACHE_TIMEOUT = 5 * 60
+
+
+def _encode_cursor(value, pk, direction):
+    raw = json.dumps({"v": value, "pk": pk, "d": direction}, default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return data["v"], int(data["pk"]), data["d"]
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+class KeysetPaginator:
+    def __init__(self, queryset, per_page, sort):
+        self.descending = sort.startswith("-")
+        self.field = sort.lstrip("-")
+        self.per_page = per_page
+        self.queryset = queryset
+
+    @property
+    def count(self):
+        """Количество товаров выборки, кешируется по тексту SQL-запроса."""
+        sql = str(self.queryset.order_by().query)
+        key = f"keyset_count_{hashlib.md5(sql.encode()).hexdigest()}_cache"
+        return cache.get_or_set(key, lambda: self.queryset.order_by().count(), COUNT_CACHE_TIMEOUT)
+
+    def _ordered(self, descending):
+        sign = "-" if descending else ""
+        return self.queryset.order_by(f"{sign}{self.field}", f"{sign}pk")
+
+    def _after(self, value, pk, descending):
+        lookup = "lt" if descending else "gt"
+        return (Q(**{f"{self.field}__{lookup}": value})
+                | Q(**{self.field: value, f"pk__{lookup}": pk}))
+
+    def _position(self, cursor):
+        """(значение колонки сортировки, pk, направление) из курсора или None, если курсор неверный."""
+        decoded = _decode_cursor(cursor) if cursor else None
+        if decoded is None:
+            return None
+        raw_value, pk, direction = decoded
+        try:
+            value = self.queryset.model._meta.get_field(self.field).to_python(raw_value)
+        except (ValidationError, TypeError):
+            return None
+        if value is None:
+            return None
+        return value, pk, direction
+
+    def get_page(self, cursor, params):
+        position = self._position(cursor)
+        if position is None:
+            items = list(self._ordered(self.descending)[:self.per_page + 1])
+            has_next, has_previous = len(items) > self.per_page, False
+            items = items[:self.per_page]
+        else:
+            value, pk, direction = position
+            if direction == "prev":
+                # идем назад: обратный порядок, затем разворачиваем страницу
+                backwards = not self.descending
+                items = list(self._ordered(backwards).filter(self._after(value, pk, backwards))[:self.per_page + 1])
+                has_previous, has_next = len(items) > self.per_page, True
+                items = items[:self.per_page][::-1]
+            else:
+                items = list(self._ordered(self.descending).filter(
+                    self._after(value, pk, self.descending))[:self.per_page + 1])
+                has_next, has_previous = len(items) > self.per_page, True
+                items = items[:self.per_page]
+        return KeysetPage(items, self, has_next, has_previous, params)
+
+
+class KeysetPage:
+    is_keyset = True
+
+    def __init__(self, object_list, paginator, has_next, has_previous, params):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self._params = params
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    def _query(self, cursor=None):
+        params = self._params.copy()
+        params.pop("cursor", None)
+        params.pop("page", None)
+        if cursor:
+            params["cursor"] = cursor
+        return params.urlencode()
+
+    def _cursor(self, item, direction):
+        return _encode_cursor(getattr(item, self.paginator.field), item.pk, direction)
+
+    @property
+    def first_page_query(self):
+        return self._query()
+
+    @property
+    def next_page_query(self):
+        if not self.object_list:
+            return self.first_page_query
+        return self._query(self._cursor(self.object_list[-1], "next"))
+
+    @property
+    def previous_page_query(self):
+        if not self.object_list:
+            return self.first_page_query
+        return self._query(self._cursor(self.object_list[0], "prev"))
+
+
+def _per_page(request):
+    try:
+        return max(int(request.GET.get("prod_count", DEFAULT_PER_PAGE)), 1)
+    except ValueError:
+        return DEFAULT_PER_PAGE
+
+
+def paginate_products(request, products):
+    """Страница товаров: keyset-режим, если он включен и поддерживается сортировкой, иначе Paginator."""
+    ordering = products.query.order_by
+    sort = ordering[0] if ordering else ""
+    if (getattr(settings, "PRODUCT_KEYSET_PAGINATION", False) and isinstance(sort, str)
+            and sort.lstrip("-") in KEYSET_SORT_FIELDS):
+        paginator = KeysetPaginator(products, _per_page(request), sort)
+        return paginator.get_page(request.GET.get("cursor"), request.GET)
+    paginator = Paginator(products, request.GET.get("prod_count", DEFAULT_PER_PAGE))
+    return paginator.get_page(request.GET.get("page"))
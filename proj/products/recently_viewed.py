@@ -0,0 +1,89 @@
+"""
+Недавно просмотренные товары.
+
+Список хранится в сессии компактно — только id товаров, новые первыми, не больше
+RECENTLY_VIEWED_LIMIT; сессия перезаписывается, только если порядок действительно изменился.
+При settings.RECENTLY_VIEWED_PERSIST список авторизованного пользователя сохраняется и в БД
+(RecentlyViewed) и при входе объединяется со списком сессии, поэтому переносится между устройствами.
+
+Для вывода id превращаются в карточки товаров (название, цена, картинка, рейтинг), которые
+кешируются по одной на товар и сбрасываются сигналами при изменении товара или его отзывов.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Product, RecentlyViewed
+
+SESSION_KEY = 'recently_viewed'
+RECENTLY_VIEWED_LIMIT = 10
+PRODUCT_CARD_TIMEOUT = 60 * 60
+
+
+def _card_key(product_id):
+    return f"product_card_{product_id}"
+
+
+def _merge(*id_lists):
+    """Объединяет списки id без повторов с сохранением порядка."""
+    return list(dict.fromkeys(pk for ids in id_lists for pk in ids))[:RECENTLY_VIEWED_LIMIT]
+
+
+def _persist(user, product_ids):
+    RecentlyViewed.objects.update_or_create(user=user, defaults={'product_ids': product_ids})
+
+
+def get_recently_viewed_ids(request):
+    return request.session.get(SESSION_KEY, [])
+
+
+def add_recently_viewed(request, product_id):
+    """Переносит товар в начало списка; сессия и БД пишутся, только если список изменился."""
+    product_ids = get_recently_viewed_ids(request)
+    updated = _merge([product_id], product_ids)
+    if updated == product_ids:
+        return
+    request.session[SESSION_KEY] = updated
+    if settings.RECENTLY_VIEWED_PERSIST and request.user.is_authenticated:
+        _persist(request.user, updated)
+
+
+def restore_recently_viewed(request, user):
+    """При входе добавляет к просмотрам сессии сохраненные в БД просмотры пользователя."""
+    if not settings.RECENTLY_VIEWED_PERSIST:
+        return
+    stored = RecentlyViewed.objects.filter(user=user).values_list('product_ids', flat=True).first() or []
+    product_ids = get_recently_viewed_ids(request)
+    updated = _merge(product_ids, stored)
+    if updated != product_ids:
+        request.session[SESSION_KEY] = updated
+    if updated != stored:
+        _persist(user, updated)
+
+
+def product_card(product):
+    return {
+        'pk': product.pk,
+        'name': product.name,
+        'price': product.price,
+        'image_url': product.image6.url,
+        'items_left': product.items_left,
+        'avg_rating': product.avg_rating,
+        'review_count': product.review_count,
+    }
+
+
+def get_product_cards(product_ids):
+    """Карточки товаров в порядке product_ids: из кеша одним get_many, недостающие — одним запросом."""
+    keys = {pk: _card_key(pk) for pk in product_ids}
+    cached = cache.get_many(keys.values())
+    cards = {pk: cached[key] for pk, key in keys.items() if key in cached}
+    missing = [pk for pk in product_ids if pk not in cards]
+    if missing:
+        loaded = {product.pk: product_card(product) for product in Product.objects.filter(pk__in=missing)}
+        cache.set_many({_card_key(pk): card for pk, card in loaded.items()}, PRODUCT_CARD_TIMEOUT)
+        cards.update(loaded)
+    return [cards[pk] for pk in product_ids if pk in cards]
+
+
+def forget_product_card(product_id):
+    cache.delete(_card_key(product_id))
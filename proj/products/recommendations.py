@@ -0,0 +1,598 @@
+"""
+Модель товаров для персональных рекомендаций.
+
+TF-IDF по поисковому тексту товара (Product.search_document) и нормированная цена
+считаются один раз для всего каталога и сохраняются в .npz-файл
+(settings.RECOMMENDATIONS_MODEL_PATH) вместе с индексом id товаров и словарем.
+Персональные рекомендации строят только вектор профиля пользователя и считают
+близость к кандидатам одним умножением разреженной матрицы на вектор.
+
+Модель перестраивается целиком по расписанию (словарь и idf), а между перестройками
+обновляется инкрементально: новые и измененные товары векторизуются по текущему
+словарю, удаленные убираются из индекса. Измененные товары копятся в множестве Redis (SADD),
+поэтому одновременные сохранения товаров не теряют отметок; без Redis — множеством в кеше Django.
+
+По модели же раз в сутки считаются списки похожих товаров (ProductNeighbor): для каждого
+проверенного товара в наличии — top-K ближайших. Соседями считаются только товары с общими
+словами: сходства считаются блоками строк по разреженной матрице TF-IDF, а слагаемое цены
+добавляется к уже найденным парам, поэтому память блока пропорциональна числу пар с общими
+словами, а не block_size × размер каталога. Списки блока заменяются своей короткой транзакцией,
+блокировки не растут с размером каталога; читатели видят для каждого товара либо старый,
+либо новый список.
+
+Рекомендации пользователю — объединенные списки похожих товаров его покупок и просмотров,
+смешанные с совместными покупками; если их не хватило, список добирается по близости профиля
+пользователя. Для всех пользователей, активных за последние RECOMMENDATIONS_ACTIVE_DAYS дней,
+тот же расчет выполняется пакетно (recommend_products_many): списки похожих загружаются одним
+запросом на блок из RECOMMEND_USERS_BLOCK_SIZE пользователей, а профили добора умножаются
+на матрицу кандидатов одним разреженным умножением; результат блока пишется в кеш одним
+set_many (в Redis — одним pipeline).
+
+Готовые рекомендации хранятся списками id под ключом отпечатка истории пользователя
+(хеш множества купленных и просмотренных товаров): пользователи с одинаковой историей
+используют один расчет, а новый просмотр меняет отпечаток и запускает пересчет.
+
+Оценка по TF-IDF смешивается с оценкой по совместным покупкам (products/copurchase.py)
+с весом settings.RECOMMENDATIONS_COPURCHASE_WEIGHT; модель совместных покупок тоже
+хранится готовой в .npz и перестраивается по расписанию, так что стоимость расчета
+для пользователя растет лишь на одно разреженное умножение.
+"""
+import hashlib
+import os
+from collections import defaultdict
+from datetime import timedelta
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from scipy.sparse import csr_matrix, diags, hstack, vstack
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from cart.models import Order
+from .copurchase import CoPurchaseModel, build_copurchase_model, paid_purchase_rows
+from .models import Product, ProductNeighbor, RecentlyViewed
+
+CHANGED_PRODUCTS_KEY = "recommendation_model_changed_products"
+NEIGHBORS_PER_PRODUCT = 20
+NEIGHBORS_BLOCK_SIZE = 500
+RECOMMEND_USERS_BLOCK_SIZE = 128  # при 100k кандидатов блок оценок занимает ~100 МБ
+RECOMMENDATIONS_TIMEOUT = 60 * 60
+BATCH_RECOMMENDATIONS_TIMEOUT = 2 * 60 * 60  # с запасом до следующего ежечасного пересчета
+PURCHASES_DAYS = 90
+PURCHASES_TIMEOUT = 60 * 60
+
+_loaded = {}  # путь к файлу модели -> (mtime, модель)
+
+
+class RecommendationModel:
+    def __init__(self, product_ids, tfidf, prices, price_range, vocabulary, idf):
+        self.product_ids = np.asarray(product_ids, dtype=np.int64)
+        self.tfidf = csr_matrix(tfidf)
+        self.prices = np.asarray(prices, dtype=np.float64)
+        self.price_range = tuple(price_range)
+        self.vocabulary = list(vocabulary)
+        self.idf = np.asarray(idf, dtype=np.float64)
+        self.positions = {int(pk): i for i, pk in enumerate(self.product_ids)}
+
+        # признаки товара: TF-IDF + цена в [0, 1]
+        low, high = self.price_range
+        scale = (high - low) or 1.0
+        price_column = np.clip((self.prices - low) / scale, 0, 1).reshape(-1, 1)
+        self.features = hstack([self.tfidf, csr_matrix(price_column)]).tocsr()
+        self.norms = np.sqrt(np.asarray(self.features.multiply(self.features).sum(axis=1)).ravel())
+
+    def vectorize(self, texts):
+        if not self.vocabulary:
+            return csr_matrix((len(texts), 0))
+        vectorizer = TfidfVectorizer(stop_words='english', vocabulary=self.vocabulary)
+        vectorizer.idf_ = self.idf
+        return vectorizer.transform(texts)
+
+    def recommend(self, interacted_ids, candidate_ids, limit=10, copurchase=None, copurchase_weight=0.0):
+        """
+        id кандидатов, наиболее близких к среднему вектору товаров пользователя (косинусная мера).
+        С моделью совместных покупок оценки смешиваются: (1 - w) * TF-IDF + w * совместные покупки.
+        """
+        user_rows = [self.positions[pk] for pk in interacted_ids if pk in self.positions]
+        candidate_ids = [pk for pk in candidate_ids if pk in self.positions]
+        if not user_rows or not candidate_ids:
+            return []
+        profile = np.asarray(self.features[user_rows].mean(axis=0)).ravel()
+        profile_norm = np.linalg.norm(profile)
+        if not profile_norm:
+            return []
+        rows = np.array([self.positions[pk] for pk in candidate_ids])
+        scores = self.features[rows] @ profile
+        norms = self.norms[rows] * profile_norm
+        scores = np.divide(scores, norms, out=np.zeros_like(scores), where=norms > 0)
+        if copurchase is not None and copurchase_weight:
+            copurchase_scores = copurchase.scores_many([list(interacted_ids)], candidate_ids)[0]
+            scores = (1 - copurchase_weight) * scores + copurchase_weight * copurchase_scores
+        order = np.argsort(-scores, kind='stable')[:limit]
+        return [candidate_ids[i] for i in order]
+
+    def recommend_many(self, interactions, candidate_ids, limit=10, block_size=RECOMMEND_USERS_BLOCK_SIZE,
+                       copurchase=None, copurchase_weight=0.0):
+        """
+        Пакетный вариант recommend: interactions — {пользователь: id товаров}.
+        Возвращает генератор словарей {пользователь: id рекомендованных товаров} по блокам пользователей;
+        товары, с которыми пользователь уже взаимодействовал, не рекомендуются.
+        """
+        candidate_ids = [pk for pk in candidate_ids if pk in self.positions]
+        users = [(user, [self.positions[pk] for pk in ids if pk in self.positions])
+                 for user, ids in interactions.items()]
+        users = [(user, rows) for user, rows in users if rows]
+        if not users or not candidate_ids:
+            return
+        candidate_columns = {pk: i for i, pk in enumerate(candidate_ids)}
+        candidate_rows = [self.positions[pk] for pk in candidate_ids]
+        # нормированные векторы кандидатов, транспонированные один раз на весь пересчет
+        candidate_norms = self.norms[candidate_rows]
+        inverse_norms = np.divide(1.0, candidate_norms, out=np.zeros_like(candidate_norms), where=candidate_norms > 0)
+        candidates = (diags(inverse_norms) @ self.features[candidate_rows]).T.tocsr()
+        limit = min(limit, len(candidate_ids))
+
+        for start in range(0, len(users), block_size):
+            block = users[start:start + block_size]
+            # профиль пользователя — среднее его товаров: разреженная матрица весов 1/n на матрицу признаков
+            weights = csr_matrix((
+                np.concatenate([np.full(len(rows), 1.0 / len(rows)) for _, rows in block]),
+                np.concatenate([rows for _, rows in block]),
+                np.cumsum([0] + [len(rows) for _, rows in block]),
+            ), shape=(len(block), self.features.shape[0]))
+            profiles = weights @ self.features
+            profile_norms = np.sqrt(np.asarray(profiles.multiply(profiles).sum(axis=1)).ravel())
+            inverse_norms = np.divide(1.0, profile_norms, out=np.zeros_like(profile_norms), where=profile_norms > 0)
+            scores = (diags(inverse_norms) @ profiles @ candidates).toarray()
+            if copurchase is not None and copurchase_weight:
+                copurchase_scores = copurchase.scores_many([list(interactions[user]) for user, _ in block],
+                                                           candidate_ids)
+                scores = (1 - copurchase_weight) * scores + copurchase_weight * copurchase_scores
+
+            for i, (user, _) in enumerate(block):
+                seen = [candidate_columns[pk] for pk in interactions[user] if pk in candidate_columns]
+                scores[i, seen] = -np.inf
+            top = np.argpartition(-scores, limit - 1, axis=1)[:, :limit]
+            result = {}
+            for i, (user, _) in enumerate(block):
+                if not profile_norms[i]:
+                    continue
+                columns = top[i][np.lexsort((top[i], -scores[i, top[i]]))]
+                result[user] = [candidate_ids[j] for j in columns if scores[i, j] > -np.inf]
+            yield result
+
+    def with_products(self, rows, removed_ids=()):
+        """Новая модель, в которой строки rows [(id, текст, цена)] добавлены или заменены по текущему словарю."""
+        replaced = {pk for pk, _, _ in rows} | set(removed_ids)
+        keep = [i for i, pk in enumerate(self.product_ids) if int(pk) not in replaced]
+        tfidf = self.tfidf[keep]
+        product_ids = list(self.product_ids[keep])
+        prices = list(self.prices[keep])
+        if rows:
+            tfidf = vstack([tfidf, self.vectorize([text for _, text, _ in rows])])
+            product_ids += [pk for pk, _, _ in rows]
+            prices += [price for _, _, price in rows]
+        return RecommendationModel(product_ids, tfidf, prices, self.price_range, self.vocabulary, self.idf)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            product_ids=self.product_ids,
+            tfidf_data=self.tfidf.data, tfidf_indices=self.tfidf.indices, tfidf_indptr=self.tfidf.indptr,
+            tfidf_shape=np.array(self.tfidf.shape),
+            prices=self.prices,
+            price_range=np.array(self.price_range),
+            vocabulary=np.array(self.vocabulary, dtype=str),
+            idf=self.idf,
+        )
+        # читатели видят либо старый, либо новый файл целиком
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            tfidf = csr_matrix(
+                (data["tfidf_data"], data["tfidf_indices"], data["tfidf_indptr"]),
+                shape=tuple(data["tfidf_shape"]),
+            )
+            return cls(data["product_ids"], tfidf, data["prices"], data["price_range"],
+                       data["vocabulary"].tolist(), data["idf"])
+
+
+def _product_rows(queryset):
+    return list(queryset.values_list('pk', 'search_document', 'price'))
+
+
+def build_recommendation_model():
+    """Обучает модель заново по всем товарам каталога."""
+    rows = _product_rows(Product.objects.order_by('pk'))
+    texts = [text for _, text, _ in rows]
+    prices = [price for _, _, price in rows]
+    vectorizer = TfidfVectorizer(stop_words='english')
+    try:
+        tfidf = vectorizer.fit_transform(texts)
+        vocabulary, idf = list(vectorizer.get_feature_names_out()), vectorizer.idf_
+    except ValueError:
+        # пустой каталог или тексты только из стоп-слов
+        tfidf, vocabulary, idf = csr_matrix((len(rows), 0)), [], []
+    price_range = (min(prices), max(prices)) if prices else (0.0, 0.0)
+    return RecommendationModel([pk for pk, _, _ in rows], tfidf, prices, price_range, vocabulary, idf)
+
+
+def _load_model(path, model_class):
+    """Модель из файла; файл перечитывается процессом только после его обновления."""
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if path not in _loaded or _loaded[path][0] != mtime:
+        _loaded[path] = (mtime, model_class.load(path))
+    return _loaded[path][1]
+
+
+def get_recommendation_model():
+    return _load_model(settings.RECOMMENDATIONS_MODEL_PATH, RecommendationModel)
+
+
+def rebuild_recommendation_model():
+    # отметки, сделанные во время сборки, останутся до следующего обновления
+    _pop_changed_products()
+    model = build_recommendation_model()
+    model.save(settings.RECOMMENDATIONS_MODEL_PATH)
+    return model
+
+
+def get_copurchase_model():
+    return _load_model(settings.RECOMMENDATIONS_COPURCHASE_MODEL_PATH, CoPurchaseModel)
+
+
+def rebuild_copurchase_model():
+    model = build_copurchase_model(paid_purchase_rows())
+    model.save(settings.RECOMMENDATIONS_COPURCHASE_MODEL_PATH)
+    return model
+
+
+@lru_cache(maxsize=None)
+def _redis_client():
+    cache_settings = settings.CACHES["default"]
+    if cache_settings["BACKEND"] != "django.core.cache.backends.redis.RedisCache":
+        return None
+    import redis
+    return redis.Redis.from_url(cache_settings["LOCATION"])
+
+
+def mark_products_changed(product_ids):
+    """Запоминает измененные товары для следующего инкрементального обновления модели."""
+    product_ids = {int(pk) for pk in product_ids}
+    if not product_ids:
+        return
+    client = _redis_client()
+    if client is not None:
+        client.sadd(CHANGED_PRODUCTS_KEY, *product_ids)
+        return
+    cache.set(CHANGED_PRODUCTS_KEY, cache.get(CHANGED_PRODUCTS_KEY, set()) | product_ids, None)
+
+
+def _pop_changed_products():
+    """Забирает накопленные отметки: чтение и удаление множества — одна транзакция MULTI/EXEC."""
+    client = _redis_client()
+    if client is not None:
+        pipe = client.pipeline()
+        pipe.smembers(CHANGED_PRODUCTS_KEY)
+        pipe.delete(CHANGED_PRODUCTS_KEY)
+        changed, _ = pipe.execute()
+        return {int(pk) for pk in changed}
+    changed = cache.get(CHANGED_PRODUCTS_KEY, set())
+    cache.delete(CHANGED_PRODUCTS_KEY)
+    return changed
+
+
+def refresh_recommendation_model():
+    """Инкрементальное обновление: новые, измененные и удаленные товары. Без модели — полная сборка."""
+    model = get_recommendation_model()
+    if model is None:
+        return rebuild_recommendation_model()
+    changed = _pop_changed_products()
+    try:
+        existing = set(Product.objects.values_list('pk', flat=True))
+        indexed = set(model.positions)
+        to_update = (existing - indexed) | (changed & existing)
+        removed = indexed - existing
+        if not to_update and not removed:
+            return model
+        model = model.with_products(_product_rows(Product.objects.filter(pk__in=to_update).order_by('pk')), removed)
+        model.save(settings.RECOMMENDATIONS_MODEL_PATH)
+    except Exception:
+        # обновление не удалось — отметки вернутся в следующий запуск
+        mark_products_changed(changed)
+        raise
+    return model
+
+
+def _available_products():
+    return Product.objects.filter(verified=True, show=True, items_left__gt=0)
+
+
+def _neighbor_similarities(text, prices, start, stop):
+    """
+    Косинусная мера строк start:stop со всеми товарами для пар с общими словами. Цена ненулевая
+    почти у всех товаров, и вместе с ней произведение блока было бы плотным, поэтому слагаемое
+    цены прибавляется только к ненулевым сходствам по TF-IDF.
+    """
+    similarities = (text[start:stop] @ text.T).tocsr()
+    block_rows = np.repeat(np.arange(similarities.shape[0]) + start, np.diff(similarities.indptr))
+    similarities.data += prices[block_rows] * prices[similarities.indices]
+    return similarities
+
+
+def compute_product_neighbors(k=NEIGHBORS_PER_PRODUCT, block_size=NEIGHBORS_BLOCK_SIZE):
+    """Пересчитывает списки похожих товаров; возвращает количество сохраненных связей."""
+    model = get_recommendation_model() or rebuild_recommendation_model()
+    product_ids = [pk for pk in _available_products().values_list('pk', flat=True) if pk in model.positions]
+    rows = [model.positions[pk] for pk in product_ids]
+    norms = model.norms[rows] if rows else np.zeros(0)
+    # нормированные строки: скалярное произведение = косинусная мера
+    inverse_norms = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    features = (diags(inverse_norms) @ model.features[rows]).tocsr()
+    # признаки = TF-IDF + последний столбец цены
+    text = features[:, :-1].tocsr()
+    prices = features[:, -1].toarray().ravel()
+    k = min(k, len(product_ids) - 1)
+
+    saved = 0
+    if k > 0:
+        for start in range(0, len(product_ids), block_size):
+            block_ids = product_ids[start:start + block_size]
+            similarities = _neighbor_similarities(text, prices, start, start + block_size)
+            links = []
+            for i, product_id in enumerate(block_ids):
+                row = slice(similarities.indptr[i], similarities.indptr[i + 1])
+                columns, scores = similarities.indices[row], similarities.data[row]
+                keep = (scores > 0) & (columns != start + i)
+                columns, scores = columns[keep], scores[keep]
+                if len(scores) > k:
+                    top = np.argpartition(-scores, k - 1)[:k]
+                    columns, scores = columns[top], scores[top]
+                for rank, j in enumerate(np.lexsort((columns, -scores)), 1):
+                    links.append(ProductNeighbor(product_id=product_id, neighbor_id=product_ids[columns[j]],
+                                                 score=float(scores[j]), rank=rank))
+            with transaction.atomic():
+                ProductNeighbor.objects.filter(product_id__in=block_ids).delete()
+                ProductNeighbor.objects.bulk_create(links, batch_size=1000)
+            saved += len(links)
+
+    # списки товаров, которые больше не в продаже или не попали в расчет
+    current = set(product_ids) if k > 0 else set()
+    stale = [pk for pk in ProductNeighbor.objects.values_list('product_id', flat=True).distinct()
+             if pk not in current]
+    for start in range(0, len(stale), block_size):
+        ProductNeighbor.objects.filter(product_id__in=stale[start:start + block_size]).delete()
+    return saved
+
+
+def get_similar_products(product_id, limit=10):
+    """Похожие товары для страницы товара."""
+    links = (
+        ProductNeighbor.objects
+        .filter(product_id=product_id, neighbor__verified=True, neighbor__show=True)
+        .select_related('neighbor')
+        .order_by('rank')[:limit]
+    )
+    return [link.neighbor for link in links]
+
+
+def _load_neighbors(product_ids):
+    """Списки похожих товаров одним запросом: {id товара: [(id соседа, сходство)]}."""
+    neighbors = defaultdict(list)
+    for product_id, neighbor_id, score in ProductNeighbor.objects.filter(product_id__in=product_ids).values_list(
+            'product_id', 'neighbor_id', 'score'):
+        neighbors[product_id].append((neighbor_id, score))
+    return neighbors
+
+
+def _copurchased(scores, candidate_ids):
+    """{id кандидата: оценка} для ненулевых оценок строки copurchase.scores_many."""
+    return {candidate_ids[j]: float(scores[j]) for j in np.flatnonzero(scores)}
+
+
+def _rank_by_neighbors(interacted_ids, neighbors, candidate_set, limit, copurchased=None, copurchase_weight=0.0):
+    """
+    Средняя близость кандидатов к товарам пользователя по спискам похожих, смешанная с оценкой
+    по совместным покупкам: (1 - w) * похожие + w * совместные покупки. Товары пользователя пропускаются.
+    """
+    interacted_ids = set(interacted_ids)
+    scores = defaultdict(float)
+    for product_id in interacted_ids:
+        for neighbor_id, score in neighbors.get(product_id, ()):
+            if neighbor_id in candidate_set and neighbor_id not in interacted_ids:
+                scores[neighbor_id] += score / len(interacted_ids)
+    if copurchased and copurchase_weight:
+        scores = defaultdict(float, {pk: (1 - copurchase_weight) * score for pk, score in scores.items()})
+        for pk, score in copurchased.items():
+            if pk in candidate_set and pk not in interacted_ids:
+                scores[pk] += copurchase_weight * score
+    return sorted(scores, key=lambda pk: (-scores[pk], pk))[:limit]
+
+
+def recommend_from_neighbors(interacted_ids, candidate_ids, limit=10, copurchase=None, copurchase_weight=0.0):
+    """
+    Объединяет списки похожих товаров для товаров пользователя: средняя близость кандидата к ним.
+    С моделью совместных покупок оценки смешиваются так же, как в RecommendationModel.recommend,
+    поэтому в список попадают и кандидаты, связанные с товарами пользователя только покупками.
+    """
+    interacted_ids, candidate_ids = list(interacted_ids), list(candidate_ids)
+    copurchased = None
+    if copurchase is not None and copurchase_weight:
+        copurchased = _copurchased(copurchase.scores_many([interacted_ids], candidate_ids)[0], candidate_ids)
+    return _rank_by_neighbors(interacted_ids, _load_neighbors(interacted_ids), set(candidate_ids), limit,
+                              copurchased, copurchase_weight)
+
+
+def recommend_products_many(interactions, candidate_ids, limit=10, copurchase=None, copurchase_weight=0.0,
+                            block_size=RECOMMEND_USERS_BLOCK_SIZE):
+    """
+    Рекомендации в том виде, в каком их отдает сайт, пакетно: interactions — {пользователь: id товаров}.
+    Для каждого пользователя объединяются списки похожих товаров, смешанные с совместными покупками;
+    если их не хватило — список добирается по близости профиля (RecommendationModel.recommend_many).
+    Товары пользователя не рекомендуются. Генератор словарей {пользователь: id товаров} по блокам
+    пользователей; пользователи без рекомендаций пропускаются.
+    """
+    candidate_ids = list(candidate_ids)
+    candidate_set = set(candidate_ids)
+    users = list(interactions)
+    model = None
+    for start in range(0, len(users), block_size):
+        block = {user: list(interactions[user]) for user in users[start:start + block_size]}
+        # списки похожих для всего блока — одним запросом, совместные покупки — одним умножением
+        neighbors = _load_neighbors({pk for ids in block.values() for pk in ids})
+        copurchase_scores = None
+        if copurchase is not None and copurchase_weight:
+            copurchase_scores = copurchase.scores_many(list(block.values()), candidate_ids)
+        result = {}
+        for i, (user, ids) in enumerate(block.items()):
+            copurchased = _copurchased(copurchase_scores[i], candidate_ids) if copurchase_scores is not None else None
+            result[user] = _rank_by_neighbors(ids, neighbors, candidate_set, limit, copurchased, copurchase_weight)
+
+        short = {user: block[user] for user, ids in result.items() if len(ids) < limit}
+        if short:
+            model = model or get_recommendation_model() or rebuild_recommendation_model()
+            # с запасом: из топа по профилю убираются товары, уже взятые из списков похожих
+            for extra in model.recommend_many(short, candidate_ids, limit=2 * limit, block_size=block_size,
+                                              copurchase=copurchase, copurchase_weight=copurchase_weight):
+                for user, extra_ids in extra.items():
+                    chosen = set(result[user])
+                    result[user] += [pk for pk in extra_ids if pk not in chosen][:limit - len(result[user])]
+        yield {user: ids for user, ids in result.items() if ids}
+
+
+def recommend_products(interacted_ids, candidate_ids, limit=10, copurchase=None, copurchase_weight=0.0):
+    """Рекомендации одному пользователю тем же расчетом, что и recommend_products_many."""
+    for block in recommend_products_many({0: interacted_ids}, candidate_ids, limit=limit, copurchase=copurchase,
+                                         copurchase_weight=copurchase_weight):
+        return block.get(0, [])
+    return []
+
+
+def interactions_fingerprint(product_ids):
+    """Отпечаток истории пользователя: хеш отсортированного множества id товаров."""
+    ids = ",".join(str(pk) for pk in sorted({int(pk) for pk in product_ids}))
+    return hashlib.sha1(ids.encode()).hexdigest()
+
+
+def recommendations_key(fingerprint):
+    return f"recommended_products_{fingerprint}"
+
+
+def _purchases_key(user_pk):
+    return f"recommendation_purchases_user_{user_pk}"
+
+
+def get_purchased_product_ids(user_pk):
+    """Товары из заказов пользователя за PURCHASES_DAYS дней (кешируются до следующего заказа)."""
+    purchased_ids = cache.get(_purchases_key(user_pk))
+    if purchased_ids is None:
+        purchased_ids = sorted(set(
+            Order.objects
+            .filter(user_id=user_pk, created__gte=timezone.now() - timedelta(days=PURCHASES_DAYS),
+                    items__product__isnull=False)
+            .values_list('items__product', flat=True)
+        ))
+        cache.set(_purchases_key(user_pk), purchased_ids, PURCHASES_TIMEOUT)
+    return purchased_ids
+
+
+def forget_purchased_product_ids(user_pk):
+    cache.delete(_purchases_key(user_pk))
+
+
+def hydrate_products(product_ids):
+    """Товары по списку id одним запросом, в том же порядке; скрытые с момента расчета пропускаются."""
+    products = Product.objects.filter(verified=True, show=True).in_bulk(product_ids)
+    return [products[pk] for pk in product_ids if pk in products]
+
+
+def _active_user_interactions(days):
+    """
+    {id пользователя: купленные и просмотренные товары} для пользователей, заходивших, заказывавших
+    или смотревших товары за days дней — то же множество, по которому отпечаток считает сайт.
+    """
+    now = timezone.now()
+    since = now - timedelta(days=days)
+    active_ids = (get_user_model().objects
+                  .filter(Q(last_login__gte=since) | Q(order__created__gte=since)
+                          | Q(recently_viewed__updated__gte=since))
+                  .values('pk'))
+    interactions = defaultdict(set)
+    for user_id, product_id in (Order.objects
+                                .filter(user_id__in=active_ids, created__gte=now - timedelta(days=PURCHASES_DAYS),
+                                        items__product__isnull=False)
+                                .values_list('user_id', 'items__product')):
+        interactions[user_id].add(product_id)
+    # просмотры хранятся в БД при RECENTLY_VIEWED_PERSIST (products/recently_viewed.py)
+    for user_id, product_ids in RecentlyViewed.objects.filter(user_id__in=active_ids).values_list(
+            'user_id', 'product_ids'):
+        interactions[user_id].update(int(pk) for pk in product_ids)
+    return interactions
+
+
+def compute_active_users_recommendations(days=None, limit=10):
+    """
+    Пересчитывает и кеширует рекомендации всех активных пользователей тем же расчетом, что и задача
+    find_recommended_products_for_user (recommend_products_many), поэтому значение под ключом
+    отпечатка не зависит от того, кто его записал. Пользователи с одинаковой историей считаются
+    один раз; возвращает количество записанных отпечатков.
+    """
+    days = settings.RECOMMENDATIONS_ACTIVE_DAYS if days is None else days
+    interactions = {interactions_fingerprint(ids): ids for ids in _active_user_interactions(days).values()}
+    if not interactions:
+        return 0
+    candidate_ids = list(_available_products().values_list('pk', flat=True))
+    saved = 0
+    for block in recommend_products_many(interactions, candidate_ids, limit=limit,
+                                         copurchase=get_copurchase_model(),
+                                         copurchase_weight=settings.RECOMMENDATIONS_COPURCHASE_WEIGHT):
+        cache.set_many({recommendations_key(fingerprint): ids for fingerprint, ids in block.items()},
+                       BATCH_RECOMMENDATIONS_TIMEOUT)
+        saved += len(block)
+    return saved
+
+
+def evaluate_hit_rate(weights, k=10):
+    """
+    Офлайн-оценка смешивания с совместными покупками. У каждого пользователя, купившего 2+ разных
+    товара, откладывается последняя покупка; модель совместных покупок обучается без отложенных
+    покупок, и для каждого веса считается доля пользователей, у которых отложенный товар попал в топ-k
+    рекомендаций recommend_products_many — того же расчета, которым сайт и пакетный пересчет
+    заполняют кеш рекомендаций.
+    Возвращает ({вес: hit rate}, количество пользователей).
+    """
+    rows = paid_purchase_rows()
+    history = defaultdict(list)
+    for basket, _, product_id, _ in rows:
+        if basket.startswith("user_"):
+            history[basket].append(product_id)
+    held_out = {basket: products[-1] for basket, products in history.items() if len(set(products)) > 1}
+    if not held_out:
+        return {weight: 0.0 for weight in weights}, 0
+    interactions = {basket: {pk for pk in history[basket] if pk != product_id}
+                    for basket, product_id in held_out.items()}
+    copurchase = build_copurchase_model([row for row in rows if held_out.get(row[0]) != row[2]])
+
+    # модель товаров и списки похожих не зависят от покупок, отложенные товары в них не «утекают»
+    model = get_recommendation_model() or rebuild_recommendation_model()
+    product_ids = [int(pk) for pk in model.product_ids]
+    hit_rates = {}
+    for weight in weights:
+        hits = 0
+        for block in recommend_products_many(interactions, product_ids, limit=k, copurchase=copurchase,
+                                             copurchase_weight=weight):
+            hits += sum(held_out[basket] in ids for basket, ids in block.items())
+        hit_rates[weight] = hits / len(held_out)
+    return hit_rates, len(held_out)
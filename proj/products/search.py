@@ -0,0 +1,163 @@
+"""
+Полнотекстовый поиск по каталогу.
+
+Текст товара (название, категории, бренд, тип, совместимость и т.д. — см. get_product_text)
+хранится в Product.search_document и обновляется при сохранении товара.
+
+- PostgreSQL: tsvector в Product.search_vector (конфигурации russian и english) с GIN-индексом,
+  ранжирование через ts_rank.
+- Остальные СУБД (SQLite в тестах и при локальном запуске): инвертированный индекс в памяти
+  процесса, который перестраивается при смене версии индекса в кеше.
+
+Бэкенд можно переопределить настройкой PRODUCT_SEARCH_BACKEND (путь к классу).
+"""
+import math
+import re
+import uuid
+from bisect import bisect_left
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Case, F, FloatField, Q, Value, When
+from django.utils.module_loading import import_string
+
+from .models import Product
+from .utils import get_product_text
+
+SEARCH_INDEX_VERSION_KEY = "product_search_index_version"
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def normalize_text(text):
+    return text.lower().replace("ё", "е")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(normalize_text(text))
+
+
+class PostgresSearchBackend:
+    """tsvector + GIN-индекс, запрос по префиксам слов (поиск по мере ввода)."""
+
+    vector = (
+        SearchVector("name", config="russian", weight="A")
+        + SearchVector("search_document", config="russian", weight="B")
+        + SearchVector("search_document", config="english", weight="C")
+    )
+
+    def _query(self, keyword):
+        raw = " & ".join(f"{token}:*" for token in tokenize(keyword))
+        return (SearchQuery(raw, config="russian", search_type="raw")
+                | SearchQuery(raw, config="english", search_type="raw"))
+
+    def filter_q(self, keyword):
+        if not tokenize(keyword):
+            return Q(pk__in=[])
+        return Q(search_vector=self._query(keyword))
+
+    def annotate_rank(self, queryset, keyword):
+        if not tokenize(keyword):
+            return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+        return queryset.annotate(search_rank=SearchRank(F("search_vector"), self._query(keyword)))
+
+    def refresh(self, product_ids):
+        Product.objects.filter(pk__in=product_ids).update(search_vector=self.vector)
+
+
+class InvertedIndexSearchBackend:
+    """Инвертированный индекс в памяти процесса: слово -> {id товара: частота}."""
+
+    def __init__(self):
+        self._version = None
+        self._postings = {}
+        self._terms = []
+        self._doc_count = 0
+
+    def _current_version(self):
+        version = cache.get(SEARCH_INDEX_VERSION_KEY)
+        if version is None:
+            cache.add(SEARCH_INDEX_VERSION_KEY, uuid.uuid4().hex, None)
+            version = cache.get(SEARCH_INDEX_VERSION_KEY)
+        return version
+
+    def _ensure_index(self):
+        version = self._current_version()
+        if version == self._version:
+            return
+        postings = defaultdict(dict)
+        doc_count = 0
+        for pk, document in Product.objects.values_list("pk", "search_document").iterator():
+            doc_count += 1
+            for term in tokenize(document):
+                postings[term][pk] = postings[term].get(pk, 0) + 1
+        self._postings, self._terms, self._doc_count = dict(postings), sorted(postings), doc_count
+        self._version = version
+
+    def search(self, keyword):
+        """Возвращает {id товара: релевантность}; каждое слово запроса ищется как префикс."""
+        tokens = tokenize(keyword)
+        if not tokens:
+            return {}
+        self._ensure_index()
+        scores = None
+        for token in tokens:
+            token_scores = defaultdict(float)
+            i = bisect_left(self._terms, token)
+            while i < len(self._terms) and self._terms[i].startswith(token):
+                term_postings = self._postings[self._terms[i]]
+                idf = math.log(1 + self._doc_count / len(term_postings))
+                for pk, tf in term_postings.items():
+                    token_scores[pk] = max(token_scores[pk], tf * idf)
+                i += 1
+            if scores is None:
+                scores = dict(token_scores)
+            else:
+                scores = {pk: score + token_scores[pk] for pk, score in scores.items() if pk in token_scores}
+        return scores
+
+    def filter_q(self, keyword):
+        return Q(pk__in=list(self.search(keyword)))
+
+    def annotate_rank(self, queryset, keyword):
+        whens = [When(pk=pk, then=Value(score)) for pk, score in self.search(keyword).items()]
+        return queryset.annotate(
+            search_rank=Case(*whens, default=Value(0.0), output_field=FloatField())
+        )
+
+    def refresh(self, product_ids):
+        cache.set(SEARCH_INDEX_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+@lru_cache(maxsize=None)
+def get_search_backend():
+    backend_path = getattr(settings, "PRODUCT_SEARCH_BACKEND", None)
+    if backend_path:
+        return import_string(backend_path)()
+    if connection.vendor == "postgresql":
+        return PostgresSearchBackend()
+    return InvertedIndexSearchBackend()
+
+
+def update_search_index(product_ids):
+    """Пересобирает поисковый текст товаров и обновляет индекс активного бэкенда."""
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+    products = list(Product.objects.filter(pk__in=product_ids).prefetch_related("category"))
+    for product in products:
+        product.search_document = normalize_text(get_product_text(product))
+    Product.objects.bulk_update(products, ["search_document"])
+    get_search_backend().refresh(product_ids)
+
+
+def rebuild_search_index(batch_size=500):
+    """Полная перестройка поискового индекса всех товаров."""
+    product_ids = list(Product.objects.values_list("pk", flat=True))
+    for start in range(0, len(product_ids), batch_size):
+        update_search_index(product_ids[start:start + batch_size])
+    return len(product_ids)
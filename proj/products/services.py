@@ -1,312 +1,146 @@
-from django.core.cache import cache
-from django.db.models import Q, Max, Min, Exists
-from .models import Product, Category
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, F
+from django.db.models.functions import Coalesce
+from .models import Product, Category, Review
 from django.db.models import Subquery, OuterRef
 from django.db.models import Avg, Count
-from .utils import get_cached_items
+from cart.models import OrderItem
+from .utils import get_cached_items, bump_cache_scopes, category_scope, shop_scope, \
+    CATALOG_SCOPE, CATEGORY_TREE_SCOPE
+from .facets import FilterState, load_facet_rows, build_facets
+from .search import get_search_backend
+from .leaderboard import record_order_in_leaderboards, rebuild_popular_leaderboards
+
+
+def update_product_rating(product_id):
+    """Пересчитывает среднюю оценку и количество отзывов одного товара."""
+    stats = Review.objects.filter(product_id=product_id).aggregate(
+        avg_rating=Avg('rating'),
+        review_count=Count('id'),
+    )
+    Product.objects.filter(pk=product_id).update(**stats)
+
+
+def increase_products_order_count(order_id):
+    """
+    Увеличивает счётчик оплаченных заказов у товаров из подтверждённого заказа. Рейтинги популярных
+    обновляются после фиксации транзакции: при ее откате и повторной обработке заказ не учитывается дважды.
+    """
+    Product.objects.filter(orderitems__order_id=order_id).update(order_count=F('order_count') + 1)
+    transaction.on_commit(lambda: record_order_in_leaderboards(order_id))
+
+
+def invalidate_catalog_caches(shop_ids=(), category_ids=()):
+    """Инвалидирует кеши каталога, затронутые изменением товаров указанных магазинов и категорий."""
+    bump_cache_scopes(
+        CATALOG_SCOPE,
+        *(shop_scope(shop_id) for shop_id in shop_ids if shop_id is not None),
+        *(category_scope(category_id) for category_id in category_ids),
+    )
+
+
+def rebuild_product_stats():
+    """Полностью пересчитывает статистику всех товаров одним UPDATE с подзапросами."""
+    reviews = Review.objects.filter(product=OuterRef('pk')).order_by().values('product')
+    paid_items = (
+        OrderItem.objects
+        .filter(product=OuterRef('pk'), order__paid=True)
+        .order_by()
+        .values('product')
+    )
+    updated = Product.objects.update(
+        avg_rating=Subquery(reviews.annotate(avg=Avg('rating')).values('avg')),
+        review_count=Coalesce(Subquery(reviews.annotate(cnt=Count('id')).values('cnt')), 0),
+        order_count=Coalesce(Subquery(paid_items.annotate(cnt=Count('id')).values('cnt')), 0),
+    )
+    rebuild_popular_leaderboards()
+    return updated
+
+
+def load_root_categories():
+    return Category.objects.filter(parent=None).order_by("title")
 
 
 def find_shop_categories(shop, category, cache_key):
-    # пробуем взять из кэша
-    result = cache.get(cache_key)
-    if result is None:
-        if category is None:
-            # — корневая страница, без изменений —
-            products = Product.objects.filter(shop=shop)
-            # определяем корневые узлы, как раньше...
-            root_ids = (
-                Category.objects
-                .filter(products__in=products)
-                .distinct()
-                .annotate(
-                    root_id=Subquery(
-                        Category.objects
-                        .filter(tree_id=OuterRef('tree_id'), lft=1)
-                        .values('id')[:1]
-                    )
-                )
-                .values_list('root_id', flat=True)
-            )
-            qs = Category.objects.filter(id__in=root_ids).order_by('title')
-
-        else:
-            # — страница подкатегорий —
-            # 1) выбираем прямых детей текущей категории:
-            children = Category.objects.filter(parent=category)
-
-            # 2) подзапрос: ищем товары в subtree каждого child:
-            products_in_subtree = Product.objects.filter(
-                shop=shop,
-                category__tree_id=OuterRef('tree_id'),
-                # любой потомок имеет lft >= child.lft и rght <= child.rght
-                category__lft__gte=OuterRef('lft'),
-                category__rght__lte=OuterRef('rght'),
-            )
-
-            # 3) аннотируем и фильтруем только тех children, у которых существует хоть один такой товар
-            qs = (
-                children
-                .annotate(has_products=Exists(products_in_subtree))  # :contentReference[oaicite:1]{index=1}
-                .filter(has_products=True)
-                .order_by('title')
-            )
-
-        # приводим к списку и кэшируем
-        result = list(qs)
-        cache.set(cache_key, result, timeout=10 * 60)
-
-    return result
+    """
+    Категории для навигации по магазину: корневые (category is None) или прямые
+    подкатегории category, в поддереве которых у магазина есть товары.
+    """
+    if category is None:
+        qs = Category.objects.filter(level=0)
+    else:
+        qs = Category.objects.filter(parent=category)
+    # принадлежность поддеревьям материализована в ProductCategoryMembership — один join
+    qs = qs.filter(product_memberships__product__shop=shop).distinct().order_by('title')
+    return get_cached_items(cache_key, lambda: qs, scopes=(), family="shop_categories")
+
+
+def _filter_products(base_query, request, keyword=None):
+    products = Product.objects.filter(base_query & FilterState(request.GET).to_q())
+    default_sort = "-pub_date"
+    if keyword:
+        # при поиске по умолчанию сортируем по релевантности
+        products = get_search_backend().annotate_rank(products, keyword)
+        default_sort = "-search_rank"
+    return products.order_by(request.GET.get("sort_by", default_sort))
 
 
-def get_filtered_products_from_all(request, keyword):
-    filters = {
-        "product_type": "product_type__in",
-        "compatibility": "compatibility__in",
-        "thread_type": "thread_type__in",
-        "mounting_type": "mounting_type__in",
-        "imitation_of_a_shot": "imitation_of_a_shot__in",
-        "laser_sight": "laser_sight__in",
-        "weight": "weight__in",
-        "principle_of_operation": "principle_of_operation__in",
-        "diameter": "diameter__in",
-    }
-
-    queryset = Q(verified=True) & Q(show=True)
-    base_query = Q(verified=True) & Q(show=True)
-    if keyword:
-        queryset &= Q(name__icontains=keyword)
-        base_query &= Q(name__icontains=keyword)
-    min_price = request.GET.get("min_price")
-    max_price = request.GET.get("max_price")
-
-    if min_price or max_price:
-        price_range = Product.objects.filter(base_query).aggregate(Max("price"), Min("price"))
-        queryset &= Q(price__range=(min_price or price_range["price__min"], max_price or price_range["price__max"]))
-
-    min_length_get = request.GET.get("min_length", '')
-    max_length_get = request.GET.get("max_length", '')
-
-    if min_length_get or max_length_get:
-        length_range = Product.objects.filter(base_query).aggregate(Max("length"), Min("length"))
-        queryset &= Q(
-            length__range=(min_price or length_range["length__min"], max_price or length_range["length__max"]))
-
-    if request.GET.get("available", ''):
-        queryset &= Q(items_left__gt=0)
-
-    for param, field in filters.items():
-        values = request.GET.getlist(param)
-        if values:
-            queryset &= Q(**{field: values})
-
-    return Product.objects.filter(queryset).annotate(
-        avg_rating=Avg('reviews__rating'),
-        review_count=Count('reviews', distinct=True),
-        order_count=Count('orderitems', distinct=True),
-    ).order_by(request.GET.get("sort_by", "-pub_date"))
-
-
-def get_all_products_filters(keyword):
-    """Получает данные для фильтров с кешированием."""
-    filter_fields = [
-        ("price", Max, Min),
-        "product_type",
-        "compatibility",
-        "thread_type",
-        "mounting_type",
-        "imitation_of_a_shot",
-        "laser_sight",
-        "weight",
-        "principle_of_operation",
-        ("length", Max, Min),
-        "diameter",
-    ]
-
-    filters_data = {}
+def _get_facets(base_query, request, cache_key=None, scopes=(CATALOG_SCOPE,)):
+    """Фасеты области каталога; строки области кешируются, количество считается под текущие фильтры."""
+    if cache_key is None:
+        rows = load_facet_rows(base_query)
+    else:
+        rows = get_cached_items(cache_key, lambda: load_facet_rows(base_query), scopes, family="facet_rows")
+    return build_facets(rows, FilterState(request.GET))
+
+
+def _all_products_query(keyword):
     base_query = Q(verified=True) & Q(show=True)
     if keyword:
-        base_query &= Q(name__icontains=keyword)
-    for field in filter_fields:
-        if isinstance(field, tuple):
-            field_name, max_func, min_func = field
-            filters_data[f"{field_name}_data_for_filters"] = Product.objects.filter(base_query).aggregate(
-                max_func(field_name), min_func(field_name))
-        else:
-            exclude_value = None
-            filters_data[f"{field}_data_for_filters"] = Product.objects.filter(base_query).values(
-                field).distinct().exclude(**{field: exclude_value})
+        base_query &= get_search_backend().filter_q(keyword)
+    return base_query
+
+
+def _category_query(category, shop=None):
+    if settings.PRODUCT_CATEGORY_SUBTREE_LISTING:
+        # товары категории и всех ее подкатегорий
+        base_query = Q(category_memberships__category=category)
+    else:
+        base_query = Q(category=category)
+    base_query &= Q(verified=True) & Q(show=True)
+    if shop is not None:
+        base_query &= Q(shop=shop)
+    return base_query
 
-    return filters_data
+
+def get_filtered_products_from_all(request, keyword):
+    return _filter_products(_all_products_query(keyword), request, keyword)
+
+
+def get_all_products_facets(keyword, request):
+    """Фасеты для фильтров по всему каталогу (с учетом поискового запроса)."""
+    # выдача по произвольным поисковым запросам не кешируется
+    cache_key = None if keyword else "facet_rows_for_all_products_cache"
+    return _get_facets(_all_products_query(keyword), request, cache_key)
 
 
 def get_category_filtered_products(category, request):
-    filters = {
-        "product_type": "product_type__in",
-        "compatibility": "compatibility__in",
-        "thread_type": "thread_type__in",
-        "mounting_type": "mounting_type__in",
-        "imitation_of_a_shot": "imitation_of_a_shot__in",
-        "laser_sight": "laser_sight__in",
-        "weight": "weight__in",
-        "principle_of_operation": "principle_of_operation__in",
-        "diameter": "diameter__in",
-    }
-
-    queryset = Q(category=category) & Q(verified=True) & Q(show=True)
-    base_query = Q(category=category) & Q(verified=True) & Q(show=True)
-    min_price = request.GET.get("min_price")
-    max_price = request.GET.get("max_price")
-
-    if min_price or max_price:
-        price_range = get_cached_items(
-            f"price_data_for_filters_in_{category.slug}_cache",
-            Product.objects.filter(base_query).aggregate(Max("price"), Min("price"))
-        )
-        queryset &= Q(price__range=(min_price or price_range["price__min"], max_price or price_range["price__max"]))
-
-    min_length_get = request.GET.get("min_length", '')
-    max_length_get = request.GET.get("max_length", '')
-
-    if min_length_get or max_length_get:
-        length_range = get_cached_items(
-            f"length_data_for_filters_in_{category.slug}_cache",
-            Product.objects.filter(base_query).aggregate(Max("length"), Min("length"))
-        )
-        queryset &= Q(
-            length__range=(min_price or length_range["length__min"], max_price or length_range["length__max"]))
-
-    if request.GET.get("available", ''):
-        queryset &= Q(items_left__gt=0)
-
-    for param, field in filters.items():
-        values = request.GET.getlist(param)
-        if values:
-            queryset &= Q(**{field: values})
-
-    return Product.objects.filter(queryset).annotate(
-        avg_rating=Avg('reviews__rating'),
-        review_count=Count('reviews', distinct=True),
-        order_count=Count('orderitems', distinct=True),
-    ).order_by(request.GET.get("sort_by", "-pub_date"))
-
-
-def get_category_filters(category):
-    """Получает данные для фильтров по категории с кешированием."""
-    filter_fields = [
-        ("price", Max, Min),
-        "product_type",
-        "compatibility",
-        "thread_type",
-        "mounting_type",
-        "imitation_of_a_shot",
-        "laser_sight",
-        "weight",
-        "principle_of_operation",
-        ("length", Max, Min),
-        "diameter",
-    ]
-
-    filters_data = {}
-    base_query = Q(category=category) & Q(verified=True) & Q(show=True)
-    for field in filter_fields:
-        if isinstance(field, tuple):
-            field_name, max_func, min_func = field
-            filters_data[f"{field_name}_data_for_filters"] = get_cached_items(
-                f"{field_name}_data_for_filters_in_{category.slug}_cache",
-                Product.objects.filter(base_query).aggregate(max_func(field_name), min_func(field_name))
-            )
-        else:
-            exclude_value = None
-            filters_data[f"{field}_data_for_filters"] = get_cached_items(
-                f"{field}_data_for_filters_in_{category.slug}_cache",
-                Product.objects.filter(base_query).values(field).distinct().exclude(**{field: exclude_value})
-            )
-
-    return filters_data
+    return _filter_products(_category_query(category), request)
+
+
+def get_category_facets(category, request):
+    """Фасеты для фильтров по категории с кешированием."""
+    return _get_facets(_category_query(category), request, f"facet_rows_in_{category.slug}_cache",
+                       [category_scope(category.pk), CATEGORY_TREE_SCOPE])
 
 
 def get_shop_filtered_products(category, shop, request):
-    filters = {
-        "product_type": "product_type__in",
-        "compatibility": "compatibility__in",
-        "thread_type": "thread_type__in",
-        "mounting_type": "mounting_type__in",
-        "imitation_of_a_shot": "imitation_of_a_shot__in",
-        "laser_sight": "laser_sight__in",
-        "weight": "weight__in",
-        "principle_of_operation": "principle_of_operation__in",
-        "diameter": "diameter__in",
-    }
-
-    queryset = Q(category=category) & Q(shop=shop) & Q(verified=True) & Q(show=True)
-    base_query = Q(category=category) & Q(shop=shop) & Q(verified=True) & Q(show=True)
-    min_price = request.GET.get("min_price")
-    max_price = request.GET.get("max_price")
-
-    if min_price or max_price:
-        price_range = get_cached_items(
-            f"shop_{shop.slug}_price_data_for_filters_in_{category.slug}_cache",
-            Product.objects.filter(base_query).aggregate(Max("price"), Min("price"))
-        )
-        queryset &= Q(price__range=(min_price or price_range["price__min"], max_price or price_range["price__max"]))
-
-    min_length_get = request.GET.get("min_length", '')
-    max_length_get = request.GET.get("max_length", '')
-
-    if min_length_get or max_length_get:
-        length_range = get_cached_items(
-            f"shop_{shop.slug}_length_data_for_filters_in_{category.slug}_cache",
-            Product.objects.filter(base_query).aggregate(Max("length"), Min("length"))
-        )
-        queryset &= Q(
-            length__range=(min_price or length_range["length__min"], max_price or length_range["length__max"]))
-
-    if request.GET.get("available", ''):
-        queryset &= Q(items_left__gt=0)
-
-    for param, field in filters.items():
-        values = request.GET.getlist(param)
-        if values:
-            queryset &= Q(**{field: values})
-
-    return Product.objects.filter(queryset).annotate(
-        avg_rating=Avg('reviews__rating'),
-        review_count=Count('reviews', distinct=True),
-        order_count=Count('orderitems', distinct=True),
-    ).order_by(request.GET.get("sort_by", "-pub_date"))
-
-
-def get_shop_category_filters(category, shop):
-    """Получает данные для фильтров по категории с кешированием."""
-    filter_fields = [
-        ("price", Max, Min),
-        "product_type",
-        "compatibility",
-        "thread_type",
-        "mounting_type",
-        "imitation_of_a_shot",
-        "laser_sight",
-        "weight",
-        "principle_of_operation",
-        ("length", Max, Min),
-        "diameter",
-    ]
-
-    filters_data = {}
-    base_query = Q(category=category) & Q(shop=shop) & Q(verified=True) & Q(show=True)
-    for field in filter_fields:
-        if isinstance(field, tuple):
-            field_name, max_func, min_func = field
-            filters_data[f"{field_name}_data_for_filters"] = get_cached_items(
-                f"shop_{shop.slug}_{field_name}_data_for_filters_in_{category.slug}_cache",
-                Product.objects.filter(base_query).aggregate(max_func(field_name), min_func(field_name))
-            )
-        else:
-            # Если поле числовое, исключаем `None`, а не `""`
-            exclude_value = None
-            filters_data[f"{field}_data_for_filters"] = get_cached_items(
-                f"shop_{shop.slug}_{field}_data_for_filters_in_{category.slug}_cache",
-                Product.objects.filter(base_query).values(field).distinct().exclude(**{field: exclude_value})
-            )
-
-    return filters_data
+    return _filter_products(_category_query(category, shop), request)
+
+
+def get_shop_category_facets(category, shop, request):
+    """Фасеты для фильтров по категории магазина с кешированием."""
+    cache_key = f"shop_{shop.slug}_facet_rows_in_{category.slug}_cache"
+    return _get_facets(_category_query(category, shop), request, cache_key,
+                       [shop_scope(shop.pk), CATEGORY_TREE_SCOPE])
@@ -0,0 +1,135 @@
+from django.contrib.auth.signals import user_logged_in
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from mptt.signals import node_moved
+from .models import Review, Product, Category, Shop, ProductCategoryMembership
+from .services import update_product_rating, invalidate_catalog_caches
+from .search import update_search_index
+from .leaderboard import update_product_in_leaderboards
+from .recommendations import mark_products_changed
+from .recently_viewed import forget_product_card, restore_recently_viewed
+from .category_tree import update_category_memberships, update_moved_category_memberships, subtree_product_ids
+from .utils import bump_cache_scopes, shop_scope, CATEGORY_TREE_SCOPE, SHOPS_SCOPE
+
+
+def _product_category_ids(product_id):
+    return list(ProductCategoryMembership.objects.filter(product_id=product_id).values_list('category_id', flat=True))
+
+
+@receiver([post_save, post_delete], sender=Review)
+def update_rating_on_review_change(sender, instance, **kwargs):
+    # при загрузке фикстур статистика пересчитывается командой rebuild_product_stats
+    if kwargs.get('raw'):
+        return
+    update_product_rating(instance.product_id)
+    update_product_in_leaderboards(instance.product_id)
+    forget_product_card(instance.product_id)
+
+
+@receiver(post_save, sender=Product)
+def update_search_index_on_product_save(sender, instance, **kwargs):
+    # при загрузке фикстур индекс строится командой rebuild_search_index
+    if kwargs.get('raw'):
+        return
+    update_search_index([instance.pk])
+    mark_products_changed([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def invalidate_caches_on_product_save(sender, instance, **kwargs):
+    invalidate_catalog_caches([instance.shop_id], _product_category_ids(instance.pk))
+    forget_product_card(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def update_leaderboards_on_product_save(sender, instance, created, **kwargs):
+    # новый товар без отзывов в рейтинг не попадает
+    if created or kwargs.get('raw'):
+        return
+    update_product_in_leaderboards(instance.pk)
+
+
+@receiver(pre_delete, sender=Product)
+def remember_categories_on_product_delete(sender, instance, **kwargs):
+    instance._category_ids = _product_category_ids(instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def invalidate_caches_on_product_delete(sender, instance, **kwargs):
+    invalidate_catalog_caches([instance.shop_id], getattr(instance, '_category_ids', []))
+    forget_product_card(instance.pk)
+
+
+def _changed_product_ids(instance, action, reverse, pk_set):
+    """Товары, у которых изменился набор категорий (None, пока изменение не применено)."""
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            return [instance.pk]
+        return None
+    # изменение со стороны категории: instance — категория, pk_set — товары
+    if action == 'pre_clear':
+        instance._cleared_product_ids = list(instance.products.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        return list(pk_set)
+    elif action == 'post_clear':
+        return getattr(instance, '_cleared_product_ids', [])
+    return None
+
+
+@receiver(m2m_changed, sender=Product.category.through)
+def update_indexes_on_categories_change(sender, instance, action, reverse, pk_set, **kwargs):
+    product_ids = _changed_product_ids(instance, action, reverse, pk_set)
+    if product_ids is None:
+        return
+    category_ids = update_category_memberships(product_ids)
+    update_search_index(product_ids)
+    mark_products_changed(product_ids)
+    shop_ids = set(Product.objects.filter(pk__in=product_ids).values_list('shop_id', flat=True))
+    invalidate_catalog_caches(shop_ids, category_ids)
+
+
+@receiver(node_moved, sender=Category)
+def update_memberships_on_category_move(sender, instance, **kwargs):
+    # перемещение в дереве (в т.ч. перетаскиванием в админке) меняет предков всех товаров поддерева
+    category_ids = update_moved_category_memberships(instance)
+    invalidate_catalog_caches(category_ids=category_ids)
+
+
+@receiver(pre_delete, sender=Category)
+def remember_subtree_products_on_category_delete(sender, instance, **kwargs):
+    instance._subtree_product_ids = subtree_product_ids(instance)
+
+
+@receiver(post_delete, sender=Category)
+def update_memberships_on_category_delete(sender, instance, **kwargs):
+    category_ids = update_category_memberships(getattr(instance, '_subtree_product_ids', []))
+    invalidate_catalog_caches(category_ids=category_ids)
+    bump_cache_scopes(CATEGORY_TREE_SCOPE)
+
+
+@receiver(post_save, sender=Category)
+def update_search_index_on_category_save(sender, instance, created, **kwargs):
+    if created or kwargs.get('raw'):
+        return
+    product_ids = list(instance.products.values_list('pk', flat=True))
+    update_search_index(product_ids)
+    mark_products_changed(product_ids)
+
+
+@receiver(post_save, sender=Category)
+def invalidate_caches_on_category_save(sender, instance, **kwargs):
+    bump_cache_scopes(CATEGORY_TREE_SCOPE)
+
+
+@receiver([post_save, post_delete], sender=Shop)
+def invalidate_caches_on_shop_change(sender, instance, **kwargs):
+    bump_cache_scopes(SHOPS_SCOPE, shop_scope(instance.pk))
+    cache.delete(f"shop_{instance.slug}_info_cache")
+
+
+@receiver(user_logged_in)
+def restore_recently_viewed_on_login(sender, request, user, **kwargs):
+    # список просмотров переносится с других устройств пользователя
+    if request is not None and hasattr(request, 'session'):
+        restore_recently_viewed(request, user)
@@ -1,17 +1,17 @@
 from proj.celery import app
 from .models import Product
+from django.conf import settings
 from django.core.cache import cache
 from django.db.models import Q
-from django.utils import timezone
-from datetime import timedelta
-import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from cart.models import Order
-from .utils import get_product_text
-from scipy.sparse import hstack, csr_matrix
-from sklearn.preprocessing import MinMaxScaler
-# import matplotlib.pyplot as plt
+from .leaderboard import rebuild_popular_leaderboards
+from .recommendations import rebuild_recommendation_model, refresh_recommendation_model, \
+    compute_product_neighbors, recommend_products, compute_active_users_recommendations, get_copurchase_model, \
+    rebuild_copurchase_model, get_purchased_product_ids, interactions_fingerprint, recommendations_key, \
+    RECOMMENDATIONS_TIMEOUT
+import logging
+import time
+
+logger = logging.getLogger('django')
 
 
 @app.task
@@ -20,19 +20,14 @@ def find_recommended_products_for_user(user_pk, viewed_product_ids=None):
         Находит и кеширует персональные рекомендации для пользователя:
         - учитываются покупки за последние 3 месяца (Order.created)
         - последние просмотры из переданного списка viewed_product_ids
-        Результат — список из топ‑10 товаров, схожих по TF‑IDF профилю.
+        Результат — список id топ‑10 товаров, схожих по TF‑IDF профилю
+        (модель товаров строится заранее, см. products/recommendations.py),
+        под ключом отпечатка истории: его используют все пользователи с такой же историей.
         """
     queryset = Q(verified=True) & Q(show=True) & Q(items_left__gt=0)
-    now = timezone.now()
-    three_months_ago = now - timedelta(days=90)
 
-    # 1) Собираем купленные за 3 месяца товары
-    purchased_ids = (
-        Order.objects
-        .filter(user__pk=user_pk, created__gte=three_months_ago)
-        .values_list('items__product', flat=True)
-        .distinct()
-    )
+    # 1) Купленные за 3 месяца товары
+    purchased_ids = get_purchased_product_ids(user_pk)
 
     # 2) Используем переданный из сессии список последних просмотров
     if viewed_product_ids is None:
@@ -45,53 +40,74 @@ def find_recommended_products_for_user(user_pk, viewed_product_ids=None):
     interacted_ids = set(purchased_ids) | set(viewed_product_ids)
 
     if interacted_ids:
-        # 4) Товары пользователя и кандидаты
-        user_prods = list(Product.objects.filter(id__in=interacted_ids))
-        candidates = list(
+        candidate_ids = list(
             Product.objects
             .filter(queryset)
             .exclude(id__in=interacted_ids)
-        ) or list(Product.objects.filter(queryset))
-
-        # 5) Тексты для TF-IDF
-        user_texts = [get_product_text(p) for p in user_prods]
-        cand_texts = [get_product_text(p) for p in candidates]
-
-        vectorizer = TfidfVectorizer(stop_words='english')
-        cand_tfidf = vectorizer.fit_transform(cand_texts)
-        user_tfidf = vectorizer.transform(user_texts)
-
-        # 6) Нормализация цены (MinMax → [0,1])
-        cand_prices = np.array([p.price for p in candidates]).reshape(-1, 1)
-        user_prices = np.array([p.price for p in user_prods]).reshape(-1, 1)
-        scaler = MinMaxScaler()  # нормирует в диапазон [0,1] :contentReference[oaicite:0]{index=0}
-        scaler.fit(np.vstack([cand_prices, user_prices]))
-        cand_price_norm = scaler.transform(cand_prices)
-        user_price_norm = scaler.transform(user_prices)
-
-        # 7) Преобразуем цены в CSR и объединяем с TF-IDF :contentReference[oaicite:1]{index=1}
-        cand_price_sp = csr_matrix(cand_price_norm)
-        user_price_sp = csr_matrix(user_price_norm)
-
-        cand_combined = hstack([cand_tfidf, cand_price_sp])
-        user_combined = hstack([user_tfidf, user_price_sp])
-
-        # 8) Профиль пользователя и вычисление cosine_similarity
-        # ----- Вот ключевое изменение: превращаем numpy.matrix в ndarray -----
-        raw_profile = user_combined.mean(axis=0)  # это возвращает numpy.matrix :contentReference[oaicite:0]{index=0}
-        user_profile = np.asarray(raw_profile)  # теперь обычный numpy.ndarray :contentReference[oaicite:1]{index=1}
-        sims = cosine_similarity(user_profile, cand_combined)[0]
-
-        # 9) Сортировка
-        scored = sorted(zip(candidates, sims), key=lambda x: x[1], reverse=True)
-
-        # Выбираем топ-10 наиболее похожих товаров и кешируем на 1 час
-        cache.set(f"recommended_products_cache_user_{user_pk}", [prod for prod, _ in scored[:10]],
-                  60 * 60)
-
-        # plt.figure()
-        # plt.hist(sims, bins=20)
-        # plt.xlabel('Косинусное сходство')
-        # plt.ylabel('Кол-во товаров')
-        # plt.title('Гистограмма распределения сходства')
-        # plt.show()
+            .values_list('pk', flat=True)
+        ) or list(Product.objects.filter(queryset).values_list('pk', flat=True))
+
+        # 4) Объединяем готовые списки похожих товаров (ProductNeighbor), смешивая их с оценкой
+        #    по совместным покупкам (products/copurchase.py); если похожих не хватило, добираем
+        #    по близости профиля пользователя в заранее обученной модели
+        recommended_ids = recommend_products(interacted_ids, candidate_ids, limit=10,
+                                             copurchase=get_copurchase_model(),
+                                             copurchase_weight=settings.RECOMMENDATIONS_COPURCHASE_WEIGHT)
+
+        # Кешируем id топ-10 наиболее похожих товаров на 1 час
+        cache.set(recommendations_key(interactions_fingerprint(interacted_ids)), recommended_ids,
+                  RECOMMENDATIONS_TIMEOUT)
+
+
+@app.task
+def update_recommendation_model(full=False):
+    """Обновляет модель рекомендаций: инкрементально или (full=True) с переобучением словаря."""
+    try:
+        model = rebuild_recommendation_model() if full else refresh_recommendation_model()
+        logger.info(f"Recommendation model updated: {len(model.product_ids)} products")
+    except Exception as e:
+        logger.error(f"Error updating recommendation model: {str(e)}")
+
+
+@app.task
+def update_copurchase_model():
+    """Перестраивает модель совместных покупок по оплаченным заказам (Celery beat)."""
+    try:
+        model = rebuild_copurchase_model()
+        logger.info(f"Co-purchase model updated: {len(model.product_ids)} products, "
+                    f"{model.similarity.nnz} links")
+    except Exception as e:
+        logger.error(f"Error updating co-purchase model: {str(e)}")
+
+
+@app.task
+def update_active_users_recommendations():
+    """Пакетно пересчитывает рекомендации всех активных пользователей (Celery beat)."""
+    try:
+        started = time.perf_counter()
+        profiles = compute_active_users_recommendations()
+        elapsed = time.perf_counter() - started
+        logger.info(f"Recommendations updated for {profiles} user profiles in {elapsed:.1f}s "
+                    f"({profiles / elapsed if elapsed else 0:.0f} profiles/s)")
+    except Exception as e:
+        logger.error(f"Error updating users recommendations: {str(e)}")
+
+
+@app.task
+def update_popular_leaderboards():
+    """Полная перестройка рейтингов популярных товаров (Celery beat)."""
+    try:
+        count = rebuild_popular_leaderboards()
+        logger.info(f"Popular leaderboards rebuilt for {count} products")
+    except Exception as e:
+        logger.error(f"Error rebuilding popular leaderboards: {str(e)}")
+
+
+@app.task
+def update_product_neighbors():
+    """Пересчитывает списки похожих товаров (Celery beat)."""
+    try:
+        links = compute_product_neighbors()
+        logger.info(f"Product neighbors updated: {links} links")
+    except Exception as e:
+        logger.error(f"Error updating product neighbors: {str(e)}")
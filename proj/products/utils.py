@@ -1,13 +1,193 @@
+import math
+import random
+import time
+import uuid
+from dataclasses import dataclass
+
+from django.apps import apps
 from django.core.cache import cache
+from django.db import router
+from django.db.models import DEFERRED, QuerySet
 from django.shortcuts import get_object_or_404
 
 from products.models import Shop
 
-CACHE_TIMEOUT = 10 * 60  # 10 минут
+# Кеши каталога версионируются по областям (см. versioned_key), поэтому живут долго:
+# при изменении данных сигналы меняют версию области и старые ключи просто перестают читаться
+CACHE_TIMEOUT = 6 * 60 * 60  # 6 часов
+CACHE_LOCK_TIMEOUT = 30  # максимальное время вычисления значения под блокировкой
+CACHE_LOCK_WAIT = 5  # сколько ждать значения, которое вычисляет другой процесс
+CACHE_LOCK_POLL_INTERVAL = 0.05
+CACHE_STALE_TIMEOUT = 10 * 60  # сколько после срока можно отдавать устаревшее значение, пока оно обновляется
+XFETCH_BETA = 1.0  # > 1 — обновлять раньше, < 1 — позже
+
+# Семейства ключей для метрик попаданий/промахов (см. get_cache_metrics)
+CACHE_FAMILIES = ("categories", "subcategories", "shops", "shop_categories", "facet_rows")
+
+_MISSING = object()
+
+# Области кеша
+CATALOG_SCOPE = "catalog"  # любые товары каталога
+CATEGORY_TREE_SCOPE = "category_tree"  # дерево категорий
+SHOPS_SCOPE = "shops"  # список магазинов
+
+
+def category_scope(category_id):
+    """Товары категории и ее подкатегорий."""
+    return f"category_{category_id}"
+
+
+def shop_scope(shop_id):
+    """Товары магазина."""
+    return f"shop_{shop_id}"
+
+
+def _version_key(scope):
+    return f"cache_version_{scope}"
+
+
+def versioned_key(key, *scopes):
+    """Ключ кеша с текущими версиями областей, от которых зависит значение."""
+    version_keys = [_version_key(scope) for scope in scopes]
+    versions = cache.get_many(version_keys)
+    for version_key in version_keys:
+        if version_key not in versions:
+            cache.add(version_key, uuid.uuid4().hex, None)
+            versions[version_key] = cache.get(version_key)
+    return ":".join([key] + [f"{scope}={versions[k]}" for scope, k in zip(scopes, version_keys)])
+
+
+def bump_cache_scopes(*scopes):
+    """Инвалидирует все кеши, зависящие от переданных областей."""
+    cache.set_many({_version_key(scope): uuid.uuid4().hex for scope in set(scopes)}, None)
+
+
+def _record_cache_metric(family, outcome):
+    key = f"cache_metrics_{family}_{outcome}"
+    try:
+        cache.incr(key)
+    except ValueError:
+        # счетчика еще нет (или он вытеснен) — создаем
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def get_cache_metrics(*families):
+    """Количество попаданий и промахов кеша по семействам ключей."""
+    families = families or CACHE_FAMILIES
+    outcomes = ("hits", "misses")
+    keys = {(family, outcome): f"cache_metrics_{family}_{outcome}" for family in families for outcome in outcomes}
+    values = cache.get_many(keys.values())
+    return {family: {outcome: values.get(keys[(family, outcome)], 0) for outcome in outcomes} for family in families}
+
+
+@dataclass
+class ModelRows:
+    """
+    Результат QuerySet в кеше: значения полей модели, а не pickle ее экземпляров. Такие строки
+    компактнее и переживают изменение схемы между выкладками: поля, которых нет в строке,
+    загружаются отложенно, лишние игнорируются. Аннотации и prefetch в кеш не попадают.
+    """
+    model: str
+    rows: list
+
+    @classmethod
+    def from_queryset(cls, queryset):
+        fields = [field.attname for field in queryset.model._meta.concrete_fields]
+        return cls(queryset.model._meta.label, list(queryset.values(*fields)))
+
+    def instances(self):
+        """Экземпляры модели без запросов к БД, как если бы они были загружены QuerySet."""
+        model = apps.get_model(self.model)
+        fields = [field.attname for field in model._meta.concrete_fields]
+        db = router.db_for_read(model)
+        return [model.from_db(db, fields, [row.get(field, DEFERRED) for field in fields]) for row in self.rows]
+
+
+def _evaluate(loader):
+    value = loader()
+    # в кеш кладем только вычисленные данные, а не ленивые QuerySet
+    if isinstance(value, QuerySet):
+        value = ModelRows.from_queryset(value)
+    return value
+
+
+def _cached_value(value):
+    return value.instances() if isinstance(value, ModelRows) else value
+
+
+@dataclass
+class CachedValue:
+    """Значение в кеше вместе со временем его вычисления и логическим сроком жизни."""
+    value: object
+    delta: float
+    expires_at: float
+
+
+def store_cached_items(key, loader):
+    """Вычисляет значение и кладет его в кеш; физически ключ живет дольше, чтобы отдавать устаревшее."""
+    started = time.monotonic()
+    value = _evaluate(loader)
+    delta = time.monotonic() - started
+    cache.set(key, CachedValue(value, delta, time.time() + CACHE_TIMEOUT), CACHE_TIMEOUT + CACHE_STALE_TIMEOUT)
+    return _cached_value(value)
+
+
+def _should_refresh(entry):
+    # XFetch: чем дольше считается значение и чем ближе срок, тем вероятнее досрочное обновление
+    return time.time() - entry.delta * XFETCH_BETA * math.log(random.random() or 1e-12) >= entry.expires_at
+
+
+def _refresh(key, loader):
+    lock_key = f"{key}:lock"
+    if not cache.add(lock_key, 1, CACHE_LOCK_TIMEOUT):
+        # значение уже обновляет другой процесс
+        return
+    try:
+        store_cached_items(key, loader)
+    finally:
+        cache.delete(lock_key)
+
+
+def get_cached_items(key, loader, scopes=(CATALOG_SCOPE,), family=None):
+    """
+    Cache-aside: значение берется из кеша, а при промахе вычисляется вызовом loader().
+
+    Пока один процесс вычисляет значение (блокировка через cache.add), остальные
+    ждут его результата, а не идут в БД одновременно. Незадолго до истечения срока
+    (XFetch) или после него значение обновляет один запрос, а остальные получают
+    текущее (stale-while-revalidate).
+    QuerySet хранится строками полей (ModelRows) и возвращается списком экземпляров модели.
+    Попадания и промахи считаются по семейству ключей family (по умолчанию — сам ключ).
+    """
+    family = family or key
+    key = versioned_key(key, *scopes)
+    entry = cache.get(key, _MISSING)
+    if entry is not _MISSING:
+        _record_cache_metric(family, "hits")
+        # значения, записанные напрямую через cache.set, отдаются как есть
+        if not isinstance(entry, CachedValue):
+            return entry
+        if _should_refresh(entry):
+            _refresh(key, loader)
+        return _cached_value(entry.value)
+    _record_cache_metric(family, "misses")
 
+    lock_key = f"{key}:lock"
+    if cache.add(lock_key, 1, CACHE_LOCK_TIMEOUT):
+        try:
+            return store_cached_items(key, loader)
+        finally:
+            cache.delete(lock_key)
 
-def get_cached_items(key, queryset):
-    return cache.get_or_set(key, queryset, CACHE_TIMEOUT)
+    deadline = time.monotonic() + CACHE_LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(CACHE_LOCK_POLL_INTERVAL)
+        entry = cache.get(key, _MISSING)
+        if entry is not _MISSING:
+            return _cached_value(entry.value) if isinstance(entry, CachedValue) else entry
+    # не дождались — считаем сами, не трогая кеш
+    return _cached_value(_evaluate(loader))
 
 
 def get_product_text(product):
@@ -2,61 +2,56 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.core.paginator import Paginator
 from cart.cart import Cart
 from .models import Product, Category, Shop, Review
-from .services import get_category_filtered_products, get_category_filters, \
-    get_shop_category_filters, get_shop_filtered_products, find_shop_categories, get_all_products_filters, \
-    get_filtered_products_from_all
-from .utils import get_cached_items, set_shop_info_cache
-from django.db.models import Q
+from .services import get_category_filtered_products, get_category_facets, \
+    get_shop_category_facets, get_shop_filtered_products, find_shop_categories, get_all_products_facets, \
+    get_filtered_products_from_all, load_root_categories
+from .leaderboard import get_popular_products
+from .recommendations import get_similar_products
+from .recently_viewed import add_recently_viewed
+from .utils import get_cached_items, set_shop_info_cache, versioned_key, shop_scope, CATEGORY_TREE_SCOPE, \
+    SHOPS_SCOPE
+from .pagination import paginate_products
 from .forms import ReviewForm
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from cart.models import OrderItem
-from django.db.models import Avg, Count
 from django.urls import reverse
 from django.core.cache import cache
 
 
 def index(request):
-    queryset = Q(verified=True) & Q(show=True)
-    products = get_cached_items("10_popular_products_cache",
-                                Product.objects.filter(queryset).annotate(
-                                    avg_rating=Avg('reviews__rating'),
-                                    review_count=Count('reviews', distinct=True),
-                                    order_count=Count('orderitems', distinct=True),
-                                ).filter(
-                                    avg_rating__gte=4  # Только товары со средним рейтингом >= 4
-                                ).order_by('-order_count')[:10])
+    products = get_popular_products()
     context = {"products": products}
     return render(request, "products/index.html", context)
 
 
 def all_products(request):
     keyword = request.GET.get("q")
-    filters_data = get_all_products_filters(keyword)
+    facets = get_all_products_facets(keyword, request)
     products = get_filtered_products_from_all(request, keyword)
 
-    paginator = Paginator(products, request.GET.get("prod_count", 24))
-    page_obj = paginator.get_page(request.GET.get("page"))
+    page_obj = paginate_products(request, products)
 
     context = {
         "keyword": keyword,
         "page_obj": page_obj,
-        "sort_parameter": request.GET.get("sort_by", "-pub_date"),
-        **filters_data
+        "sort_parameter": request.GET.get("sort_by", "-search_rank" if keyword else "-pub_date"),
+        "facets": facets,
     }
     return render(request, "products/all_products.html", context)
 
 
 def categories(request):
-    categories = get_cached_items("categories_without_parents_cache",
-                                  Category.objects.filter(parent=None).order_by("title"))
+    categories = get_cached_items("categories_without_parents_cache", load_root_categories,
+                                  [CATEGORY_TREE_SCOPE], family="categories")
     context = {"categories": categories}
     return render(request, "products/categories.html", context)
 
 
 def subcategories(request, slug):
     category = get_object_or_404(Category, slug=slug)
-    subcategories = get_cached_items(f"{slug}_subcategories_cache", Category.objects.filter(parent=category))
+    subcategories = get_cached_items(f"{slug}_subcategories_cache", lambda: Category.objects.filter(parent=category),
+                                     [CATEGORY_TREE_SCOPE], family="subcategories")
     context = {"subcategories": subcategories, "category": category}
     return render(request, "products/subcategories.html", context)
 
@@ -64,20 +59,20 @@ def subcategories(request, slug):
 def category_products(request, slug):
     category = get_object_or_404(Category, slug=slug)
 
-    filters_data = get_category_filters(category)
+    facets = get_category_facets(category, request)
     products = get_category_filtered_products(category, request)
 
-    paginator = Paginator(products, request.GET.get("prod_count", 24))
-    page_obj = paginator.get_page(request.GET.get("page"))
+    page_obj = paginate_products(request, products)
 
     context = {"category": category, "page_obj": page_obj, "sort_parameter": request.GET.get("sort_by", "-pub_date"),
-               **filters_data}
+               "facets": facets}
     return render(request, "products/category_list.html", context)
 
 
 def shops(request):
     shops = get_cached_items("shops_cache",
-                             Shop.objects.filter(verified=True).order_by("title"))
+                             lambda: Shop.objects.filter(verified=True).order_by("title"), [SHOPS_SCOPE],
+                             family="shops")
     paginator = Paginator(shops, 24)
     page_obj = paginator.get_page(request.GET.get("page"))
     context = {"shops": page_obj}
@@ -86,7 +81,7 @@ def shops(request):
 
 def shop_categories(request, shop_slug):
     shop = get_object_or_404(Shop, slug=shop_slug)
-    cache_key = f"shop_{shop_slug}_categories_cache"
+    cache_key = versioned_key(f"shop_{shop_slug}_categories_cache", shop_scope(shop.pk), CATEGORY_TREE_SCOPE)
 
     root_categories = find_shop_categories(shop, None, cache_key)
 
@@ -105,7 +100,8 @@ def shop_categories(request, shop_slug):
 def shop_subcategories(request, shop_slug, slug):
     shop = get_object_or_404(Shop, slug=shop_slug)
     category = get_object_or_404(Category, slug=slug)
-    cache_key = f"shop_{shop_slug}_category_{slug}_subcategories_cache"
+    cache_key = versioned_key(f"shop_{shop_slug}_category_{slug}_subcategories_cache",
+                              shop_scope(shop.pk), CATEGORY_TREE_SCOPE)
 
     root_categories = find_shop_categories(shop, category, cache_key)
 
@@ -126,11 +122,10 @@ def shop_category_products(request, shop_slug, slug):
     shop = get_object_or_404(Shop, slug=shop_slug)
     category = get_object_or_404(Category, slug=slug)
 
-    filters_data = get_shop_category_filters(category, shop)
+    facets = get_shop_category_facets(category, shop, request)
     products = get_shop_filtered_products(category, shop, request)
 
-    paginator = Paginator(products, request.GET.get("prod_count", 24))
-    page_obj = paginator.get_page(request.GET.get("page"))
+    page_obj = paginate_products(request, products)
 
     if not cache.get(f"shop_{shop_slug}_info_cache"):
         set_shop_info_cache(shop_slug)
@@ -141,7 +136,7 @@ def shop_category_products(request, shop_slug, slug):
         "shop": shop,
         "page_obj": page_obj,
         "sort_parameter": request.GET.get("sort_by", "-pub_date"),
-        **filters_data,
+        "facets": facets,
         "shop_info": shop_info,
     }
     return render(request, "products/shop_category_list.html", context)
@@ -149,31 +144,10 @@ def shop_category_products(request, shop_slug, slug):
 
 def product_detail(request, product_id):
     product = get_object_or_404(Product, pk=product_id)
-    # --- Работа с сессией: сохраняем в ключе 'recently_viewed' ---
-    session_key = 'recently_viewed'
-    recent = request.session.get(session_key, [])
-
-    # Убираем дубликат, если товар уже есть в списке
-    if product_id in recent:
-        recent.remove(product_id)
-    # Вставляем в начало
-    recent.insert(0, product_id)
-    # Оставляем только 10 последних
-    recent = recent[:10]
-
-    # Сохраняем обратно в сессию
-    request.session[session_key] = recent
-    # При мутировании списка желательно отметить, что сессия изменилась
-    request.session.modified = True  # :contentReference[oaicite:0]{index=0}
-
-    in_cart = str(product_id) in Cart(request).cart
-
-    reviews_stats = product.reviews.aggregate(
-        avg_rating=Avg('rating'),
-        reviews_count=Count('id')
-    )
-    avg_rating = reviews_stats.get('avg_rating')
-    reviews_count = reviews_stats.get('reviews_count')
+    # Сессия перезаписывается, только если товара не было первым в списке просмотренных
+    add_recently_viewed(request, product.pk)
+
+    in_cart = product_id in Cart(request)
 
     # Определяем, может ли пользователь оставить новый отзыв
     can_review = False
@@ -186,9 +160,10 @@ def product_detail(request, product_id):
     context = {
         "product": product,
         "in_cart": in_cart,
-        "avg_rating": avg_rating,
-        "reviews_count": reviews_count,
+        "avg_rating": product.avg_rating,
+        "reviews_count": product.review_count,
         "can_review": can_review,
+        "similar_products": get_similar_products(product.pk),
     }
     return render(request, "products/product_detail.html", context)
 
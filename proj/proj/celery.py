@@ -23,6 +23,47 @@ app.conf.beat_schedule = {
         'task': 'cart.tasks.create_monthly_reports',
         'schedule': crontab(day_of_month='28', hour=0, minute=0),
     },
+    'process-payment-outbox': {
+        'task': 'cart.tasks.process_payment_outbox',
+        'schedule': crontab(minute='*/5'),
+    },
+    'process-pending-payment-events': {
+        'task': 'cart.tasks.process_pending_payment_events',
+        'schedule': crontab(minute='*/5'),
+    },
+    'drain-payment-webhook-inbox': {
+        'task': 'cart.tasks.drain_payment_webhook_inbox',
+        'schedule': crontab(minute='*'),
+    },
+    'release-expired-stock-reservations': {
+        'task': 'cart.tasks.release_expired_stock_reservations',
+        'schedule': crontab(minute='*/5'),
+    },
+    'update-popular-leaderboards': {
+        'task': 'products.tasks.update_popular_leaderboards',
+        'schedule': crontab(minute='*/15'),
+    },
+    'update-recommendation-model': {
+        'task': 'products.tasks.update_recommendation_model',
+        'schedule': crontab(minute='*/10'),
+    },
+    'retrain-recommendation-model': {
+        'task': 'products.tasks.update_recommendation_model',
+        'schedule': crontab(hour=4, minute=0),
+        'kwargs': {'full': True},
+    },
+    'update-copurchase-model': {
+        'task': 'products.tasks.update_copurchase_model',
+        'schedule': crontab(hour=4, minute=15),
+    },
+    'update-active-users-recommendations': {
+        'task': 'products.tasks.update_active_users_recommendations',
+        'schedule': crontab(minute=20),
+    },
+    'update-product-neighbors': {
+        'task': 'products.tasks.update_product_neighbors',
+        'schedule': crontab(hour=4, minute=30),
+    },
 }
 
 
@@ -233,3 +233,49 @@ DEBUG_TOOLBAR_CONFIG = {"SHOW_TOOLBAR_CALLBACK": show_toolbar_callback}
 # Yookassa
 YOOKASSA_SECRET_KEY = os.getenv('YOOKASSA_SECRET_KEY')
 YOOKASSA_SHOP_ID = os.getenv('YOOKASSA_SHOP_ID')
+# Быстрый ответ на вебхук: уведомление сохраняется как есть и разбирается пачками в Celery (cart/payments.py)
+YOOKASSA_WEBHOOK_FAST_ACK = os.getenv('YOOKASSA_WEBHOOK_FAST_ACK', 'False') == 'True'
+YOOKASSA_WEBHOOK_BATCH_SIZE = int(os.getenv('YOOKASSA_WEBHOOK_BATCH_SIZE', 100))
+# Сколько раз process_payment_outbox повторяет запрос на оплату, прежде чем отменить заказ
+PAYMENT_OUTBOX_MAX_ATTEMPTS = int(os.getenv('PAYMENT_OUTBOX_MAX_ATTEMPTS', 5))
+
+# Бэкенд поиска по каталогу (путь к классу). По умолчанию выбирается по СУБД:
+# PostgreSQL - tsvector с GIN-индексом, иначе - инвертированный индекс в памяти (products/search.py)
+PRODUCT_SEARCH_BACKEND = os.getenv('PRODUCT_SEARCH_BACKEND')
+
+# Keyset-пагинация списков товаров (без OFFSET и COUNT(*) на каждую страницу), см. products/pagination.py
+PRODUCT_KEYSET_PAGINATION = os.getenv('PRODUCT_KEYSET_PAGINATION', 'False') == 'True'
+
+# Показывать на странице категории товары всех ее подкатегорий (по ProductCategoryMembership),
+# а не только товары, привязанные к категории напрямую
+PRODUCT_CATEGORY_SUBTREE_LISTING = os.getenv('PRODUCT_CATEGORY_SUBTREE_LISTING', 'False') == 'True'
+
+# Файл модели товаров для персональных рекомендаций (products/recommendations.py)
+RECOMMENDATIONS_MODEL_PATH = os.getenv('RECOMMENDATIONS_MODEL_PATH',
+                                       os.path.join(BASE_DIR, 'ml_models', 'recommendations.npz'))
+
+# Рекомендации пересчитываются пакетно для пользователей, заходивших или заказывавших за это число дней
+RECOMMENDATIONS_ACTIVE_DAYS = int(os.getenv('RECOMMENDATIONS_ACTIVE_DAYS', 30))
+
+# Модель совместных покупок (products/copurchase.py) и ее вес при смешивании с TF-IDF оценкой:
+# 0 — только контентные рекомендации. Вес подбирается командой evaluate_recommendations
+RECOMMENDATIONS_COPURCHASE_MODEL_PATH = os.getenv('RECOMMENDATIONS_COPURCHASE_MODEL_PATH',
+                                                  os.path.join(BASE_DIR, 'ml_models', 'copurchase.npz'))
+RECOMMENDATIONS_COPURCHASE_WEIGHT = float(os.getenv('RECOMMENDATIONS_COPURCHASE_WEIGHT', 0.3))
+
+# Хранить недавно просмотренные товары авторизованных пользователей в БД, чтобы список
+# переносился между устройствами (products/recently_viewed.py)
+RECENTLY_VIEWED_PERSIST = os.getenv('RECENTLY_VIEWED_PERSIST', 'True') == 'True'
+
+# Сколько минут товары заказа остаются зарезервированными в ожидании оплаты (cart/stock.py)
+STOCK_RESERVATION_MINUTES = int(os.getenv('STOCK_RESERVATION_MINUTES', 30))
+
+# Провайдер тарифов доставки (путь к классу, cart/carriers.py). По умолчанию — локальная тарифная
+# сетка СДЭК; cart.carriers.CdekRateProvider запрашивает API СДЭК с откатом на сетку по таймауту
+SHIPPING_RATE_PROVIDER = os.getenv('SHIPPING_RATE_PROVIDER')
+CDEK_API_URL = os.getenv('CDEK_API_URL', 'https://api.cdek.ru')
+CDEK_CLIENT_ID = os.getenv('CDEK_CLIENT_ID')
+CDEK_CLIENT_SECRET = os.getenv('CDEK_CLIENT_SECRET')
+CDEK_TIMEOUT = float(os.getenv('CDEK_TIMEOUT', 2))  # секунд на расчет всей корзины
+CDEK_MAX_WORKERS = int(os.getenv('CDEK_MAX_WORKERS', 8))
+CDEK_WEIGHT_STEP = int(os.getenv('CDEK_WEIGHT_STEP', 100))  # шаг веса в граммах для кеша тарифов
@@ -0,0 +1,126 @@
+import json
+import threading
+import time
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cart.carriers import CdekRateProvider, TariffTableRateProvider, get_rate_provider
+from cart.services import get_cdek_shipping_cost
+
+
+class FakeCdek:
+    """Локальный сервер с OAuth и калькулятором тарифов СДЭК: цена = вес в граммах / 10."""
+
+    def __init__(self, delay=0.0, fail_cities=()):
+        self.delay = delay
+        self.fail_cities = set(fail_cities)
+        self.tariff_requests = []
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path == "/v2/oauth/token":
+                    return self._reply(200, {"access_token": "token", "expires_in": 3600})
+                request = json.loads(body)
+                fake.tariff_requests.append(request)
+                time.sleep(fake.delay)
+                if self.headers.get("Authorization") != "Bearer token":
+                    return self._reply(401, {})
+                if request["from_location"]["city"] in fake.fail_cities:
+                    return self._reply(500, {})
+                return self._reply(200, {"total_sum": request["packages"][0]["weight"] / 10})
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def provider(server, timeout=2.0):
+    return CdekRateProvider(base_url=server.url, client_id="id", client_secret="secret", timeout=timeout,
+                            max_workers=4, weight_step=100)
+
+
+def test_default_provider_uses_tariff_table(settings):
+    get_rate_provider.cache_clear()
+    settings.SHIPPING_RATE_PROVIDER = None
+    try:
+        assert isinstance(get_rate_provider(), TariffTableRateProvider)
+    finally:
+        get_rate_provider.cache_clear()
+
+
+def test_cdek_provider_quotes_groups_with_bucketed_weights():
+    with FakeCdek() as server:
+        costs = provider(server).quote_many(["Москва", "Казань"], [Decimal("1.23"), 2], "Тула", "Курьером")
+
+    assert costs == [Decimal("130"), Decimal("200")]
+    assert sorted(request["from_location"]["city"] for request in server.tariff_requests) == ["Казань", "Москва"]
+    assert {request["to_location"]["city"] for request in server.tariff_requests} == {"Тула"}
+    assert {request["tariff_code"] for request in server.tariff_requests} == {137}
+
+
+def test_cdek_provider_caches_by_route_and_weight_bucket():
+    with FakeCdek() as server:
+        rates = provider(server)
+        rates.quote_many(["Москва"], [Decimal("1.21")], "Тула", "Пункт выдачи")
+        # тот же маршрут (в другом написании) и та же ступень веса — из кеша
+        assert rates.quote_many([" г. москва"], [Decimal("1.29")], "тула ", "Пункт выдачи") == [Decimal("130")]
+        assert len(server.tariff_requests) == 1
+        rates.quote_many(["Москва"], [Decimal("1.31")], "Тула", "Пункт выдачи")
+        assert len(server.tariff_requests) == 2
+
+
+def test_cdek_provider_requests_groups_concurrently():
+    with FakeCdek(delay=0.3) as server:
+        started = time.monotonic()
+        costs = provider(server).quote_many(["Москва", "Казань", "Тула"], [1, 1, 1], "Омск", "Курьером")
+        elapsed = time.monotonic() - started
+
+    assert costs == [Decimal("100")] * 3
+    assert elapsed < 0.8
+
+
+def test_slow_cdek_falls_back_to_tariff_table():
+    with FakeCdek(delay=1.0) as server:
+        started = time.monotonic()
+        costs = provider(server, timeout=0.2).quote_many(["Москва"], [Decimal("2.5")], "Казань", "Курьером")
+        elapsed = time.monotonic() - started
+
+    assert costs == [get_cdek_shipping_cost("москва", "казань", Decimal("2.5"), "Курьером")]
+    assert elapsed < 0.6
+
+
+def test_cdek_errors_fall_back_per_group():
+    with FakeCdek(fail_cities={"Казань"}) as server:
+        costs = provider(server).quote_many(["Москва", "Казань"], [1, 1], "Тула", "Пункт выдачи")
+
+    assert costs == [Decimal("100"), get_cdek_shipping_cost("казань", "тула", 1, "Пункт выдачи")]
+
+
+def test_unreachable_cdek_falls_back_to_tariff_table():
+    server = FakeCdek()
+    server.server.server_close()
+    costs = provider(server, timeout=0.5).quote_many(["Москва"], [1], "Казань", "Курьером")
+    assert costs == [get_cdek_shipping_cost("москва", "казань", 1, "Курьером")]
@@ -0,0 +1,107 @@
+from datetime import timedelta
+from decimal import Decimal
+
+import pytest
+from django.utils import timezone
+from yookassa import Payment
+from yookassa.domain.exceptions import BadRequestError
+
+from cart.checkout import get_shipping_address, place_order, send_payment
+from cart.models import Order, OrderItem, PaymentOutbox, ShippingAddress
+from cart.tasks import process_payment_outbox
+
+pytestmark = pytest.mark.django_db
+
+ADDRESS = {'country': 'Россия', 'region': 'Регион', 'city': 'Город', 'street': 'Улица', 'house': '1',
+           'flat': '', 'entrance': '', 'floor': '', 'intercom': ''}
+CUSTOMER = {'customer_last_name': 'LN', 'customer_first_name': 'FN', 'customer_patronymic': '',
+            'customer_email': 'test@example.com', 'customer_phone': '+79123456789'}
+
+
+class DummyPayment:
+    def __init__(self, pid):
+        self.id = pid
+        self.confirmation = type('Confirmation', (), {'confirmation_url': f'https://confirm.test/{pid}'})()
+
+
+@pytest.fixture
+def placed(user, shop, product_factory):
+    products = [product_factory("A", price=10.0), product_factory("B", price=2.5)]
+    items = [{'product': products[0], 'qty': 2, 'price': Decimal('10.00')},
+             {'product': products[1], 'qty': 1, 'price': Decimal('2.50')}]
+    return place_order(user=user, shop=shop, items=items, customer=CUSTOMER, delivery_method='Курьером',
+                       address=ADDRESS, return_url='https://shop.test/success')
+
+
+def test_address_found_by_fingerprint(user):
+    first = get_shipping_address(user, ADDRESS)
+    assert get_shipping_address(user, {**ADDRESS, 'city': ' город '}) == first
+    assert get_shipping_address(None, ADDRESS) != first
+    assert ShippingAddress.objects.count() == 2
+
+
+def test_order_items_and_outbox_written_together(placed):
+    order = placed.order
+    assert order.amount == Decimal('22.50')
+    assert order.payment_id is None
+    assert OrderItem.objects.filter(order=order).count() == 2
+    assert placed.status == 'pending'
+    assert placed.payload['amount']['value'] == '22.50'
+    assert placed.payload['metadata']['order_id'] == order.pk
+
+
+def test_payment_sent_with_idempotence_key(placed, monkeypatch):
+    calls = []
+    monkeypatch.setattr(Payment, 'create', lambda payload, key: calls.append(key) or DummyPayment('pay_1'))
+    assert send_payment(placed) == 'https://confirm.test/pay_1'
+    assert calls == [str(placed.idempotence_key)]
+    placed.refresh_from_db()
+    assert (placed.status, placed.attempts, placed.order.payment_id) == ('sent', 1, 'pay_1')
+
+
+def test_gateway_error_deletes_order(placed, monkeypatch):
+    monkeypatch.setattr(Payment, 'create', lambda *args: (_ for _ in ()).throw(RuntimeError()))
+    assert send_payment(placed) is None
+    assert not Order.objects.filter(pk=placed.order_id).exists()
+    assert not PaymentOutbox.objects.exists()
+
+
+def test_stale_outbox_retried_with_same_key(placed, monkeypatch):
+    keys = []
+    monkeypatch.setattr(Payment, 'create', lambda payload, key: keys.append(key) or DummyPayment('pay_2'))
+    process_payment_outbox()
+    assert keys == []
+
+    PaymentOutbox.objects.filter(pk=placed.pk).update(created=timezone.now() - timedelta(minutes=10))
+    process_payment_outbox()
+    assert keys == [str(placed.idempotence_key)]
+    assert Order.objects.get(pk=placed.order_id).payment_id == 'pay_2'
+
+
+def _make_stale(outbox):
+    PaymentOutbox.objects.filter(pk=outbox.pk).update(created=timezone.now() - timedelta(minutes=10))
+
+
+def test_outbox_retry_keeps_order_until_attempts_run_out(placed, monkeypatch, settings):
+    settings.PAYMENT_OUTBOX_MAX_ATTEMPTS = 2
+    monkeypatch.setattr(Payment, 'create', lambda *args: (_ for _ in ()).throw(RuntimeError()))
+    _make_stale(placed)
+
+    # временная ошибка шлюза: заказ и резерв остаются, запрос ждет следующего запуска
+    process_payment_outbox()
+    placed.refresh_from_db()
+    assert (placed.status, placed.attempts) == ('pending', 1)
+    assert Order.objects.filter(pk=placed.order_id).exists()
+
+    process_payment_outbox()
+    assert not Order.objects.filter(pk=placed.order_id).exists()
+    assert not PaymentOutbox.objects.exists()
+
+
+def test_outbox_retry_rejected_by_gateway_deletes_order(placed, monkeypatch):
+    error = BadRequestError({'type': 'error', 'code': 'invalid_request'})
+    monkeypatch.setattr(Payment, 'create', lambda *args: (_ for _ in ()).throw(error))
+    _make_stale(placed)
+
+    process_payment_outbox()
+    assert not Order.objects.filter(pk=placed.order_id).exists()
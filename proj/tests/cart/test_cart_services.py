@@ -6,6 +6,9 @@ from cart.services import (
     determine_tariff_zone,
     calculate_shipping_cost,
     get_cdek_shipping_cost,
+    quote,
+    quote_many,
+    product_shipping_weight,
     SPECIAL_CITIES_ZONE4,
     SPECIAL_CITIES_ZONE5,
     SPECIAL_CITIES_ZONE6,
@@ -85,7 +88,47 @@ def test_get_cdek_shipping_cost_various(monkeypatch):
     assert cost == Decimal(base).quantize(Decimal("1.00"))
 
     # test that exceptions inside get_cdek_shipping_cost return None
-    # monkeypatch determine_tariff_zone to throw
-    monkeypatch.setattr("cart.services.determine_tariff_zone",
+    # monkeypatch the compiled tariff lookup to throw
+    monkeypatch.setattr("cart.services._quote",
                         lambda *args, **kwargs: (_ for _ in ()).throw(ValueError()))
     assert get_cdek_shipping_cost("москва", "казань", Decimal("1.0"), "Курьером") is None
+
+
+@pytest.mark.parametrize("city,expected_zone", [
+    ("г. Ростов на Дону", 3),
+    ("город Артем", 6),
+    ("Г Орехово - Зуево", 2),
+    ("Губкин", 3),
+])
+def test_get_city_zone_normalizes_names(city, expected_zone):
+    assert get_city_zone(city) == expected_zone
+
+
+def test_quote_matches_tariff_grid():
+    # особый город зоны 4 → зона 4 и обычный город той же зоны отличаются тарифом
+    special = next(iter(SPECIAL_CITIES_ZONE4))
+    expected = calculate_shipping_cost(TARIFF_MATRIX[4][4][0], "Курьером", Decimal("3.2"))
+    assert quote(special, "сочи", Decimal("3.2"), "Курьером") == expected
+    expected = calculate_shipping_cost(TARIFF_MATRIX[4][4][1], "Курьером", Decimal("3.2"))
+    assert quote("Сочи", "пермь", 3.2, "Курьером") == expected
+
+
+def test_quote_many_prices_all_warehouses():
+    costs = quote_many(["Москва", "казань", "xxx"], [Decimal("2.5"), 1, 3], "г. Казань", "Пункт выдачи")
+    assert costs == [
+        get_cdek_shipping_cost("москва", "казань", Decimal("2.5"), "Пункт выдачи"),
+        Decimal(TARIFF_TABLE[0]["pickup"][0]),
+        None,
+    ]
+    assert quote_many(["москва"], [1], "yyy", "Курьером") == [None]
+
+
+def test_product_shipping_weight_rounds_up_to_grams():
+    class Product:
+        shipping_width, shipping_length, shipping_height, shipping_weight = 10.0, 10.0, 10.0, 0.1
+
+    assert product_shipping_weight(Product) == Decimal("0.2")
+    Product.shipping_width = 10.01
+    assert product_shipping_weight(Product) == Decimal("0.201")
+    Product.shipping_width = None
+    assert product_shipping_weight(Product) == 0
@@ -0,0 +1,95 @@
+from decimal import Decimal
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from cart.services import get_cdek_shipping_cost
+from cart.shipping import cart_contents_hash
+from products.models import Product
+
+pytestmark = pytest.mark.django_db
+
+
+def _put_in_cart(client, *products, qty=1):
+    session = client.session
+    session['session_key'] = {
+        str(product.pk): {'qty': qty, 'price': str(product.price), 'shop_slug': product.shop.slug}
+        for product in products
+    }
+    session.save()
+
+
+def _shipping_products(product_factory):
+    first = product_factory("A")
+    second = product_factory("B")
+    third = product_factory("C")
+    Product.objects.filter(pk=first.pk).update(warehouse_city="Москва", shipping_weight=2.0)
+    Product.objects.filter(pk=second.pk).update(warehouse_city="Москва", shipping_weight=0.5)
+    Product.objects.filter(pk=third.pk).update(warehouse_city="Казань", shipping_weight=1.5)
+    return first, second, third
+
+
+def test_cart_contents_hash_ignores_order():
+    first = {'1': {'qty': 1}, '2': {'qty': 3}}
+    second = {'2': {'qty': 3}, '1': {'qty': 1}}
+    assert cart_contents_hash(first) == cart_contents_hash(second)
+    assert cart_contents_hash(first) != cart_contents_hash({'1': {'qty': 2}, '2': {'qty': 3}})
+
+
+def test_shipping_quote_sums_warehouse_groups(client, product_factory):
+    products = _shipping_products(product_factory)
+    _put_in_cart(client, *products)
+
+    resp = client.get(reverse('cart:shipping-quote', args=[products[0].shop.slug]),
+                      {'city': 'г. Казань', 'method': 'Курьером'})
+
+    expected = (get_cdek_shipping_cost("москва", "казань", Decimal("2.5"), "Курьером")
+                + get_cdek_shipping_cost("казань", "казань", Decimal("1.5"), "Курьером"))
+    assert resp.status_code == 200
+    assert resp.json() == {'shipping_cost': f"{expected:.2f}"}
+
+
+def test_repeated_quotes_do_not_query_products(client, product_factory):
+    products = _shipping_products(product_factory)
+    _put_in_cart(client, *products)
+    url = reverse('cart:shipping-quote', args=[products[0].shop.slug])
+    client.get(url, {'city': 'Казань', 'method': 'Курьером'})
+
+    # веса групп — в кеше, стоимость — в тарифной сетке; из БД читается только сессия
+    with CaptureQueriesContext(connection) as queries:
+        for city in ('Москва', 'Тула', 'Омск'):
+            assert client.get(url, {'city': city, 'method': 'Пункт выдачи'}).status_code == 200
+    assert not [query for query in queries if 'products_' in query['sql']]
+
+
+def test_product_change_recomputes_weights(client, product_factory):
+    products = _shipping_products(product_factory)
+    _put_in_cart(client, *products)
+    url = reverse('cart:shipping-quote', args=[products[0].shop.slug])
+    before = client.get(url, {'city': 'Казань', 'method': 'Курьером'}).json()['shipping_cost']
+
+    product = Product.objects.get(pk=products[2].pk)
+    product.shipping_weight = 10.0
+    product.save()
+
+    after = client.get(url, {'city': 'Казань', 'method': 'Курьером'}).json()['shipping_cost']
+    assert Decimal(after) > Decimal(before)
+
+
+@pytest.mark.parametrize("params", [
+    {'city': '', 'method': 'Курьером'},
+    {'city': 'Казань'},
+    {'city': 'Неизвестный город', 'method': 'Курьером'},
+])
+def test_shipping_quote_errors(client, product_factory, params):
+    products = _shipping_products(product_factory)
+    _put_in_cart(client, *products)
+    resp = client.get(reverse('cart:shipping-quote', args=[products[0].shop.slug]), params)
+    assert resp.status_code == 400
+
+
+def test_shipping_quote_for_empty_cart(client, shop):
+    resp = client.get(reverse('cart:shipping-quote', args=[shop.slug]), {'city': 'Казань', 'method': 'Курьером'})
+    assert resp.status_code == 400
@@ -0,0 +1,206 @@
+from collections import defaultdict
+from decimal import Decimal
+
+import pytest
+from django.contrib.sessions.backends.cache import SessionStore
+from django.urls import reverse
+
+from cart.cart import Cart, RedisCartStore, SessionCartStore
+from products.models import Product, Shop
+
+pytestmark = pytest.mark.django_db
+
+
+class FakeRedis:
+    """Минимальная замена клиента Redis: команды hash'ей и транзакции с WATCH, которые использует корзина."""
+
+    def __init__(self):
+        self.hashes = defaultdict(dict)
+        self.versions = defaultdict(int)
+        # вызывается один раз между чтением под WATCH и EXEC — так имитируется параллельный запрос
+        self.before_exec = None
+
+    def hgetall(self, key):
+        return {field.encode(): value for field, value in self.hashes[key].items()}
+
+    def hget(self, key, field):
+        return self.hashes[key].get(field)
+
+    def hset(self, key, field, value):
+        self.hashes[key][field] = value
+        self.versions[key] += 1
+
+    def hdel(self, key, field):
+        self.hashes[key].pop(field, None)
+        self.versions[key] += 1
+
+    def hincrby(self, key, field, amount):
+        self.hashes[key][field] = int(self.hashes[key].get(field, 0)) + amount
+        self.versions[key] += 1
+
+    def expire(self, key, ttl):
+        pass
+
+    def transaction(self, func, *watches):
+        while True:
+            versions = [self.versions[key] for key in watches]
+            pipe = FakePipeline(self)
+            func(pipe)
+            hook, self.before_exec = self.before_exec, None
+            if hook:
+                hook()
+            # ключ под WATCH изменился — EXEC не выполняется, транзакция повторяется
+            if versions == [self.versions[key] for key in watches]:
+                return pipe.execute()
+
+
+class FakePipeline:
+    """Команды до multi() выполняются сразу, после — копятся до execute()."""
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = None
+
+    def __getattr__(self, name):
+        command = getattr(self.client, name)
+        if self.commands is None:
+            return command
+        return lambda *args: self.commands.append((command, args))
+
+    def multi(self):
+        self.commands = []
+
+    def execute(self):
+        return [command(*args) for command, args in self.commands or []]
+
+
+def _shop(slug):
+    return Shop.objects.create(title=slug, slug=slug, address="A", INN="1", payment_account="1", BIC="1")
+
+
+def _product(name, shop, price):
+    return Product.objects.create(name=name, shop=shop, price=price, items_left=5, warehouse_city="moscow",
+                                  shipping_width=1, shipping_length=1, shipping_height=1, shipping_weight=1)
+
+
+class _Request:
+    def __init__(self, session):
+        self.session = session
+
+
+@pytest.fixture
+def products():
+    first, second = _shop("first"), _shop("second")
+    return [_product("A", first, 10.0), _product("B", first, 2.5), _product("C", second, 100.0)]
+
+
+@pytest.mark.parametrize("make_store", [
+    lambda session: SessionCartStore(session),
+    lambda session: RedisCartStore(FakeRedis(), session),
+])
+def test_store_keeps_items_and_totals(make_store, products, django_assert_num_queries):
+    session = SessionStore()
+    cart = Cart(_Request(session))
+    cart.store = make_store(session)
+    assert len(cart) == 0 and cart.get_total_price() == 0
+
+    cart.add(products[0], 2)
+    cart.add(products[1], 1)
+    cart.add(products[2], 1)
+    cart.add(products[0], 5)  # повторное добавление не меняет позицию
+    cart.update(products[1].pk, 4)
+    cart.delete(products[2].pk)
+
+    # счетчик в шапке и сумма считаются без обращений к БД
+    with django_assert_num_queries(0):
+        assert len(cart) == 6
+        assert cart.get_total_price() == Decimal('30.00')
+        assert products[0].pk in cart and products[2].pk not in cart
+
+    with django_assert_num_queries(1):
+        items = list(cart)
+    assert [(item['product'], item['qty'], item['total']) for item in items] == [
+        (products[0], 2, Decimal('20.0')), (products[1], 4, Decimal('10.0')),
+    ]
+    assert items[0]['product'].shop.slug == "first"
+
+
+def test_redis_store_created_lazily(products):
+    session, client = SessionStore(), FakeRedis()
+    store = RedisCartStore(client, session)
+    assert store.count() == 0 and store.items() == {}
+    assert 'cart_id' not in session
+
+    store.save(str(products[0].pk), {'qty': 1, 'price': '10.0', 'shop_slug': 'first'})
+    assert client.hashes[f"cart:{session['cart_id']}:summary"] == {'qty': 1, 'total': 1000}
+
+
+def test_redis_store_retries_write_raced_by_another_request(products):
+    session, client = SessionStore(), FakeRedis()
+    store, other = RedisCartStore(client, session), RedisCartStore(client, session)
+    pk = str(products[0].pk)
+    store.save(pk, {'qty': 1, 'price': '10.0', 'shop_slug': 'first'})
+
+    # между чтением прежней позиции и записью другой запрос меняет ту же позицию
+    client.before_exec = lambda: other.save(pk, {'qty': 3, 'price': '10.0', 'shop_slug': 'first'})
+    store.save(pk, {'qty': 2, 'price': '10.0', 'shop_slug': 'first'})
+
+    assert store.get(pk)['qty'] == 2
+    assert store.count() == 2 and store.total() == Decimal('20.00')
+
+    client.before_exec = lambda: other.delete(pk)
+    store.delete(pk)
+    assert store.items() == {} and store.count() == 0 and store.total() == 0
+
+
+def test_cart_view_loads_shops_with_products(client, products, django_assert_max_num_queries):
+    for product in products:
+        client.post(reverse('cart:add-to-cart'), {'action': 'post', 'product_id': product.id, 'product_qty': 1})
+
+    with django_assert_max_num_queries(3):
+        response = client.get(reverse('cart:cart-view'))
+    groups = list(response.context['grouped_items'])
+    assert [(group['shop'].slug, len(group['items']), group['total']) for group in groups] == [
+        ("first", 2, Decimal('12.5')), ("second", 1, Decimal('100.0')),
+    ]
+
+
+def test_revalidate_reprices_and_clamps_in_one_query(products, django_assert_num_queries):
+    session = SessionStore()
+    cart = Cart(_Request(session))
+    for product in products:
+        cart.add(product, 3)
+    Product.objects.filter(pk=products[0].pk).update(price=12.0)
+    Product.objects.filter(pk=products[1].pk).update(items_left=2)
+    Product.objects.filter(pk=products[2].pk).update(items_left=0)
+
+    with django_assert_num_queries(1):
+        items, changes = cart.revalidate()
+    assert [(item['product'].pk, item['qty'], item['total']) for item in items] == [
+        (products[0].pk, 3, Decimal('36.0')), (products[1].pk, 2, Decimal('5.0')),
+    ]
+    assert [(change['product'].pk, change['kind'], change['old'], change['new']) for change in changes] == [
+        (products[0].pk, 'price', Decimal('10.0'), Decimal('12.0')),
+        (products[1].pk, 'quantity', 3, 2),
+        (products[2].pk, 'out_of_stock', 3, 0),
+    ]
+    assert len(cart) == 5 and cart.get_total_price() == Decimal('41.0')
+    assert cart.revalidate()[1] == []
+
+
+def test_cart_update_clamps_to_stock(client, products):
+    client.post(reverse('cart:add-to-cart'), {'action': 'post', 'product_id': products[0].id, 'product_qty': 1})
+    response = client.post(reverse('cart:update-to-cart'),
+                           {'action': 'post', 'product_id': products[0].id, 'product_qty': 99})
+    assert response.json()['qty'] == 5
+
+
+def test_checkout_shows_changes_instead_of_charging_stale_price(client, products):
+    client.post(reverse('cart:add-to-cart'), {'action': 'post', 'product_id': products[0].id, 'product_qty': 1})
+    Product.objects.filter(pk=products[0].pk).update(price=15.0)
+
+    response = client.post(reverse('cart:order-view', args=["first"]), {'shipping': 'Курьером'})
+    assert response.status_code == 200
+    assert [change['kind'] for change in response.context['cart_changes']] == ['price']
+    assert response.context['total_price'] == Decimal('15.0')
+    assert "цена изменилась" in response.content.decode()
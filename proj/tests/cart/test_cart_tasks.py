@@ -6,16 +6,15 @@ import calendar
 from django.utils import timezone
 from django.core import mail
 
+from cart.payments import confirm_order_payment
 from cart.tasks import (
-    update_order_status,
-    decrease_product_quantity,
-    update_store_sales_report,
     send_email_to_owner,
     send_email_to_customer,
     create_monthly_reports,
     delete_order_with_canceled_payment,
+    process_payment_event,
 )
-from cart.models import Order, OrderItem, StoreSalesReport, ShippingAddress
+from cart.models import Order, OrderItem, StoreSalesReport, ShippingAddress, PaymentWebhookEvent
 from products.models import Shop
 
 
@@ -71,24 +70,24 @@ def order_factory(db, user, shop, product_factory):
 
 
 @pytest.mark.django_db
-def test_update_order_status(order_factory):
+def test_confirm_order_payment_updates_status(order_factory):
     order = order_factory(items_info=[({'price': Decimal('9.00'), 'items_left': 5}, 1)])
     assert not order.paid and order.status != 'in_assembly'
 
-    update_order_status(order.id)
+    assert confirm_order_payment(order.id) is True
     order.refresh_from_db()
     assert order.paid is True
     assert order.status == 'in_assembly'
 
 
 @pytest.mark.django_db
-def test_decrease_product_quantity(order_factory):
+def test_confirm_order_payment_decreases_product_quantity(order_factory):
     # items_left=5, qty=2 → станет 3
     order = order_factory(items_info=[({'price': Decimal('3.00'), 'items_left': 5}, 2)])
     item = order.items.first()
     before = item.product.items_left
 
-    decrease_product_quantity(order.id)
+    confirm_order_payment(order.id)
     item.product.refresh_from_db()
     assert item.product.items_left == before - item.quantity
 
@@ -100,13 +99,11 @@ def order_for_report(order_factory):
 
 
 @pytest.mark.django_db
-def test_update_store_sales_report(order_for_report):
+def test_confirm_order_payment_updates_store_sales_report(order_for_report):
     order = order_for_report
-    # вызываем таску
-    update_store_sales_report(order.id)
+    confirm_order_payment(order.id)
 
     today = timezone.now().date()
-    # после фикса в коде tasks.py (update_fields=['revenue','updated']), отчет должен быть создан
     report = StoreSalesReport.objects.get(
         shop=order.shop,
         start_date__lte=today,
@@ -207,3 +204,47 @@ def test_create_monthly_reports(shops_pair):
     reports = StoreSalesReport.objects.filter(start_date=first, end_date=last)
     shop_ids = {r.shop_id for r in reports}
     assert shop_ids == {shops_pair[0].pk, shops_pair[1].pk}
+
+
+@pytest.mark.django_db
+def test_process_payment_event_is_applied_once(order_with_owner_and_address, django_capture_on_commit_callbacks):
+    order = order_with_owner_and_address
+    product = order.items.first().product
+    mail.outbox = []
+    first = PaymentWebhookEvent.objects.create(payment_id="pay_1", event="payment.succeeded", order=order, payload={})
+    # уведомление о другом платеже того же заказа уже оплаченный заказ не меняет
+    second = PaymentWebhookEvent.objects.create(payment_id="pay_2", event="payment.succeeded", order=order, payload={})
+
+    # письма отправляются после фиксации транзакции
+    with django_capture_on_commit_callbacks(execute=True):
+        process_payment_event(first.pk)
+        process_payment_event(first.pk)
+        process_payment_event(second.pk)
+
+    order.refresh_from_db()
+    product.refresh_from_db()
+    assert order.paid and order.status == 'in_assembly'
+    assert product.items_left == 1
+    assert product.order_count == 1
+    assert StoreSalesReport.objects.get(shop=order.shop).revenue == order.amount
+    assert len(mail.outbox) == 2
+    first.refresh_from_db()
+    assert first.status == 'processed' and first.processed is not None
+
+
+@pytest.mark.django_db
+def test_confirm_order_payment_counts_order_once(order_for_report):
+    assert confirm_order_payment(order_for_report.id) is True
+    # повторное подтверждение (ретрай вебхука) ничего не меняет
+    assert confirm_order_payment(order_for_report.id) is False
+    assert StoreSalesReport.objects.get(shop=order_for_report.shop).revenue == order_for_report.amount
+
+
+@pytest.mark.django_db
+def test_process_payment_event_cancels_order(order_factory):
+    order = order_factory()
+    event = PaymentWebhookEvent.objects.create(payment_id="pay_2", event="payment.canceled", order=order, payload={})
+    process_payment_event(event.pk)
+    assert not Order.objects.filter(pk=order.pk).exists()
+    event.refresh_from_db()
+    assert event.status == 'processed' and event.order is None
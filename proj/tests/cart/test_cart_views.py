@@ -236,7 +236,8 @@ def test_order_view_calculate_shipping(monkeypatch, client, product_factory):
     assert resp_bad.status_code == 400
 
     # правильный POST, мокируем стоимость
-    monkeypatch.setattr('cart.views.get_cdek_shipping_cost', lambda w, c, g, m: Decimal('5.00'))
+    monkeypatch.setattr('cart.carriers.TariffTableRateProvider.quote_many',
+                        lambda self, w, g, c, m: [Decimal('5.00') for _ in w])
     resp = client.post(url, {
         'find_shipping_cost_to_city': 'anycity',
         'find_shipping_cost_with_method': 'courier'
@@ -4,15 +4,8 @@ from decimal import Decimal
 from django.test import RequestFactory
 from django.http import HttpResponse
 from cart.webhooks import yookassa_webhook
-from cart.models import Order
-from cart.tasks import (
-    update_order_status,
-    decrease_product_quantity,
-    update_store_sales_report,
-    send_email_to_owner,
-    send_email_to_customer,
-    delete_order_with_canceled_payment
-)
+from cart.models import Order, PaymentWebhookEvent
+from cart.tasks import process_payment_event
 from yookassa.domain.common import SecurityHelper
 from yookassa.domain.notification import (
     WebhookNotificationEventType,
@@ -73,7 +66,7 @@ def test_untrusted_ip(rf, monkeypatch):
 
 @pytest.mark.django_db
 def test_payment_succeeded_amount_match_triggers_tasks(rf, monkeypatch, order):
-    """PAYMENT_SUCCEEDED + корректная сумма → 200 и вызов .delay всех задач кроме delete"""
+    """PAYMENT_SUCCEEDED + корректная сумма → 200, уведомление во входящем ящике и одна задача обработки"""
     payload = {"event": WebhookNotificationEventType.PAYMENT_SUCCEEDED}
     dummy_resp = DummyResponseObject(order.payment_id, str(order.amount))
     # Monkeypatch фабрику уведомлений
@@ -81,18 +74,8 @@ def test_payment_succeeded_amount_match_triggers_tasks(rf, monkeypatch, order):
     monkeypatch.setattr(WebhookNotificationFactory, "create",
                         lambda self, j: DummyNotification(WebhookNotificationEventType.PAYMENT_SUCCEEDED, dummy_resp)
                         )
-
-    # Пусть все .delay запишем вызовы
     called = []
-    for task in (
-            update_order_status,
-            decrease_product_quantity,
-            update_store_sales_report,
-            send_email_to_owner,
-            send_email_to_customer,
-            delete_order_with_canceled_payment
-    ):
-        monkeypatch.setattr(task, "delay", lambda order_id, t=task: called.append(t.__name__))
+    monkeypatch.setattr(process_payment_event, "delay", lambda event_id: called.append(event_id))
 
     req = rf.post("/webhook/",
                   data=json.dumps(payload).encode(),
@@ -100,14 +83,29 @@ def test_payment_succeeded_amount_match_triggers_tasks(rf, monkeypatch, order):
     req.META["REMOTE_ADDR"] = "127.0.0.1"
     resp = yookassa_webhook(req)
     assert resp.status_code == 200
-    # delete_order_with_canceled_payment не должен вызываться
-    assert set(called) == {
-        "update_order_status",
-        "decrease_product_quantity",
-        "update_store_sales_report",
-        "send_email_to_owner",
-        "send_email_to_customer",
-    }
+    event = PaymentWebhookEvent.objects.get()
+    assert (event.payment_id, event.event, event.order) == (
+        order.payment_id, WebhookNotificationEventType.PAYMENT_SUCCEEDED, order)
+    assert called == [event.pk]
+
+
+@pytest.mark.django_db
+def test_repeated_webhook_is_processed_once(rf, monkeypatch, order):
+    """Повторная доставка того же уведомления → 200 без новой записи и без повторной обработки"""
+    dummy_resp = DummyResponseObject(order.payment_id, str(order.amount))
+    monkeypatch.setattr(SecurityHelper, "is_ip_trusted", lambda self, ip: True)
+    monkeypatch.setattr(WebhookNotificationFactory, "create",
+                        lambda self, j: DummyNotification(WebhookNotificationEventType.PAYMENT_SUCCEEDED, dummy_resp)
+                        )
+    called = []
+    monkeypatch.setattr(process_payment_event, "delay", lambda event_id: called.append(event_id))
+
+    for _ in range(3):
+        req = rf.post("/webhook/", data=b"{}", content_type="application/json")
+        req.META["REMOTE_ADDR"] = "127.0.0.1"
+        assert yookassa_webhook(req).status_code == 200
+    assert PaymentWebhookEvent.objects.count() == 1
+    assert len(called) == 1
 
 
 @pytest.mark.django_db
@@ -121,15 +119,7 @@ def test_payment_succeeded_amount_mismatch_logs_400(rf, monkeypatch, order):
                         )
 
     called = []
-    for task in (
-            update_order_status,
-            decrease_product_quantity,
-            update_store_sales_report,
-            send_email_to_owner,
-            send_email_to_customer,
-            delete_order_with_canceled_payment
-    ):
-        monkeypatch.setattr(task, "delay", lambda order_id, t=task: called.append(t.__name__))
+    monkeypatch.setattr(process_payment_event, "delay", lambda event_id: called.append(event_id))
 
     req = rf.post("/webhook/",
                   data=json.dumps(payload).encode(),
@@ -138,6 +128,7 @@ def test_payment_succeeded_amount_mismatch_logs_400(rf, monkeypatch, order):
     resp = yookassa_webhook(req)
     assert resp.status_code == 400
     assert called == []
+    assert not PaymentWebhookEvent.objects.exists()
 
 
 @pytest.mark.django_db
@@ -159,7 +150,7 @@ def test_payment_succeeded_order_not_found(rf, monkeypatch):
 
 @pytest.mark.django_db
 def test_payment_canceled_triggers_delete(rf, monkeypatch, order):
-    """PAYMENT_CANCELED → 200 и вызов только delete_order_with_canceled_payment"""
+    """PAYMENT_CANCELED → 200 и задача обработки отмены"""
     payload = {"event": WebhookNotificationEventType.PAYMENT_CANCELED}
     dummy_resp = DummyResponseObject(order.payment_id, str(order.amount))
     monkeypatch.setattr(SecurityHelper, "is_ip_trusted", lambda self, ip: True)
@@ -167,15 +158,16 @@ def test_payment_canceled_triggers_delete(rf, monkeypatch, order):
                         lambda self, j: DummyNotification(WebhookNotificationEventType.PAYMENT_CANCELED, dummy_resp)
                         )
     called = []
-    monkeypatch.setattr(delete_order_with_canceled_payment, "delay",
-                        lambda order_id: called.append("delete_order_with_canceled_payment"))
+    monkeypatch.setattr(process_payment_event, "delay", lambda event_id: called.append(event_id))
     req = rf.post("/webhook/",
                   data=json.dumps(payload).encode(),
                   content_type="application/json")
     req.META["REMOTE_ADDR"] = "127.0.0.1"
     resp = yookassa_webhook(req)
     assert resp.status_code == 200
-    assert called == ["delete_order_with_canceled_payment"]
+    event = PaymentWebhookEvent.objects.get()
+    assert event.event == WebhookNotificationEventType.PAYMENT_CANCELED
+    assert called == [event.pk]
 
 
 @pytest.mark.django_db
@@ -191,3 +183,92 @@ def test_unknown_event_returns_400(rf, monkeypatch):
     req.META["REMOTE_ADDR"] = "127.0.0.1"
     resp = yookassa_webhook(req)
     assert resp.status_code == 400
+
+
+def make_notification(payment_id, amount, event="payment.succeeded"):
+    """Уведомление в формате YooKassa, которое разбирает WebhookNotificationFactory."""
+    return json.dumps({
+        "type": "notification",
+        "event": event,
+        "object": {
+            "id": payment_id,
+            "status": "succeeded" if event == "payment.succeeded" else "canceled",
+            "paid": event == "payment.succeeded",
+            "amount": {"value": str(amount), "currency": "RUB"},
+            "created_at": "2026-10-18T10:00:00.000Z",
+            "test": True,
+            "refundable": False,
+            "recipient": {"account_id": "1", "gateway_id": "1"},
+        },
+    }).encode()
+
+
+@pytest.fixture
+def fast_ack(settings, monkeypatch):
+    settings.YOOKASSA_WEBHOOK_FAST_ACK = True
+    monkeypatch.setattr(SecurityHelper, "is_ip_trusted", lambda self, ip: True)
+
+
+def post_webhook(rf, body):
+    req = rf.post("/webhook/", data=body, content_type="application/json")
+    req.META["REMOTE_ADDR"] = "127.0.0.1"
+    return yookassa_webhook(req)
+
+
+@pytest.mark.django_db
+def test_fast_ack_stores_raw_body_without_parsing(rf, fast_ack, monkeypatch, order, django_assert_num_queries):
+    from cart.tasks import drain_payment_webhook_inbox
+    scheduled = []
+    monkeypatch.setattr(drain_payment_webhook_inbox, "apply_async", lambda **kwargs: scheduled.append(kwargs))
+
+    # тело не разбирается и заказ не ищется: только вставка во входящий ящик
+    with django_assert_num_queries(1):
+        assert post_webhook(rf, b"not json").status_code == 200
+    assert post_webhook(rf, make_notification(order.payment_id, order.amount)).status_code == 200
+
+    events = PaymentWebhookEvent.objects.order_by("pk")
+    assert [(event.status, event.payment_id) for event in events] == [("received", None), ("received", None)]
+    assert events[0].body == "not json"
+    # несколько уведомлений подряд разбираются одной задачей
+    assert len(scheduled) == 1
+
+
+@pytest.mark.django_db
+def test_fast_ack_untrusted_ip(rf, fast_ack, monkeypatch):
+    monkeypatch.setattr(SecurityHelper, "is_ip_trusted", lambda self, ip: False)
+    assert post_webhook(rf, b"{}").status_code == 400
+    assert not PaymentWebhookEvent.objects.exists()
+
+
+@pytest.mark.django_db
+def test_drain_inbox_processes_batches_and_skips_duplicates(rf, fast_ack, monkeypatch, settings, order):
+    from cart.tasks import drain_payment_webhook_inbox
+    monkeypatch.setattr(drain_payment_webhook_inbox, "apply_async", lambda **kwargs: None)
+    settings.YOOKASSA_WEBHOOK_BATCH_SIZE = 2
+    for body in (
+            make_notification(order.payment_id, order.amount),
+            make_notification(order.payment_id, order.amount),  # повтор от шлюза
+            make_notification(order.payment_id, "1.00"),  # уже принятое событие платежа отбрасывается до проверок
+            make_notification("unknown", order.amount),
+            b"not json",
+    ):
+        post_webhook(rf, body)
+    processed = []
+    monkeypatch.setattr("cart.tasks.process_payment_event", lambda event_id: processed.append(event_id))
+
+    drain_payment_webhook_inbox()
+
+    statuses = list(PaymentWebhookEvent.objects.order_by("pk").values_list("status", flat=True))
+    assert statuses == ["pending", "duplicate", "duplicate", "rejected", "rejected"]
+    accepted = PaymentWebhookEvent.objects.get(status="pending")
+    assert (accepted.payment_id, accepted.event, accepted.order) == (order.payment_id, "payment.succeeded", order)
+    assert processed == [accepted.pk]
+
+
+@pytest.mark.django_db
+def test_fast_ack_end_to_end(rf, fast_ack, order):
+    # задачи Celery в тестах выполняются сразу, поэтому уведомление обрабатывается в том же запросе
+    assert post_webhook(rf, make_notification(order.payment_id, order.amount)).status_code == 200
+    order.refresh_from_db()
+    assert order.paid and order.status == "in_assembly"
+    assert PaymentWebhookEvent.objects.get().status == "processed"
@@ -44,6 +44,14 @@ def clear_cache():
     cache.clear()
 
 
+@pytest.fixture(autouse=True)
+def recommendations_model_path(settings, tmp_path):
+    # модель рекомендаций не должна попадать в рабочую директорию проекта
+    settings.RECOMMENDATIONS_MODEL_PATH = str(tmp_path / "recommendations.npz")
+    settings.RECOMMENDATIONS_COPURCHASE_MODEL_PATH = str(tmp_path / "copurchase.npz")
+    return settings.RECOMMENDATIONS_MODEL_PATH
+
+
 @pytest.fixture
 def request_factory():
     return RequestFactory()
@@ -84,7 +84,7 @@ def test_all_products_and_filters(client, product_factory):
     assert resp.status_code == 200
     ctx = resp.context
     assert list(ctx['page_obj'])[0].pk == p1.pk
-    assert 'price_data_for_filters' in ctx and 'length_data_for_filters' in ctx
+    assert 'facets' in ctx
 
 
 def test_category_products_and_filters(client, product_factory, category_tree):
@@ -97,7 +97,7 @@ def test_category_products_and_filters(client, product_factory, category_tree):
     assert resp.status_code == 200
     ctx = resp.context
     assert list(ctx['page_obj']) == [z]
-    assert ctx['category'] == child and 'price_data_for_filters' in ctx
+    assert ctx['category'] == child and 'facets' in ctx
 
 
 def test_shop_categories_and_cache(client, user, shop, category_tree, product_factory):
@@ -141,7 +141,7 @@ def test_shop_products_and_filters(client, shop, category_tree, product_factory)
     assert resp.status_code == 200
     ctx = resp.context
     assert list(ctx['page_obj']) == [p1]
-    assert ctx['shop'] == shop and ctx['category'] == grand and 'price_data_for_filters' in ctx
+    assert ctx['shop'] == shop and ctx['category'] == grand and 'facets' in ctx
 
 
 # --- Recommendations integration ---
@@ -159,6 +159,8 @@ def test_recommendations_data_and_task(monkeypatch, rf, user, product_factory, c
     calls = {}
     monkeypatch.setattr(find_recommended_products_for_user, 'delay', lambda u, v: calls.setdefault('args', (u, v)))
     result1 = recommendations_data(request)
+    # задача ставится при первом обращении шаблона к рекомендациям
+    list(result1['recommended_products'])
     assert calls['args'] == (user.pk, [p2.id]) and 'recommended_products' in result1
     # second call uses cache
     result2 = recommendations_data(request)
@@ -195,25 +197,18 @@ def test_yookassa_webhook_success(monkeypatch, client, product_factory, shop, us
 
     monkeypatch.setattr(SecurityHelper, 'is_ip_trusted', lambda self, ip: True)
     monkeypatch.setattr(WebhookNotificationFactory, 'create', lambda self, j: DummyNotification())
-    # Patch tasks
-    from cart.tasks import update_order_status, decrease_product_quantity, update_store_sales_report, \
-        send_email_to_owner, send_email_to_customer
-    called = []
-    for task_name, task in [
-        ('update_order_status', update_order_status),
-        ('decrease_product_quantity', decrease_product_quantity),
-        ('update_store_sales_report', update_store_sales_report),
-        ('send_email_to_owner', send_email_to_owner),
-        ('send_email_to_customer', send_email_to_customer),
-    ]:
-        monkeypatch.setattr(task, 'delay', lambda oid, name=task_name: called.append(name))
-    # Send webhook
-    resp = client.post(reverse('cart:webhook-yookassa'), data=make_payment_notification(order),
-                       content_type='application/json', REMOTE_ADDR='127.0.0.1')
-    assert resp.status_code == 200
-    # Ensure all tasks triggered
-    assert set(called) == {'update_order_status', 'decrease_product_quantity', 'update_store_sales_report',
-                           'send_email_to_owner', 'send_email_to_customer'}
+    from cart.models import StoreSalesReport
+    # Send webhook twice: YooKassa retries notifications
+    for _ in range(2):
+        resp = client.post(reverse('cart:webhook-yookassa'), data=make_payment_notification(order),
+                           content_type='application/json', REMOTE_ADDR='127.0.0.1')
+        assert resp.status_code == 200
+    # Order paid, stock and revenue counted once
+    order.refresh_from_db()
+    prod.refresh_from_db()
+    assert order.paid and order.status == 'in_assembly'
+    assert prod.items_left == 3
+    assert StoreSalesReport.objects.get(shop=shop).revenue == order.amount
 
 
 @pytest.mark.django_db
@@ -231,14 +226,11 @@ def test_yookassa_webhook_canceled(monkeypatch, client, product_factory, shop, u
 
     monkeypatch.setattr(SecurityHelper, 'is_ip_trusted', lambda self, ip: True)
     monkeypatch.setattr(WebhookNotificationFactory, 'create', lambda self, j: DummyNotification())
-    from cart.tasks import delete_order_with_canceled_payment
-    deleted = []
-    monkeypatch.setattr(delete_order_with_canceled_payment, 'delay', lambda oid: deleted.append(oid))
     resp = client.post(reverse('cart:webhook-yookassa'), data=make_payment_notification(order, False),
                        content_type='application/json', REMOTE_ADDR='127.0.0.1')
     assert resp.status_code == 200
-    # Verify delete task
-    assert deleted == [order.id]
+    # Verify order deleted
+    assert not Order.objects.filter(pk=order.id).exists()
 
 
 # --- User views & support/task integration tests ---
@@ -0,0 +1,137 @@
+import time
+
+import pytest
+from django.core.cache import cache
+from django.urls import reverse
+
+from products import utils
+from products.models import Product, Shop
+from products.services import get_category_facets, get_all_products_facets, load_root_categories
+from products.utils import versioned_key, bump_cache_scopes, get_cached_items, get_cache_metrics, CATALOG_SCOPE, \
+    CATEGORY_TREE_SCOPE
+
+pytestmark = pytest.mark.django_db
+
+
+def test_versioned_key_changes_only_for_bumped_scope():
+    key = versioned_key("k", CATALOG_SCOPE, "shop_1")
+    assert versioned_key("k", CATALOG_SCOPE, "shop_1") == key
+
+    bump_cache_scopes("shop_2")
+    assert versioned_key("k", CATALOG_SCOPE, "shop_1") == key
+
+    bump_cache_scopes("shop_1")
+    assert versioned_key("k", CATALOG_SCOPE, "shop_1") != key
+
+
+def test_stock_change_invalidates_category_facets(request_factory, category_tree, product_factory):
+    p = product_factory("P", category_tree["grand"], items_left=0)
+    req = request_factory.get("/", {"available": "1"})
+    assert get_category_facets(category_tree["grand"], req).total == 0
+
+    p.items_left = 3
+    p.save()
+    assert get_category_facets(category_tree["grand"], req).total == 1
+
+
+def test_category_change_invalidates_facets(request_factory, category_tree, product_factory):
+    p = product_factory("P", category_tree["grand"])
+    req = request_factory.get("/")
+    assert get_category_facets(category_tree["child"], req).total == 0
+
+    p.category.add(category_tree["child"])
+    assert get_category_facets(category_tree["child"], req).total == 1
+    assert get_all_products_facets(None, req).total == 1
+
+    p.delete()
+    assert get_category_facets(category_tree["child"], req).total == 0
+    assert get_all_products_facets(None, req).total == 0
+
+
+def test_shop_and_category_lists_invalidated(client, shop, category_tree, product_factory):
+    product_factory("P", category_tree["grand"])
+    assert client.get(reverse("shop_categories", args=[shop.slug])).context["categories"] == [category_tree["root"]]
+
+    category_tree["child"].move_to(None)
+    resp = client.get(reverse("shop_categories", args=[shop.slug]))
+    assert resp.context["categories"] == [category_tree["child"]]
+
+    assert list(client.get(reverse("shops")).context["shops"]) == []
+    # без сигналов кеш остается прежним
+    Shop.objects.filter(pk=shop.pk).update(verified=True)
+    assert list(client.get(reverse("shops")).context["shops"]) == []
+    shop.verified = True
+    shop.save()
+    assert list(client.get(reverse("shops")).context["shops"]) == [shop]
+
+
+def test_get_cached_items_calls_loader_only_on_miss(product_factory):
+    product_factory("P")
+    calls = []
+
+    def load():
+        calls.append(1)
+        return Product.objects.all()
+
+    first = get_cached_items("thunk_test", load, family="thunk")
+    second = get_cached_items("thunk_test", load, family="thunk")
+    assert len(calls) == 1
+    # в кеше лежит вычисленный список, а не QuerySet
+    assert isinstance(first, list) and second == first
+    assert get_cache_metrics("thunk") == {"thunk": {"hits": 1, "misses": 1}}
+
+
+def test_cached_querysets_stored_as_field_rows(django_assert_num_queries, category_tree):
+    get_cached_items("rows_test", load_root_categories)
+    entry = cache.get(versioned_key("rows_test", CATALOG_SCOPE))
+    assert entry.value.model == "products.Category"
+    assert all(isinstance(row, dict) for row in entry.value.rows)
+
+    # экземпляры собираются из строк без запросов, дерево категорий работает как у загруженных из БД
+    with django_assert_num_queries(0):
+        categories = get_cached_items("rows_test", load_root_categories)
+        assert categories == [category_tree["root"]]
+        assert categories[0].title == category_tree["root"].title
+        assert not categories[0].is_leaf_node()
+
+    # поле, которого не было в кеше (схема изменилась), загружается отложенно
+    del entry.value.rows[0]["title"]
+    cache.set(versioned_key("rows_test", CATALOG_SCOPE), entry, 60)
+    assert get_cached_items("rows_test", load_root_categories)[0].title == category_tree["root"].title
+
+
+def test_get_cached_items_waits_for_locked_key(monkeypatch):
+    monkeypatch.setattr(utils, "CACHE_LOCK_WAIT", 0.1)
+    key = versioned_key("locked_test", CATALOG_SCOPE)
+    cache.add(f"{key}:lock", 1, 30)
+
+    # блокировку держит другой процесс: значение считается, но в кеш не пишется
+    assert get_cached_items("locked_test", lambda: [1]) == [1]
+    assert cache.get(key) is None
+
+
+def test_expired_value_served_stale_and_refreshed(product_factory):
+    key = versioned_key("categories_without_parents_cache", CATEGORY_TREE_SCOPE)
+    cache.set(key, utils.CachedValue(["stale"], 0.1, time.time() - 1), 60)
+
+    # текущий запрос получает устаревшее значение и кладет в кеш новое
+    assert get_cached_items("categories_without_parents_cache", load_root_categories, [CATEGORY_TREE_SCOPE],
+                            family="categories") == ["stale"]
+    assert cache.get(key).value == utils.ModelRows.from_queryset(load_root_categories())
+    assert cache.get(f"{key}:lock") is None
+
+
+def test_fresh_value_not_refreshed_early():
+    key = versioned_key("fresh_test", CATALOG_SCOPE)
+    cache.set(key, utils.CachedValue(["cached"], 0.001, time.time() + 3600), 60)
+
+    assert get_cached_items("fresh_test", lambda: ["new"]) == ["cached"]
+    assert cache.get(key).value == ["cached"]
+
+
+def test_inline_refresh_without_celery():
+    key = versioned_key("inline_test", CATALOG_SCOPE)
+    cache.set(key, utils.CachedValue(["stale"], 0.1, time.time() - 1), 60)
+
+    assert get_cached_items("inline_test", lambda: ["fresh"]) == ["stale"]
+    assert get_cached_items("inline_test", lambda: ["newer"]) == ["fresh"]
@@ -0,0 +1,69 @@
+import pytest
+from products.category_tree import rebuild_category_memberships
+from products.models import Category, ProductCategoryMembership
+from products.services import find_shop_categories, get_category_filtered_products
+
+pytestmark = pytest.mark.django_db
+
+
+def _memberships(product):
+    return dict(ProductCategoryMembership.objects.filter(product=product).values_list("category__slug", "direct"))
+
+
+def test_memberships_cover_all_ancestors(category_tree, product_factory):
+    p = product_factory("P", category_tree["grand"])
+    assert _memberships(p) == {"grand": True, "child": False, "root": False}
+
+    p.category.add(category_tree["child"])
+    assert _memberships(p) == {"grand": True, "child": True, "root": False}
+
+    category_tree["grand"].products.clear()
+    assert _memberships(p) == {"child": True, "root": False}
+
+
+def test_memberships_follow_tree_moves(category_tree, product_factory):
+    p = product_factory("P", category_tree["grand"])
+    other_root = Category.objects.create(title="Other", slug="other")
+
+    Category.objects.move_node(category_tree["grand"], other_root, "last-child")
+    assert _memberships(p) == {"grand": True, "other": False}
+
+    grand = Category.objects.get(pk=category_tree["grand"].pk)
+    grand.parent = Category.objects.get(pk=category_tree["root"].pk)
+    grand.save()
+    assert _memberships(p) == {"grand": True, "root": False}
+
+
+def test_memberships_after_category_delete(category_tree, product_factory):
+    p = product_factory("P", category_tree["grand"])
+    p.category.add(category_tree["root"])
+
+    Category.objects.get(pk=category_tree["child"].pk).delete()
+    assert _memberships(p) == {"root": True}
+
+
+def test_rebuild_category_memberships(category_tree, product_factory):
+    p = product_factory("P", category_tree["grand"])
+    ProductCategoryMembership.objects.all().delete()
+
+    assert rebuild_category_memberships() == 1
+    assert _memberships(p) == {"grand": True, "child": False, "root": False}
+
+
+def test_find_shop_categories_skips_empty_subtrees(shop, category_tree, product_factory):
+    Category.objects.create(title="Empty", slug="empty", parent=category_tree["root"])
+    product_factory("P", category_tree["grand"])
+
+    subs = find_shop_categories(shop, Category.objects.get(pk=category_tree["root"].pk), cache_key="tree_test")
+    assert subs == [category_tree["child"]]
+
+
+def test_subtree_listing(settings, request_factory, category_tree, product_factory):
+    direct = product_factory("Direct", category_tree["child"])
+    nested = product_factory("Nested", category_tree["grand"])
+    req = request_factory.get("/")
+
+    assert set(get_category_filtered_products(category_tree["child"], req)) == {direct}
+
+    settings.PRODUCT_CATEGORY_SUBTREE_LISTING = True
+    assert set(get_category_filtered_products(category_tree["child"], req)) == {direct, nested}
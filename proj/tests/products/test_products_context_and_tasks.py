@@ -6,9 +6,11 @@ from django.core.cache import cache
 from core.context_processors.recently_viewed import recently_viewed
 from core.context_processors.recommendations_data import recommendations_data
 from products.tasks import find_recommended_products_for_user
+from products.recommendations import recommendations_key, interactions_fingerprint, get_purchased_product_ids
 from cart.models import Order, OrderItem
 from django.contrib.auth import get_user_model
 from products.models import Product, Review
+from products.leaderboard import get_leaderboard, GLOBAL_BOARD
 
 pytestmark = pytest.mark.django_db
 
@@ -45,7 +47,7 @@ def test_recently_viewed_ordering(product_factory):
 
     out = recently_viewed(req)
     recs = out['recently_viewed_products']
-    assert [p.id for p in recs] == [p2.id, p3.id, p1.id]
+    assert [p["pk"] for p in recs] == [p2.id, p3.id, p1.id]
 
 
 def test_recommendations_data_anonymous_and_cache(monkeypatch):
@@ -74,7 +76,8 @@ def test_recommendations_data_anonymous_and_cache(monkeypatch):
     recs1 = data1['recommended_products']
     # оба должны попасть в результаты
     assert set(p.id for p in recs1) == {a.id, b.id}
-    assert cache.get("recommended_products_cache") is not None
+    # рейтинг популярных построен задачей (eager) при первом обращении
+    assert set(get_leaderboard().top(GLOBAL_BOARD, 10)) == {a.id, b.id}
 
     # второй вызов — читаем из кеша, delay не должен вызываться
     monkeypatch.setattr(find_recommended_products_for_user, 'delay',
@@ -98,11 +101,19 @@ def test_recommendations_data_authenticated_triggers_task(monkeypatch):
     monkeypatch.setattr(find_recommended_products_for_user, 'delay', fake_delay)
 
     data = recommendations_data(req)
+    # пока шаблон не обратился к рекомендациям, задача не ставится
+    assert called == {}
+    list(data['recommended_products'])
     # проверяем, что задача запущена именно с нашими аргументами
     assert called['args'] == (req.user.pk, [1, 2, 3])
     # и при этом возвращается общий кешенный список
     assert 'recommended_products' in data
 
+    # повторные показы страниц в пределах окна не ставят задачу снова
+    called.clear()
+    list(recommendations_data(req)['recommended_products'])
+    assert called == {}
+
 
 def test_find_recommended_products_for_user_caches_only_candidates(product_factory, user):
     cache.clear()
@@ -121,9 +132,55 @@ def test_find_recommended_products_for_user_caches_only_candidates(product_facto
     # запускаем задачу
     find_recommended_products_for_user(user.pk, viewed)
 
-    key = f"recommended_products_cache_user_{user.pk}"
+    key = recommendations_key(interactions_fingerprint([p1.id, p2.id]))
     cached = cache.get(key)
-    # единственным кандидатом остаётся p3
-    assert isinstance(cached, list)
-    assert len(cached) == 1
-    assert cached[0].id == p3.id
+    # единственным кандидатом остаётся p3; в кеше — только id
+    assert cached == [p3.id]
+
+
+def test_users_with_same_history_share_recommendations(monkeypatch, product_factory, user):
+    p1 = product_factory("P1", None)
+    p2 = product_factory("P2", None)
+    other = get_user_model().objects.create_user("other", "other@e", "p")
+    cache.set(recommendations_key(interactions_fingerprint([p1.id])), [p2.id])
+    monkeypatch.setattr(find_recommended_products_for_user, 'delay',
+                        lambda *args, **kwargs: (_ for _ in ()).throw(AssertionError("delay shouldn't be called")))
+
+    for customer in (user, other):
+        req = _get_request_with_session(user=customer)
+        req.session['recently_viewed'] = [p1.id]
+        assert list(recommendations_data(req)['recommended_products']) == [p2]
+
+
+def test_new_view_changes_fingerprint_and_triggers_task(monkeypatch, product_factory, user):
+    p1 = product_factory("P1", None)
+    p2 = product_factory("P2", None)
+    p3 = product_factory("P3", None)
+    cache.set(recommendations_key(interactions_fingerprint([p1.id])), [p3.id])
+    called = []
+    monkeypatch.setattr(find_recommended_products_for_user, 'delay', lambda pk, viewed: called.append(viewed))
+
+    req = _get_request_with_session(user=user)
+    req.session['recently_viewed'] = [p2.id, p1.id]
+    list(recommendations_data(req)['recommended_products'])
+    assert called == [[p2.id, p1.id]]
+
+
+def test_cached_ids_hydrated_with_one_query(django_assert_num_queries, product_factory, user):
+    products = [product_factory(f"P{i}", None) for i in range(3)]
+    ids = [products[2].id, products[0].id]
+    cache.set(recommendations_key(interactions_fingerprint([products[1].id])), ids)
+    req = _get_request_with_session(user=user)
+    req.session['recently_viewed'] = [products[1].id]
+    get_purchased_product_ids(user.pk)
+
+    with django_assert_num_queries(1):
+        assert list(recommendations_data(req)['recommended_products']) == [products[2], products[0]]
+
+
+def test_new_order_resets_purchases_fingerprint(product_factory, user):
+    p1 = product_factory("P1", None)
+    assert get_purchased_product_ids(user.pk) == []
+    order = Order.objects.create(user=user, status='new', amount=p1.price)
+    OrderItem.objects.create(order=order, product=p1, quantity=1, price=p1.price)
+    assert get_purchased_product_ids(user.pk) == [p1.id]
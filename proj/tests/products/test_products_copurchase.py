@@ -0,0 +1,89 @@
+from io import StringIO
+
+import pytest
+from cart.models import Order, OrderItem
+from django.core.management import call_command
+from products.copurchase import build_copurchase_model, paid_purchase_rows
+from products.recommendations import (
+    compute_product_neighbors, evaluate_hit_rate, get_copurchase_model, rebuild_copurchase_model,
+    rebuild_recommendation_model, recommend_from_neighbors,
+)
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def buy():
+    def make(customer, *products, paid=True):
+        order = Order.objects.create(user=customer, status='new', amount=0, paid=paid)
+        for product in products:
+            OrderItem.objects.create(order=order, product=product, quantity=1, price=product.price)
+        return order
+    return make
+
+
+@pytest.fixture
+def catalog(product_factory):
+    return {
+        "rifle": product_factory("Sniper rifle", price=100.0),
+        "balls": product_factory("Airsoft balls", price=5.0),
+        "scope": product_factory("Sniper scope", price=100.0),
+    }
+
+
+def test_copurchase_similarity_from_paid_orders(user, catalog, buy):
+    buy(None, catalog["rifle"], catalog["balls"])
+    buy(user, catalog["rifle"])
+    buy(user, catalog["balls"])
+    buy(user, catalog["rifle"], catalog["scope"], paid=False)
+
+    model = build_copurchase_model(paid_purchase_rows())
+    rifle, balls = model.positions[catalog["rifle"].id], model.positions[catalog["balls"].id]
+    assert catalog["scope"].id not in model.positions
+    assert model.similarity[rifle, balls] == pytest.approx(1.0)
+    assert model.similarity[rifle, rifle] == 0
+
+    scores = model.scores_many([[catalog["rifle"].id], [999]], [catalog["balls"].id, catalog["scope"].id])
+    assert scores.ravel().tolist() == pytest.approx([1.0, 0.0, 0.0, 0.0])
+
+
+def test_copurchase_blended_with_content_score(user, catalog, buy):
+    buy(None, catalog["rifle"], catalog["balls"])
+    content = rebuild_recommendation_model()
+    copurchase = rebuild_copurchase_model()
+    assert get_copurchase_model().positions == copurchase.positions
+
+    candidates = [catalog["balls"].id, catalog["scope"].id]
+    assert content.recommend([catalog["rifle"].id], candidates, limit=1) == [catalog["scope"].id]
+    assert content.recommend([catalog["rifle"].id], candidates, limit=1, copurchase=copurchase,
+                             copurchase_weight=0.8) == [catalog["balls"].id]
+
+
+def test_copurchase_blended_into_neighbor_lists(user, catalog, buy):
+    buy(None, catalog["rifle"], catalog["balls"])
+    compute_product_neighbors()
+    copurchase = rebuild_copurchase_model()
+
+    candidates = [catalog["balls"].id, catalog["scope"].id]
+    assert recommend_from_neighbors([catalog["rifle"].id], candidates, limit=1) == [catalog["scope"].id]
+    # шарики не похожи на винтовку по описанию, но их покупают вместе
+    assert recommend_from_neighbors([catalog["rifle"].id], candidates, limit=1, copurchase=copurchase,
+                                    copurchase_weight=0.8) == [catalog["balls"].id]
+
+
+def test_hit_rate_on_held_out_last_purchase(user, django_user_model, catalog, buy):
+    other = django_user_model.objects.create_user(username="other", email="other@example.com", password="secret")
+    for _ in range(2):
+        buy(None, catalog["rifle"], catalog["balls"])
+    for customer in (user, other):
+        buy(customer, catalog["rifle"])
+        buy(customer, catalog["balls"])
+    compute_product_neighbors()
+
+    hit_rates, users = evaluate_hit_rate([0.0, 1.0], k=1)
+    assert users == 2
+    assert hit_rates == {0.0: 0.0, 1.0: 1.0}
+
+    out = StringIO()
+    call_command("evaluate_recommendations", "--weights", "0", "1", "--k", "1", stdout=out)
+    assert "hit rate@1 = 1.000" in out.getvalue()
@@ -0,0 +1,95 @@
+import pytest
+from cart import payments
+from cart.models import Order, OrderItem
+from products.leaderboard import (
+    get_leaderboard, get_popular_products, rebuild_popular_leaderboards, category_board, shop_board, GLOBAL_BOARD,
+)
+from products.models import Review
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def rated(user, product_factory):
+    def make(name, category=None, rating=5, **extras):
+        product = product_factory(name, category, **extras)
+        Review.objects.create(product=product, user=user, rating=rating)
+        return product
+    return make
+
+
+def test_rebuild_fills_global_category_and_shop_boards(shop, category_tree, rated):
+    top = rated("Top", category_tree["grand"], order_count=5)
+    second = rated("Second", category_tree["root"], order_count=2)
+    rated("Low rating", category_tree["root"], rating=3, order_count=10)
+
+    assert rebuild_popular_leaderboards() == 2
+    leaderboard = get_leaderboard()
+    assert leaderboard.top(GLOBAL_BOARD, 10) == [top.id, second.id]
+    assert leaderboard.top(category_board(category_tree["root"].id), 10) == [top.id, second.id]
+    assert leaderboard.top(shop_board(shop.id), 1) == [top.id]
+
+
+def test_paid_order_moves_product_up(shop, user, rated, django_capture_on_commit_callbacks):
+    first = rated("First", order_count=2)
+    second = rated("Second")
+    rebuild_popular_leaderboards()
+
+    def pay_for(product):
+        order = Order.objects.create(user=user, shop=shop, status='new', amount=product.price)
+        OrderItem.objects.create(order=order, product=product, quantity=1, price=product.price)
+        with django_capture_on_commit_callbacks(execute=True):
+            payments.confirm_order_payment(order.id)
+        return order
+
+    order = pay_for(second)
+    with django_capture_on_commit_callbacks(execute=True):
+        payments.confirm_order_payment(order.id)  # повторное подтверждение не учитывается
+    assert [p.id for p in get_popular_products()] == [first.id, second.id]
+
+    pay_for(second)
+    pay_for(second)
+    assert [p.id for p in get_popular_products()] == [second.id, first.id]
+
+
+def test_rolled_back_payment_is_counted_once_on_retry(monkeypatch, shop, user, rated,
+                                                      django_capture_on_commit_callbacks):
+    other = rated("Other", order_count=3)
+    product = rated("P", order_count=1)
+    rebuild_popular_leaderboards()
+    order = Order.objects.create(user=user, shop=shop, status='new', amount=product.price)
+    OrderItem.objects.create(order=order, product=product, quantity=1, price=product.price)
+
+    add_to_report = payments.add_order_to_sales_report
+
+    def fail_once(order):
+        monkeypatch.setattr(payments, 'add_order_to_sales_report', add_to_report)
+        raise RuntimeError("report is unavailable")
+
+    monkeypatch.setattr(payments, 'add_order_to_sales_report', fail_once)
+    with django_capture_on_commit_callbacks(execute=True):
+        with pytest.raises(RuntimeError):
+            payments.confirm_order_payment(order.id)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        assert payments.confirm_order_payment(order.id)
+    product.refresh_from_db()
+    assert product.order_count == 2
+    # при двойном учете товар сравнялся бы с Other (3) и обогнал его по id
+    assert [p.id for p in get_popular_products()] == [other.id, product.id]
+
+
+def test_reviews_and_visibility_update_leaderboard(user, rated):
+    product = rated("P")
+    rebuild_popular_leaderboards()
+    assert get_popular_products() == [product]
+
+    Review.objects.create(product=product, user=user, rating=1)
+    assert get_popular_products() == []
+
+    Review.objects.filter(rating=1).delete()
+    assert get_popular_products() == [product]
+
+    product.show = False
+    product.save()
+    assert get_popular_products() == []
@@ -0,0 +1,72 @@
+import pytest
+from django.core.paginator import Page
+from django.http import QueryDict
+
+from products.models import Product
+from products.pagination import _encode_cursor, paginate_products
+
+pytestmark = pytest.mark.django_db
+
+
+def _page(request_factory, params):
+    req = request_factory.get("/", params)
+    return paginate_products(req, Product.objects.all().order_by("price"))
+
+
+def test_keyset_pages_forward_and_back(settings, request_factory, product_factory):
+    settings.PRODUCT_KEYSET_PAGINATION = True
+    # одинаковые цены: порядок внутри страницы держится на pk
+    products = [product_factory(f"p{i}", price=float(i // 2)) for i in range(5)]
+
+    first = _page(request_factory, {"prod_count": 2})
+    assert first.is_keyset
+    assert list(first) == products[:2]
+    assert first.has_next() and not first.has_previous()
+
+    second = _page(request_factory, QueryDict(first.next_page_query))
+    assert list(second) == products[2:4]
+    assert second.has_next() and second.has_previous()
+
+    third = _page(request_factory, QueryDict(second.next_page_query))
+    assert list(third) == products[4:]
+    assert not third.has_next()
+
+    back = _page(request_factory, QueryDict(third.previous_page_query))
+    assert list(back) == products[2:4]
+    assert back.has_previous()
+
+    assert "prod_count=2" in back.first_page_query
+    assert "cursor" not in back.first_page_query
+
+
+def test_keyset_ignores_broken_cursor(settings, request_factory, product_factory):
+    settings.PRODUCT_KEYSET_PAGINATION = True
+    p = product_factory("p")
+
+    page = _page(request_factory, {"cursor": "не-курсор"})
+    assert list(page) == [p]
+
+
+@pytest.mark.parametrize("sort_by, value", [
+    ("price", "not a number"),
+    ("price", None),
+    ("pub_date", "yesterday"),
+    ("pub_date", [2024, 1, 1]),
+])
+def test_keyset_ignores_tampered_cursor_value(settings, request_factory, product_factory, sort_by, value):
+    settings.PRODUCT_KEYSET_PAGINATION = True
+    products = [product_factory(f"p{i}", price=float(i)) for i in range(3)]
+    cursor = _encode_cursor(value, products[0].pk, "next")
+
+    req = request_factory.get("/", {"prod_count": 2, "cursor": cursor})
+    page = paginate_products(req, Product.objects.all().order_by(sort_by, "pk"))
+    assert list(page) == list(Product.objects.order_by(sort_by, "pk")[:2])
+    assert not page.has_previous()
+
+
+def test_offset_paginator_when_keyset_disabled(settings, request_factory, product_factory):
+    settings.PRODUCT_KEYSET_PAGINATION = False
+    product_factory("p")
+
+    page = _page(request_factory, {"page": 1})
+    assert isinstance(page, Page)
@@ -0,0 +1,81 @@
+import pytest
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.cache import cache
+from django.urls import reverse
+from products.models import RecentlyViewed, Review
+from products.recently_viewed import get_product_cards, add_recently_viewed, RECENTLY_VIEWED_LIMIT, SESSION_KEY
+
+pytestmark = pytest.mark.django_db
+
+
+def _view(client, product):
+    return client.get(reverse('product_detail', args=[product.pk]))
+
+
+def test_views_move_product_to_front_and_limit_list(client, product_factory):
+    products = [product_factory(f"P{i}") for i in range(RECENTLY_VIEWED_LIMIT + 2)]
+    for product in products:
+        _view(client, product)
+    _view(client, products[5])
+
+    expected = [products[5].pk] + [p.pk for p in reversed(products) if p != products[5]]
+    assert client.session['recently_viewed'] == expected[:RECENTLY_VIEWED_LIMIT]
+
+
+def test_session_not_modified_when_order_unchanged(request_factory, product_factory):
+    first, second = product_factory("First"), product_factory("Second")
+    request = request_factory.get('/')
+    SessionMiddleware(get_response=lambda r: None).process_request(request)
+    request.user = AnonymousUser()
+    request.session[SESSION_KEY] = [first.pk, second.pk]
+    request.session.save()
+    request.session.modified = False
+
+    add_recently_viewed(request, first.pk)
+    assert not request.session.modified
+
+    add_recently_viewed(request, second.pk)
+    assert request.session.modified
+    assert request.session[SESSION_KEY] == [second.pk, first.pk]
+
+
+def test_cards_cached_per_product_and_reset_on_change(user, product_factory, django_assert_num_queries):
+    first = product_factory("First", price=10.0)
+    second = product_factory("Second", price=20.0)
+    with django_assert_num_queries(1):
+        cards = get_product_cards([second.pk, first.pk, 999])
+    assert [card['name'] for card in cards] == ["Second", "First"]
+    assert cards[0]['image_url'] == second.image6.url
+
+    with django_assert_num_queries(0):
+        get_product_cards([first.pk, second.pk])
+
+    first.price = 15.0
+    first.save()
+    Review.objects.create(product=second, user=user, rating=4)
+    cards = get_product_cards([first.pk, second.pk])
+    assert cards[0]['price'] == 15.0
+    assert (cards[1]['avg_rating'], cards[1]['review_count']) == (4.0, 1)
+    assert cache.get(f"product_card_{first.pk}") == cards[0]
+
+
+def test_list_follows_user_across_devices(client, user, product_factory, settings):
+    settings.RECENTLY_VIEWED_PERSIST = True
+    seen_on_phone, seen_anonymously = product_factory("Phone"), product_factory("Anonymous")
+    client.force_login(user)
+    _view(client, seen_on_phone)
+    assert RecentlyViewed.objects.get(user=user).product_ids == [seen_on_phone.pk]
+
+    laptop = client.__class__()
+    _view(laptop, seen_anonymously)
+    laptop.force_login(user)
+    assert laptop.session['recently_viewed'] == [seen_anonymously.pk, seen_on_phone.pk]
+    assert RecentlyViewed.objects.get(user=user).product_ids == [seen_anonymously.pk, seen_on_phone.pk]
+
+
+def test_list_not_persisted_when_disabled(client, user, product_factory, settings):
+    settings.RECENTLY_VIEWED_PERSIST = False
+    client.force_login(user)
+    _view(client, product_factory("P"))
+    assert not RecentlyViewed.objects.exists()
@@ -0,0 +1,261 @@
+import os
+from datetime import timedelta
+from io import StringIO
+
+import pytest
+from scipy.sparse import diags
+from cart.models import Order, OrderItem
+from django.core.cache import cache
+from django.core.management import call_command
+from django.utils import timezone
+from django.urls import reverse
+from products import recommendations
+from products.models import Product, ProductNeighbor, RecentlyViewed
+from products.recommendations import (
+    get_recommendation_model, rebuild_recommendation_model, refresh_recommendation_model, compute_product_neighbors,
+    get_similar_products, recommend_from_neighbors, compute_active_users_recommendations, interactions_fingerprint,
+    recommendations_key,
+)
+from products.tasks import find_recommended_products_for_user
+
+pytestmark = pytest.mark.django_db
+
+
+def test_model_saved_and_loaded(recommendations_model_path, product_factory):
+    rifle = product_factory("Sniper rifle", price=100.0)
+    product_factory("Rifle scope", price=110.0)
+    product_factory("Tactical gloves", price=10.0)
+
+    rebuild_recommendation_model()
+    assert os.path.exists(recommendations_model_path)
+
+    model = get_recommendation_model()
+    assert set(model.positions) == set(Product.objects.values_list("pk", flat=True))
+    assert model.recommend([rifle.id], [p.id for p in Product.objects.exclude(pk=rifle.pk)], limit=1) == [
+        Product.objects.get(name="Rifle scope").id
+    ]
+
+
+def test_incremental_refresh(product_factory):
+    rifle = product_factory("Sniper rifle", price=100.0)
+    gloves = product_factory("Tactical gloves", price=10.0)
+    rebuild_recommendation_model()
+
+    scope = product_factory("Rifle scope", price=100.0)
+    gloves.name = "Rifle gloves"
+    gloves.save()
+    rifle_id = rifle.id
+    rifle.delete()
+
+    model = refresh_recommendation_model()
+    assert set(model.positions) == {gloves.id, scope.id}
+    # измененный товар векторизован заново по текущему словарю
+    row = model.tfidf[model.positions[gloves.id]]
+    assert row[0, model.vocabulary.index("rifle")] > 0
+    assert get_recommendation_model().positions.keys() == model.positions.keys()
+    assert rifle_id not in get_recommendation_model().positions
+
+
+class FakeRedisSets:
+    """Множества Redis для отметок измененных товаров."""
+
+    def __init__(self):
+        self.sets = {}
+
+    def sadd(self, key, *members):
+        self.sets.setdefault(key, set()).update(str(member).encode() for member in members)
+
+    def smembers(self, key):
+        return set(self.sets.get(key, set()))
+
+    def delete(self, key):
+        return int(self.sets.pop(key, None) is not None)
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    """Команды копятся и выполняются подряд при execute(), как в MULTI/EXEC."""
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        command = getattr(self.client, name)
+        return lambda *args: self.commands.append((command, args))
+
+    def execute(self):
+        return [command(*args) for command, args in self.commands]
+
+
+def test_changed_products_collected_in_redis_set(monkeypatch, product_factory):
+    client = FakeRedisSets()
+    monkeypatch.setattr(recommendations, "_redis_client", lambda: client)
+    rifle = product_factory("Sniper rifle", price=100.0)
+    gloves = product_factory("Tactical gloves", price=10.0)
+    rebuild_recommendation_model()
+    assert not client.sets
+
+    gloves.name = "Rifle gloves"
+    gloves.save()
+    rifle.save()
+    assert client.sets[recommendations.CHANGED_PRODUCTS_KEY] == {str(gloves.id).encode(), str(rifle.id).encode()}
+
+    model = refresh_recommendation_model()
+    assert model.tfidf[model.positions[gloves.id], model.vocabulary.index("rifle")] > 0
+    assert not client.sets
+
+    # обновление упало — отметки возвращаются в множество
+    gloves.save()
+    monkeypatch.setattr(recommendations.RecommendationModel, "with_products",
+                        lambda *args: (_ for _ in ()).throw(RuntimeError()))
+    with pytest.raises(RuntimeError):
+        refresh_recommendation_model()
+    assert client.sets[recommendations.CHANGED_PRODUCTS_KEY] == {str(gloves.id).encode()}
+
+
+def test_refresh_without_model_builds_it(product_factory):
+    product_factory("Mask")
+    assert get_recommendation_model() is None
+    model = refresh_recommendation_model()
+    assert len(model.product_ids) == 1
+
+
+def test_neighbors_computed_in_blocks(product_factory):
+    rifle = product_factory("Sniper rifle", price=100.0)
+    scope = product_factory("Sniper rifle scope", price=100.0)
+    gloves = product_factory("Tactical gloves", price=10.0)
+    product_factory("Out of stock rifle", items_left=0)
+
+    links = compute_product_neighbors(k=1, block_size=2)
+    assert links == 2
+    assert get_similar_products(rifle.id) == [scope]
+    assert get_similar_products(scope.id) == [rifle]
+    # ни общих слов, ни близкой цены — похожих нет
+    assert not ProductNeighbor.objects.filter(product=gloves).exists()
+
+
+def test_neighbor_block_keeps_only_pairs_with_common_words(product_factory):
+    products = [product_factory("Sniper rifle", price=100.0), product_factory("Sniper scope", price=50.0),
+                product_factory("Tactical gloves", price=10.0), product_factory("Airsoft mask", price=30.0)]
+    model = rebuild_recommendation_model()
+    rows = [model.positions[p.id] for p in products]
+    features = (diags(1.0 / model.norms[rows]) @ model.features[rows]).tocsr()
+
+    similarities = recommendations._neighbor_similarities(features[:, :-1].tocsr(),
+                                                          features[:, -1].toarray().ravel(), 0, 4)
+    # цена ненулевая у трех товаров из четырех, но в блоке только сами товары и пара с общим словом
+    assert similarities.nnz == 4 + 2
+    assert similarities[0, 1] == pytest.approx((features[0] @ features[1].T)[0, 0])
+    assert similarities[2, 3] == 0
+
+
+def test_neighbors_recomputed_per_product(product_factory):
+    rifle = product_factory("Sniper rifle", price=100.0)
+    scope = product_factory("Sniper rifle scope", price=100.0)
+    sling = product_factory("Sniper rifle sling", price=90.0)
+
+    def links():
+        return set(ProductNeighbor.objects.values_list("product_id", "neighbor_id", "rank"))
+
+    compute_product_neighbors(k=2, block_size=100)
+    whole = links()
+    compute_product_neighbors(k=2, block_size=1)
+    assert links() == whole and len(whole) == 6
+
+    # товар закончился: его список удален, а из чужих списков он пропадает при их пересчете
+    Product.objects.filter(pk=sling.pk).update(items_left=0)
+    assert compute_product_neighbors(k=2, block_size=1) == 2
+    assert links() == {(rifle.id, scope.id, 1), (scope.id, rifle.id, 1)}
+
+
+def test_user_recommendations_merge_neighbor_lists(user, product_factory):
+    rifle = product_factory("Sniper rifle", price=100.0)
+    scope = product_factory("Sniper rifle scope", price=100.0)
+    product_factory("Tactical gloves", price=10.0)
+    compute_product_neighbors()
+
+    assert recommend_from_neighbors([rifle.id], [scope.id], limit=10) == [scope.id]
+    find_recommended_products_for_user(user.pk, [rifle.id])
+    assert cache.get(recommendations_key(interactions_fingerprint([rifle.id])))[0] == scope.id
+
+
+def test_product_detail_shows_similar_products(client, product_factory):
+    rifle = product_factory("Sniper rifle", price=100.0)
+    scope = product_factory("Sniper rifle scope", price=100.0)
+    compute_product_neighbors()
+
+    resp = client.get(reverse("product_detail", args=[rifle.id]))
+    assert resp.context["similar_products"] == [scope]
+    assert "Похожие товары" in resp.content.decode()
+
+
+def test_recommend_many_matches_single_user_scoring(product_factory):
+    rifle = product_factory("Sniper rifle", price=100.0)
+    scope = product_factory("Sniper rifle scope", price=100.0)
+    gloves = product_factory("Tactical gloves", price=10.0)
+    mask = product_factory("Tactical mask", price=12.0)
+    model = rebuild_recommendation_model()
+    candidates = [rifle.id, scope.id, gloves.id, mask.id]
+    interactions = {1: [rifle.id], 2: [gloves.id], 3: [rifle.id, gloves.id], 4: [999]}
+
+    blocks = list(model.recommend_many(interactions, candidates, limit=2, block_size=2))
+    assert len(blocks) == 2
+    result = {user: ids for block in blocks for user, ids in block.items()}
+    # пользователь без известных модели товаров пропущен
+    assert set(result) == {1, 2, 3}
+    for user, ids in result.items():
+        others = [pk for pk in candidates if pk not in interactions[user]]
+        assert ids == model.recommend(interactions[user], others, limit=2)
+    assert result[1][0] == scope.id
+    assert result[2][0] == mask.id
+
+
+def test_active_users_recommendations_cached(user, django_user_model, product_factory):
+    rifle = product_factory("Sniper rifle", price=100.0)
+    scope = product_factory("Sniper rifle scope", price=100.0)
+    gloves = product_factory("Tactical gloves", price=10.0)
+    same_history = django_user_model.objects.create_user(username="same", email="same@example.com",
+                                                         password="secret")
+    inactive = django_user_model.objects.create_user(username="inactive", email="inactive@example.com",
+                                                     password="secret")
+    for customer, product in ((user, rifle), (same_history, rifle), (inactive, gloves)):
+        order = Order.objects.create(user=customer, status='new', amount=product.price)
+        OrderItem.objects.create(order=order, product=product, quantity=1, price=product.price)
+    Order.objects.filter(user=inactive).update(created=timezone.now() - timedelta(days=60))
+
+    # одинаковая история считается один раз, неактивный пользователь пропущен
+    assert compute_active_users_recommendations(days=30) == 1
+    assert cache.get(recommendations_key(interactions_fingerprint([rifle.id])))[0] == scope.id
+    assert cache.get(recommendations_key(interactions_fingerprint([gloves.id]))) is None
+
+
+def test_batch_recommendations_match_served_ones(user, product_factory):
+    rifle = product_factory("Sniper rifle", price=100.0)
+    scope = product_factory("Sniper rifle scope", price=100.0)
+    mask = product_factory("Airsoft mask", price=30.0)
+    product_factory("Airsoft mask strap", price=5.0)
+    product_factory("Tactical gloves", price=10.0)
+    compute_product_neighbors()
+    order = Order.objects.create(user=user, status='new', amount=rifle.price)
+    OrderItem.objects.create(order=order, product=rifle, quantity=1, price=rifle.price)
+    # просмотры из БД входят в отпечаток так же, как просмотры сессии на сайте
+    RecentlyViewed.objects.create(user=user, product_ids=[mask.id])
+    key = recommendations_key(interactions_fingerprint([rifle.id, mask.id]))
+
+    assert compute_active_users_recommendations(days=30) == 1
+    batch = cache.get(key)
+    assert batch[0] == scope.id and rifle.id not in batch and mask.id not in batch
+
+    cache.delete(key)
+    find_recommended_products_for_user(user.pk, [mask.id])
+    assert cache.get(key) == batch
+
+
+def test_benchmark_command_reports_throughput():
+    out = StringIO()
+    call_command("benchmark_recommendations", "--products", "300", "--users", "40", "--vocabulary", "50",
+                 "--sample", "5", stdout=out)
+    assert "300 товаров: пакетно" in out.getvalue()
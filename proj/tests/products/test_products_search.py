@@ -0,0 +1,41 @@
+import pytest
+from products.search import get_search_backend, InvertedIndexSearchBackend
+from products.services import get_filtered_products_from_all
+
+pytestmark = pytest.mark.django_db
+
+
+def test_default_backend_for_sqlite():
+    assert isinstance(get_search_backend(), InvertedIndexSearchBackend)
+
+
+def test_search_covers_brand_and_category_titles(category_tree, product_factory):
+    by_brand = product_factory("Маска", brand="Ёжик")
+    by_category = product_factory("Очки", category_tree["grand"])
+
+    backend = get_search_backend()
+    assert set(backend.search("ежик")) == {by_brand.id}
+    assert set(backend.search("gra")) == {by_category.id}
+
+
+def test_search_index_follows_product_and_category_changes(category_tree, product_factory):
+    p = product_factory("Старое название", category_tree["child"])
+    backend = get_search_backend()
+    assert set(backend.search("стар")) == {p.id}
+
+    p.name = "Новое название"
+    p.save()
+    assert backend.search("стар") == {}
+    assert set(backend.search("нов")) == {p.id}
+
+    category_tree["child"].title = "Глушители"
+    category_tree["child"].save()
+    assert set(backend.search("глушит")) == {p.id}
+
+
+def test_search_results_ranked_by_relevance(request_factory, product_factory):
+    weak = product_factory("Привод", brand="Cyma")
+    strong = product_factory("Cyma Cyma привод", brand="Cyma")
+
+    req = request_factory.get("/", {"q": "cyma"})
+    assert list(get_filtered_products_from_all(req, "cyma")) == [strong, weak]
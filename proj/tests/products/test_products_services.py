@@ -3,11 +3,11 @@ from django.core.cache import cache
 from products.services import (
     find_shop_categories,
     get_filtered_products_from_all,
-    get_all_products_filters,
+    get_all_products_facets,
     get_category_filtered_products,
-    get_category_filters,
+    get_category_facets,
     get_shop_filtered_products,
-    get_shop_category_filters,
+    get_shop_category_facets,
 )
 
 pytestmark = pytest.mark.django_db
@@ -46,23 +46,42 @@ def test_get_filtered_products_from_all(request_factory, category_tree, product_
     assert ids == {p3.id}
 
 
-def test_get_all_products_filters(category_tree, product_factory):
+def _facet(facets, name):
+    return next(f for f in facets.choices if f.name == name)
+
+
+def test_get_all_products_facets(request_factory, category_tree, product_factory):
     # товары с разными price, length, diameter
     product_factory("A", category_tree["root"], price=1.2, length=10, diameter=0.5)
     product_factory("B", category_tree["root"], price=3.4, length=20, diameter=1.5)
 
-    data = get_all_products_filters(keyword=None)
+    facets = get_all_products_facets(None, request_factory.get("/"))
     # Проверяем агрегаты
-    pr = data["price_data_for_filters"]
-    assert pr["price__min"] == 1.2
-    assert pr["price__max"] == 3.4
+    assert facets.price.min == 1.2
+    assert facets.price.max == 3.4
+
+    assert facets.length.min == 10
+    assert facets.length.max == 20
+
+    diams = {v.value: v.count for v in _facet(facets, "diameter").values}
+    assert diams == {0.5: 1, 1.5: 1}
+
+
+def test_facet_counts_follow_applied_filters(request_factory, category_tree, product_factory):
+    product_factory("A", category_tree["root"], product_type="mask", weight=0.2)
+    product_factory("B", category_tree["root"], product_type="mask", weight=0.25)
+    product_factory("C", category_tree["root"], product_type="sight", weight=0.25)
 
-    ln = data["length_data_for_filters"]
-    assert ln["length__min"] == 10
-    assert ln["length__max"] == 20
+    req = request_factory.get("/", {"product_type": "mask"})
+    facets = get_all_products_facets(None, req)
 
-    diams = {d["diameter"] for d in data["diameter_data_for_filters"]}
-    assert diams == {0.5, 1.5}
+    # собственный фильтр фасета не сужает его значения
+    types = {v.value: (v.count, v.selected) for v in _facet(facets, "product_type").values}
+    assert types == {"mask": (2, True), "sight": (1, False)}
+    # остальные фасеты считаются только по товарам типа "mask"
+    weights = {v.value: v.count for v in _facet(facets, "weight").values}
+    assert weights == {0.2: 1, 0.25: 1}
+    assert facets.total == 2
 
 
 def test_get_category_filtered_products(request_factory, category_tree, product_factory):
@@ -84,16 +103,15 @@ def test_get_category_filtered_products(request_factory, category_tree, product_
     assert list(qs2) == [a]
 
 
-def test_get_category_filters(category_tree, product_factory):
+def test_get_category_facets(request_factory, category_tree, product_factory):
     product_factory("M1", category_tree["child"], weight=10, principle_of_operation="op1")
     product_factory("M2", category_tree["child"], weight=20, principle_of_operation="op2")
 
-    data = get_category_filters(category_tree["child"])
-    weights = {w["weight"] for w in data["weight_data_for_filters"]}
+    facets = get_category_facets(category_tree["child"], request_factory.get("/"))
+    weights = {v.value for v in _facet(facets, "weight").values}
     assert weights == {10, 20}
 
-    pr = data["price_data_for_filters"]
-    assert pr["price__min"] <= pr["price__max"]
+    assert facets.price.min <= facets.price.max
 
 
 def test_get_shop_filtered_and_category_filters(
@@ -112,6 +130,5 @@ def test_get_shop_filtered_and_category_filters(
     qs_shop2 = get_shop_filtered_products(category_tree["child"], shop, req2)
     assert list(qs_shop2) == [pA]
 
-    filt_data = get_shop_category_filters(category_tree["child"], shop)
-    pr = filt_data["price_data_for_filters"]
-    assert pr["price__min"] <= pr["price__max"]
+    facets = get_shop_category_facets(category_tree["child"], shop, req2)
+    assert facets.price.min <= facets.price.max
@@ -0,0 +1,54 @@
+import pytest
+from decimal import Decimal
+from django.core.management import call_command
+from django.contrib.auth import get_user_model
+from cart.models import Order, OrderItem
+from cart.payments import confirm_order_payment
+from products.models import Product, Review
+
+pytestmark = pytest.mark.django_db
+
+
+def _paid_order(user, product, paid=False, shop=None):
+    order = Order.objects.create(user=user, shop=shop, amount=Decimal(product.price), paid=paid)
+    OrderItem.objects.create(order=order, product=product, price=product.price, quantity=1)
+    return order
+
+
+def test_review_signals_update_rating(product_factory, user):
+    p = product_factory("Rated")
+    other = get_user_model().objects.create_user("u2", "u2@e", "pw")
+
+    r1 = Review.objects.create(product=p, user=user, rating=5)
+    Review.objects.create(product=p, user=other, rating=2)
+    p.refresh_from_db()
+    assert p.review_count == 2
+    assert p.avg_rating == 3.5
+
+    r1.delete()
+    p.refresh_from_db()
+    assert p.review_count == 1
+    assert p.avg_rating == 2
+
+
+def test_order_count_increases_once_on_payment(product_factory, user, shop):
+    p = product_factory("Ordered")
+    order = _paid_order(user, p, shop=shop)
+
+    confirm_order_payment(order.pk)
+    # повторное подтверждение (ретрай вебхука) не должно увеличивать счетчик
+    confirm_order_payment(order.pk)
+    p.refresh_from_db()
+    assert p.order_count == 1
+
+
+def test_rebuild_product_stats_command(product_factory, user):
+    p = product_factory("Rebuild")
+    Review.objects.create(product=p, user=user, rating=4)
+    _paid_order(user, p, paid=True)
+    _paid_order(user, p, paid=False)
+    Product.objects.filter(pk=p.pk).update(avg_rating=None, review_count=0, order_count=0)
+
+    call_command('rebuild_product_stats')
+    p.refresh_from_db()
+    assert (p.avg_rating, p.review_count, p.order_count) == (4, 1, 1)
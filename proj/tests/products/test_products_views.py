@@ -35,8 +35,8 @@ def test_all_products_context(client, category_tree, product_factory):
     assert ctx['keyword'] == 'X'
     assert ctx['sort_parameter'] == 'price'
     assert len(ctx['page_obj'].object_list) == 1
-    assert 'price_data_for_filters' in ctx
-    assert 'length_data_for_filters' in ctx
+    assert ctx['facets'].price.min == 10
+    assert ctx['facets'].length.min is None
 
 
 def test_categories_and_subcategories_context(client, category_tree):
@@ -66,7 +66,7 @@ def test_category_products_context(client, category_tree, product_factory):
     assert ctx['category'] == child
     assert list(ctx['page_obj'].object_list) == [p_direct]
     assert ctx['sort_parameter'] == '-pub_date'
-    assert 'price_data_for_filters' in ctx
+    assert 'facets' in ctx
 
 
 def test_shops_and_shop_categories_context(client, shop, category_tree, product_factory):
@@ -109,7 +109,7 @@ def test_shop_subcategories_and_products_context(client, shop, category_tree, pr
     assert ctx_prod['category'] == category_tree['child']
     assert 'page_obj' in ctx_prod
     assert ctx_prod['shop_info'] == {'bar': 2}
-    assert 'price_data_for_filters' in ctx_prod
+    assert 'facets' in ctx_prod
 
 
 def test_product_detail_and_reviews_context(client, user, order_with_item):